@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.urls import re_path
-from awards.models import Category, Award, YearAward, Nomination, FicEligibility
+from awards.models import Category, Award, YearAward, Nomination, FicEligibility, ResultsSnapshot
 from awards.views import YearAwardsMassEditView
 
 
@@ -38,8 +38,15 @@ class NominationAdmin(admin.ModelAdmin):
     ordering = ['-year', 'award']
 
 
+class ResultsSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('year', 'modified_date')
+    fields = ('year', 'modified_date')
+    readonly_fields = ('year', 'modified_date')
+
+
 admin.site.register(Category)
 admin.site.register(Award, AwardAdmin)
 admin.site.register(YearAward, YearAwardsAdmin)
 admin.site.register(FicEligibility)
 admin.site.register(Nomination, NominationAdmin)
+admin.site.register(ResultsSnapshot, ResultsSnapshotAdmin)
@@ -1,12 +1,11 @@
 from collections import defaultdict
 from django import forms
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.forms.formsets import BaseFormSet
-from django.forms.models import ModelChoiceIterator
 from django.utils.html import mark_safe
-from awards.models import Award, YearAward, Nomination, Vote, Phase, CURRENT_YEAR, check_eligible
+from awards.models import Award, YearAward, Nomination, Vote, Phase, check_all_eligible, check_eligible
 from forum.models import Member, MemberPage, Fic, FicPage
 from forum.forms import ForumLinkField, ForumObjectField, VerificationForm
 
@@ -94,24 +93,27 @@ class FicForm(forms.ModelForm):
 
 class NominationObjectSelect(forms.Select):
     """
-    A customized Select that restricts the actual choices given to
-    those already nominated this year and the given value (if it
-    exists).
+    A customized Select that only offers the selected fic/member (if
+    any) as a choice - the rest are found through the typeahead search
+    rather than being sent with every field. The formset fetches the
+    selected objects for all its forms at once and hands them over as
+    known_objects.
 
     """
     def __init__(self, object_class, *args, **kwargs):
         self.object_class = object_class
+        self.known_objects = {}
         super(NominationObjectSelect, self).__init__(*args, **kwargs)
 
     def optgroups(self, name, value, attrs=None):
-        groups = super(NominationObjectSelect, self).optgroups(name, value, attrs)
+        groups = [(None, [self.create_option(name, '', '---------', not any(value), 0, subindex=None, attrs=attrs)], 0)]
 
         for val in value:
-            if val and val not in (choice[0] for choice in self.choices):
-                # The defined value is not in the available choices - check if it's a valid fic/member
-                selected_object = self.object_class.objects.filter(pk=val).first()
+            if val:
+                selected_object = self.known_objects.get(str(val))
+                if selected_object is None:
+                    selected_object = self.object_class.objects.filter(pk=val).first()
                 if selected_object:
-                    # We have a submitted value that's the PK for a fic/member - include that fic/member as a choice
                     index = len(groups)
                     groups.append((None, [
                         self.create_option(
@@ -127,19 +129,18 @@ class NominationObjectSelect(forms.Select):
         return groups
 
 
-class NominationObjectIterator(ModelChoiceIterator):
+class NominationObjectChoiceField(forms.ModelChoiceField):
     """
-    A version of ModelChoiceIterator that limits the displayed choices
-    to those objects that have been nominated in the current year.
+    A ModelChoiceField that cleans to one of its known_objects without
+    going to the database, if it can.
 
     """
-    def __init__(self, field):
-        super(NominationObjectIterator, self).__init__(field)
-        self.queryset = self.queryset.nominated_in_year(CURRENT_YEAR)
-
+    known_objects = {}
 
-class NominationObjectChoiceField(forms.ModelChoiceField):
-    iterator = NominationObjectIterator
+    def to_python(self, value):
+        if value not in self.empty_values and str(value) in self.known_objects:
+            return self.known_objects[str(value)]
+        return super(NominationObjectChoiceField, self).to_python(value)
 
 
 class NominationObjectField(ForumObjectField):
@@ -150,11 +151,25 @@ class NominationObjectField(ForumObjectField):
     def get_object_field(self):
         return NominationObjectChoiceField(queryset=self.object_class.objects.all(), widget=NominationObjectSelect(self.object_class))
 
+    def set_known_objects(self, known_objects):
+        """
+        Gives the field the already fetched objects (by primary key, as
+        a string) that its value is likely to be one of.
+
+        """
+        self.fields[0].known_objects = known_objects
+        self.widget.widgets[0].known_objects = known_objects
+
+    # Whether the field checks the eligibility of its value itself;
+    # BaseNominationFormSet checks all its forms' values at once instead
+    check_eligibility = True
+
     def clean(self, value):
         value = super(NominationObjectField, self).clean(value)
 
         # Validate eligibility
-        check_eligible(value.get_page())
+        if self.check_eligibility:
+            check_eligible(value.get_page())
 
         return value
 
@@ -164,8 +179,8 @@ class NominationForm(forms.ModelForm):
     The form for a single nomination.
 
     """
-    nominee = NominationObjectField(MemberPage, help_text=u"Select the user from the drop-down or paste their profile URL into the text field.")
-    fic = NominationObjectField(FicPage, help_text=u"Select the fic from the drop-down or paste a link to it into the text field.")
+    nominee = NominationObjectField(MemberPage, help_text=u"Start typing their username or paste their profile URL into the text field.")
+    fic = NominationObjectField(FicPage, help_text=u"Start typing the fic's title or paste a link to it into the text field.")
 
     class Meta:
         model = Nomination
@@ -264,6 +279,7 @@ class BaseNominationFormSet(BaseFormSet):
     def __init__(self, year, member, user, *args, **kwargs):
         self.year = year
         self.member = member
+        self._known_objects = None
         super(BaseNominationFormSet, self).__init__(*args, **kwargs)
 
         if self.member:
@@ -293,11 +309,67 @@ class BaseNominationFormSet(BaseFormSet):
                     pass
                 self.initial.append(form_kwargs)
 
+    def get_known_objects(self):
+        """
+        Returns the fics and members that are selected in any of the
+        forms, whether already nominated or just submitted, as dicts by
+        primary key (as a string) keyed by field name. They're fetched
+        in one query each and shared by all the forms' fields.
+
+        """
+        if self._known_objects is None:
+            pks = {'fic': set(), 'nominee': set()}
+            for form_kwargs in self.initial:
+                instance = form_kwargs.get('instance')
+                if instance is not None:
+                    if instance.fic_id:
+                        pks['fic'].add(instance.fic_id)
+                    if instance.nominee_id:
+                        pks['nominee'].add(instance.nominee_id)
+            if self.is_bound:
+                for key, value in self.data.items():
+                    for field in pks:
+                        if key.startswith(self.prefix + '-') and key.endswith('-%s_0' % field) and value.isdigit():
+                            pks[field].add(int(value))
+            self._known_objects = {
+                'fic': {str(fic.pk): fic for fic in Fic.objects.filter(pk__in=pks['fic']).prefetch_related('authors')},
+                'nominee': {str(member.pk): member for member in Member.objects.filter(pk__in=pks['nominee'])},
+            }
+        return self._known_objects
+
     def _construct_form(self, i, **kwargs):
         defaults = self.initial[i]
         defaults['empty_permitted'] = True  # All forms are allowed to be empty
         defaults.update(**kwargs)
-        return super(BaseNominationFormSet, self)._construct_form(i, **defaults)
+        form = super(BaseNominationFormSet, self)._construct_form(i, **defaults)
+        for field, known_objects in self.get_known_objects().items():
+            if field in form.fields:
+                form.fields[field].set_known_objects(known_objects)
+                form.fields[field].check_eligibility = False
+            # So that existing nominations don't look their fic/nominee
+            # up again when the formset is cleaned
+            object_id = getattr(form.instance, '%s_id' % field)
+            if object_id is not None and str(object_id) in known_objects:
+                setattr(form.instance, field, known_objects[str(object_id)])
+        return form
+
+    def check_eligibility(self):
+        """
+        Checks the eligibility of everything nominated in the forms (that
+        have been changed) all at once, so that the fics that need to be
+        checked on the forum are checked concurrently rather than one
+        field at a time, and adds any errors to the fields as usual.
+
+        """
+        fields = []
+        for form in self.forms:
+            for field in ('fic', 'nominee'):
+                if form.cleaned_data.get(field) is not None:
+                    fields.append((form, field))
+        errors = check_all_eligible([form.cleaned_data[field].get_page() for form, field in fields])
+        for (form, field), error in zip(fields, errors):
+            if error is not None:
+                form.add_error(field, error)
 
     def clean(self):
         phase = Phase.get_current()
@@ -305,6 +377,7 @@ class BaseNominationFormSet(BaseFormSet):
             raise ValidationError(u"The nomination phase has ended! Better luck next year.")
         elif phase < 'nomination':
             raise ValidationError(u"The nomination phase hasn't started yet! Have patience until nominations open.")
+        self.check_eligibility()
         # By this point all nominations will have been saved to the
         # database, so we can safely assume they have PKs.
         fic_nominations = defaultdict(int)
@@ -348,10 +421,34 @@ class BaseNominationFormSet(BaseFormSet):
         return [form.save() for form in self.forms if form.has_changed()]
 
 
+class NominationChoiceField(forms.ChoiceField):
+    """
+    A choice between the given (already fetched) nominations, which
+    cleans to the chosen Nomination without going to the database.
+
+    """
+    def __init__(self, nominations, *args, **kwargs):
+        self.nominations = {str(nomination.pk): nomination for nomination in nominations}
+        empty_label = kwargs.pop('empty_label', u"---------")
+        kwargs['choices'] = lambda: [('', empty_label)] + [(pk, nomination.nomination_text()) for pk, nomination in self.nominations.items()]
+        super(NominationChoiceField, self).__init__(*args, **kwargs)
+
+    def valid_value(self, value):
+        return str(value) in self.nominations
+
+    def clean(self, value):
+        value = super(NominationChoiceField, self).clean(value)
+        return self.nominations.get(value)
+
+
 class VotingForm(forms.Form):
     """
     The full voting form.
 
+    The awards, their nominations (with the fics' authors) and the
+    member's current votes are all fetched up front, so the form takes
+    the same handful of queries however many awards there are.
+
     """
     def __init__(self, year, member, *args, **kwargs):
         self.year = year
@@ -359,15 +456,19 @@ class VotingForm(forms.Form):
 
         super(VotingForm, self).__init__(*args, **kwargs)
 
-        current_votes = {}
+        self.current_votes = {vote.award_id: vote for vote in Vote.objects.from_year(self.year).filter(member=self.member)}
 
-        for vote in Vote.objects.from_year(self.year).filter(member=self.member):
-            current_votes[vote.award_id] = vote.nomination
+        year_awards = list(YearAward.objects.from_year(year).select_related('award'))
+        awards = {year_award.award_id: year_award.award for year_award in year_awards}
+        nominations = defaultdict(list)
+        for nomination in Nomination.objects.from_year(year).filter(verified=True, award__in=awards).select_related('nominee', 'fic').prefetch_related('fic__authors').order_by('pk'):
+            nomination.award = awards[nomination.award_id]
+            nominations[nomination.award_id].append(nomination)
 
-        for year_award in YearAward.objects.from_year(year).select_related('award'):
-            nominations = year_award.get_nominations()
-            if nominations:
-                field = forms.ModelChoiceField(queryset=nominations, label=year_award.award.name, widget=forms.RadioSelect, empty_label="No vote", required=False, initial=current_votes.get(year_award.award_id))
+        for year_award in year_awards:
+            if nominations[year_award.award_id]:
+                current_vote = self.current_votes.get(year_award.award_id)
+                field = NominationChoiceField(nominations[year_award.award_id], label=year_award.award.name, widget=forms.RadioSelect, empty_label="No vote", required=False, initial=current_vote.nomination_id if current_vote else None)
                 field.award = year_award.award
                 self.fields['award_%s' % year_award.award.pk] = field
 
@@ -382,7 +483,7 @@ class VotingForm(forms.Form):
         for field in self.fields:
             vote = self.cleaned_data.get(field)
             if vote:
-                vote_obj = Vote(member=self.member, year=self.year, award_id=self.fields[field].award.pk, nomination=vote)
+                vote_obj = Vote(member=self.member, year=self.year, award=self.fields[field].award, nomination=vote)
                 try:
                     vote_obj.clean()
                 except ValidationError as e:
@@ -394,15 +495,14 @@ class VotingForm(forms.Form):
 
     def save(self, commit=True):
         votes = []
-        for year_award in YearAward.objects.from_year(self.year):
-            vote = self.cleaned_data.get('award_%s' % year_award.award_id)
+        for field in self.fields:
+            vote = self.cleaned_data.get(field)
             if vote:
-                try:
-                    vote_obj = Vote.objects.from_year(self.year).get(member=self.member, award_id=year_award.award_id)
-                except Vote.DoesNotExist:
-                    vote_obj = Vote(member=self.member, year=self.year, award_id=year_award.award_id)
-                vote_obj.nomination = vote
-                if commit:
-                    vote_obj.save()
-                votes.append(vote_obj)
+                votes.append(Vote(member=self.member, year=self.year, award=self.fields[field].award, nomination=vote))
+        if commit and votes:
+            # Insert the new votes and point existing ones at the new
+            # nominations in one go. Existing votes keep their verified
+            # status, as they did when they were saved one at a time.
+            with transaction.atomic():
+                Vote.objects.bulk_create(votes, update_conflicts=True, unique_fields=['member', 'award', 'year'], update_fields=['nomination'])
         return votes
@@ -0,0 +1,143 @@
+# -*- coding: utf8 -*-
+from __future__ import unicode_literals
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from unittest import mock
+from django.conf import settings
+from django.db import transaction
+from django.test.utils import override_settings
+from django.core.management.base import BaseCommand, CommandError
+from awards import models as awards_models
+from awards.models import fetch_thread_fic_eligibility, validate_fic_page, validate_thread_fic_api, validate_thread_fic_html
+from forum import transport
+from forum.api import ForumAPIError
+from forum.models import FicPage
+from forum.replay import load_recording, replay_forum
+
+
+# Recorded threads of 5, 50 and 500 pages (plus a short one that was
+# finished long ago), replayed when no URLs are given
+RECORDING = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'benchmarks', 'eligibility_threads.json.gz')
+
+
+@contextmanager
+def awards_year(year):
+    """
+    Makes the eligibility checks look at the given year rather than the
+    current one.
+
+    """
+    with mock.patch.multiple(awards_models, ELIGIBILITY_START=datetime(year, 1, 1, tzinfo=timezone.utc), ELIGIBILITY_END=datetime(year + 1, 1, 1, tzinfo=timezone.utc)):
+        yield
+
+
+def linear_validate_thread_fic(page):
+    """
+    The old eligibility check, which walks backward from the last page of
+    the thread one page at a time. Kept here for comparison only.
+
+    """
+    author_ids = [author.user_id for author in page.object.get_authors()]
+    authorposts = [post for post in page.get_page_posts() if post.author.user_id in author_ids]
+    if validate_fic_page(authorposts):
+        return True
+    if not page.has_pages():
+        return False
+
+    curpage = page.get_last_page()
+    if curpage is page:
+        curpage = curpage.get_prev_page()
+
+    while curpage:
+        page_posts = curpage.get_page_posts()
+        authorposts = [post for post in page_posts if post.author.user_id in author_ids]
+        if validate_fic_page(authorposts):
+            return True
+        if authorposts and authorposts[0].posted_date < awards_models.ELIGIBILITY_START or page_posts[0].posted_date < awards_models.ELIGIBILITY_START:
+            return False
+        curpage = curpage.get_prev_page()
+
+    return False
+
+
+class Command(BaseCommand):
+    help = "Compares how many requests (and how much data) the eligibility check makes for the given fic threads with each backend, against the old page-by-page walk. Without URLs, the recorded threads in awards/benchmarks are replayed instead of going to the forum, so the numbers are the same every time."
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='*', metavar='url')
+        parser.add_argument('--recording', default=RECORDING, help="The recorded threads to replay when no URLs are given.")
+        parser.add_argument('--year', dest='years', nargs='+', type=int, default=[settings.YEAR], metavar='YEAR', help="Check eligibility for these years rather than the current awards year.")
+
+    def get_backends(self):
+        backends = [
+            ("binary search (HTML)", validate_thread_fic_html),
+            ("linear walk (HTML)", linear_validate_thread_fic),
+        ]
+        if hasattr(settings, 'FORUM_API_KEY'):
+            backends[1:1] = [
+                ("dates (API), then HTML", fetch_thread_fic_eligibility),
+                ("binary search (API)", lambda page: validate_thread_fic_api(page.object)),
+            ]
+        return backends
+
+    def run_check(self, check, url):
+        # Always download, so that every page the check looks at shows up
+        # as a fetch rather than being served from the page/API caches.
+        # The page we start from doesn't count - the nomination form has
+        # always fetched it already.
+        page = FicPage.from_url(url, force_download=True)
+        transport.stats.reset()
+        start = time.monotonic()
+        with override_settings(FORUM_API_CACHE_TTL=0):
+            result = check(page)
+        seconds = time.monotonic() - start
+        stats = transport.get_stats()
+        requests = sum(counter['calls'] for counter in stats.values())
+        size = sum(counter['bytes'] for counter in stats.values())
+        return result, requests, size, seconds, page.get_last_page_number()
+
+    def benchmark(self, urls, years):
+        totals = {}
+        for year in years:
+            for url in urls:
+                results = []
+                with awards_year(year):
+                    for name, check in self.get_backends():
+                        try:
+                            result, requests, size, seconds, pages = self.run_check(check, url)
+                        except (ValueError, ForumAPIError) as e:
+                            raise CommandError("Couldn't check {} with {}: {}".format(url, name, e))
+                        results.append((name, result, requests, size, seconds))
+                        total = totals.setdefault(name, [0, 0, 0.0])
+                        total[0] += requests
+                        total[1] += size
+                        total[2] += seconds
+
+                self.stdout.write("{} ({} pages) in {}: {}".format(url, pages, year, "eligible" if results[0][1] else "not eligible"))
+                for name, result, requests, size, seconds in results:
+                    self.stdout.write("    {:<22} {:>4} requests, {:>9,} bytes in {:.2f}s".format(name + ":", requests, size, seconds))
+                if len({result for name, result, requests, size, seconds in results}) > 1:
+                    self.stderr.write("    Results differ! " + ", ".join("{}: {}".format(name, "eligible" if result else "not eligible") for name, result, requests, size, seconds in results))
+
+        if len(urls) * len(years) > 1:
+            self.stdout.write("Total:")
+            for name, (requests, size, seconds) in totals.items():
+                self.stdout.write("    {:<22} {:>4} requests, {:>9,} bytes in {:.2f}s".format(name + ":", requests, size, seconds))
+
+    def handle(self, urls, *args, **options):
+        if urls:
+            self.benchmark(urls, options['years'])
+            return
+
+        # Replay the recording (through the API as well), on one thread
+        # so that it all happens in one transaction, which is rolled back
+        # afterwards - the replayed fics and pages aren't real.
+        try:
+            recording = load_recording(options['recording'])
+        except (OSError, ValueError) as e:
+            raise CommandError("Couldn't load the recording: {}".format(e))
+        with replay_forum(recording) as forum, override_settings(FORUM_API_KEY='replay', FORUM_PREFETCH_PAGES=0), transaction.atomic():
+            self.benchmark(forum.get_thread_urls(), options['years'])
+            transaction.set_rollback(True)
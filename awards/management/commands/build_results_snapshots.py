@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from awards.models import YearAward, ResultsSnapshot, is_finished
+
+
+class Command(BaseCommand):
+    help = "Saves snapshots of the nominations and results of the given finished award years (by default, every finished year that doesn't have one yet)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('years', nargs='*', type=int, metavar='year')
+
+    def handle(self, years, *args, **options):
+        if years:
+            unfinished = [year for year in years if not is_finished(year)]
+            if unfinished:
+                raise CommandError("The awards for {} aren't finished yet.".format(", ".join(str(year) for year in unfinished)))
+        else:
+            years = [year for year in YearAward.objects.values_list('year', flat=True).order_by('year').distinct() if is_finished(year)]
+            years = [year for year in years if not ResultsSnapshot.objects.filter(year=year).exists()]
+
+        for year in years:
+            snapshot = ResultsSnapshot.objects.build(year)
+            self.stdout.write("{}: {} awards, {} nominations".format(year, len(snapshot.data), sum(len(award['nominations']) for award in snapshot.data)))
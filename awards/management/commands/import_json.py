@@ -32,6 +32,11 @@ class Command(BaseCommand):
             print("Nominations for year {}!".format(year))
 
             placeholder_nominations = set(Nomination.objects.from_year(year).filter(member_id=388))
+
+            # Look up all the nominated fics and members in one go
+            fic_pages = FicPage.from_urls([nomination['nominee_thread_link'] for nomination in nominations if nomination.get('nominee_thread_link')], save=True)
+            nominee_pages = MemberPage.from_urls([nomination['nominee_user_link'] for nomination in nominations if not nomination.get('nominee_thread_link') and nomination.get('nominee_user_link')], save=True)
+
             for nomination in nominations:
                 try:
                     award = Award.objects.get(name=nomination['award'])
@@ -49,10 +54,10 @@ class Command(BaseCommand):
                     'year': year
                 }
                 if nomination.get('nominee_thread_link'):
-                    fic = FicPage.from_url(nomination.get('nominee_thread_link'), save=True).object
+                    fic = fic_pages[nomination.get('nominee_thread_link')].object
                     nomination_params['fic'] = fic
                 elif nomination.get('nominee_user_link'):
-                    nominee = MemberPage.from_url(nomination.get('nominee_user_link'), save=True).object
+                    nominee = nominee_pages[nomination.get('nominee_user_link')].object
                     nomination_params['nominee'] = nominee
                 else:
                     print("This nomination has neither a thread nor a user link!", nomination)
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.4 on 2026-10-15 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('awards', '0016_alter_award_id_alter_category_id_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResultsSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveIntegerField(unique=True)),
+                ('data', models.JSONField()),
+                ('created_date', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-15 16:05
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('awards', '0017_resultssnapshot'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='resultssnapshot',
+            old_name='created_date',
+            new_name='modified_date',
+        ),
+    ]
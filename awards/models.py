@@ -1,14 +1,19 @@
 # -*- coding: utf8 -*-
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from functools import total_ordering
-from django.db import models
-from django.db.models import Q, Count, Prefetch
+from itertools import groupby
+from django.db import connections, models
+from django.db.models import Q, Count
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.dispatch import receiver
+from django.utils.dateparse import parse_datetime
 from forum.admin import member_manually_verified, member_user_id_updated
-from forum.models import Member, Fic, User
+from forum.api import ForumAPIError, get_thread_posts_page, make_api_request
+from forum.models import Member, Fic, ThreadIndex, User
 from forum.utils import bbcode_to_html
 
 
@@ -50,85 +55,216 @@ def validate_post_fic(page):
     return check_in_awards_year(page.get_post().posted_date)
 
 
-def validate_thread_fic(page):
+def search_thread_pages(last_number, get_posts, author_ids):
     """
-    Returns True if the given FicPage was likely updated in the current
-    year (and thus is eligible for nomination), or False otherwise.
+    Returns True if any page of a thread has a post by one of the given
+    authors made in the current year. get_posts(number) must return the
+    posts on the given page (numbered from 1 to last_number) as a list of
+    (author user ID, posted date) pairs, oldest first.
+
+    """
+    def author_posted_in_year(number):
+        return any(author_id in author_ids and check_in_awards_year(posted_date) for author_id, posted_date in get_posts(number))
+
+    def ends_before_year(number):
+        posts = get_posts(number)
+        return bool(posts) and posts[-1][1] < ELIGIBILITY_START
+
+    def starts_after_year(number):
+        posts = get_posts(number)
+        return bool(posts) and posts[0][1] >= ELIGIBILITY_END
+
+    if ends_before_year(last_number):
+        # If the last post in the thread altogether was made before the
+        # beginning of the awards year, the story can't possibly be
+        # eligible.
+        return False
+    elif author_posted_in_year(last_number):
+        # The story was updated recently.
+        return True
+
+    # Posts are in chronological order, so the only pages that can hold
+    # a post from the awards year are a contiguous run of them. Rather
+    # than walking back through the thread a page at a time, search for
+    # either end of that run.
+
+    # Find the first page with a post made after the start of the awards
+    # year. Most threads we check are recent, so rather than bisecting
+    # the whole thread, gallop back from the last page in doubling steps
+    # until we pass the start of the year, then bisect that stretch.
+    low, high = 1, last_number
+    step = 1
+    while high > low:
+        number = max(high - step, low)
+        if ends_before_year(number):
+            low = number + 1
+            break
+        high = number
+        step *= 2
+    while low < high:
+        middle = (low + high) // 2
+        if ends_before_year(middle):
+            low = middle + 1
+        else:
+            high = middle
+    first_number = low
+
+    # Then the last page with a post made before the end of the awards
+    # year - usually just the last page, if the thread is still going.
+    low, high = first_number, last_number
+    if starts_after_year(high):
+        high -= 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if starts_after_year(middle):
+                high = middle - 1
+            else:
+                low = middle
+    last_number = high
+
+    # Now look for the author's posts on the pages in between. Updates
+    # tend to be near one end or the other (a fic that was updated early
+    # in the year, or one that's still going), so work inward from both
+    # ends at once.
+    numbers = deque(range(first_number, last_number + 1))
+    from_end = True
+    while numbers:
+        number = numbers.pop() if from_end else numbers.popleft()
+        from_end = not from_end
+        if author_posted_in_year(number):
+            return True
+
+    return False
+
+
+def validate_thread_fic_html(page):
+    """
+    Checks whether the given FicPage was updated in the current year by
+    scraping the thread's pages.
 
     """
-    # We need to check whether the 'fic was UPDATED in the awards year.
     # First look at author's posts on the given page.
     # If any are from the awards year, we don't need to go further.
-    page_posts = page.get_page_posts()
-    author_ids = [author.user_id for author in page.object.get_authors()]
-    authorposts = [post for post in page_posts if post.author.user_id in author_ids]
-
-    if not validate_fic_page(authorposts):
-        if not page.has_pages():
-            # This is the only page!
-            # The story can't possibly be eligible.
-            return False
-
-        elif not page.has_prev_page():
-            # This is the first page!
-            if authorposts[0].posted_date >= ELIGIBILITY_END:
-                # If the first post was made after the end of the awards year,
-                # the story can't possibly be eligible.
-                return False
+    author_ids = {author.user_id for author in page.object.get_authors()}
+    pages = {page.get_page_number(): page}
 
-        elif not page.has_next_page():
-            # This is the last page!
-            # I don't believe this should be able to happen
-            # But just in case...
-            if authorposts and authorposts[-1].posted_date < ELIGIBILITY_START or page_posts[-1].posted_date < ELIGIBILITY_START:
-                # If the last post by the author, or the last post in the
-                # thread altogether, was made before the beginning of the
-                # awards year, the story can't possibly be eligible.
-                return False
+    def get_posts(number):
+        # Fetch pages directly by number, and only once
+        if number not in pages:
+            pages[number] = page.get_page_by_number(number)
+            pages[number].index_posts()
+        return [(post.author.user_id, post.posted_date) for post in pages[number].get_page_posts()]
 
-        # Nothing for it but to start working backward through the thread
-        # First, fetch the last page if we aren't there already
-        curpage = page.get_last_page()
-        if curpage is page:
-            curpage = curpage.get_prev_page()
-
-        while curpage:
-            page_posts = curpage.get_page_posts()
-            authorposts = [post for post in page_posts if post.author.user_id in author_ids]
-
-            if not validate_fic_page(authorposts):
-                # If the author's first post on this page is from before the
-                # awards year, or the first post on the page altogether, the
-                # story can't possibly be eligible (if we go further back in
-                # the thread, we're just going to get even older posts).
-                if authorposts and authorposts[0].posted_date < ELIGIBILITY_START or page_posts[0].posted_date < ELIGIBILITY_START:
-                    return False
-
-                curpage = curpage.get_prev_page()
-            else:
-                break
+    if any(author_id in author_ids and check_in_awards_year(posted_date) for author_id, posted_date in get_posts(page.get_page_number())):
+        return True
 
-    return True
+    last_number = page.get_last_page_number()
+    if last_number == 1:
+        # This is the only page!
+        # The story can't possibly be eligible.
+        return False
 
+    return search_thread_pages(last_number, get_posts, author_ids)
 
-def check_eligible(page):
+
+def api_thread_rules_out_fic(fic):
     """
-    Check if the given ForumPage is eligible to be nominated (this year).
+    Returns True if the forum API's summary of the given thread fic's
+    thread shows that it can't have been updated in the current year:
+    the thread was either finished before the awards year started or
+    started after it ended. That's one small request, whereas telling
+    whether it was updated in the year takes a search of its posts.
+    Raises a ForumAPIError if the API lets us down.
 
     """
-    # Only fics do actual eligibility checks at the moment
-    if not isinstance(page.object, Fic):
+    thread = make_api_request('GET', 'threads/%s' % fic.thread_id)['thread']
+    return datetime.fromtimestamp(thread['last_post_date'], timezone.utc) < ELIGIBILITY_START or datetime.fromtimestamp(thread['post_date'], timezone.utc) >= ELIGIBILITY_END
+
+
+def validate_thread_fic_api(fic):
+    """
+    Checks whether the given thread fic was updated in the current year
+    using the forum API, which gives us just the post data we need rather
+    than whole pages. Raises a ForumAPIError if the API lets us down.
+
+    The posts come a page at a time, just like the thread's own pages, so
+    this makes about as many requests as scraping them; it only saves on
+    the amount of data fetched.
+
+    """
+    if api_thread_rules_out_fic(fic):
+        return False
+
+    author_ids = {author.user_id for author in fic.get_authors()}
+    responses = {}
+
+    def get_posts(number):
+        if number not in responses:
+            responses[number] = get_thread_posts_page(fic.thread_id, number)
+        return [(post['user_id'], datetime.fromtimestamp(post['post_date'], timezone.utc)) for post in responses[number]['posts']]
+
+    if any(author_id in author_ids and check_in_awards_year(posted_date) for author_id, posted_date in get_posts(1)):
         return True
+    return search_thread_pages(responses[1]['pagination']['last_page'], get_posts, author_ids)
+
+
+def fetch_thread_fic_eligibility(page):
+    """
+    Checks whether the given FicPage was updated in the current year on
+    the forum. With an API key, the thread's first and last post dates
+    are checked through the API first, since they often settle it; the
+    posts themselves are then searched through the API only if
+    ELIGIBILITY_API_SEARCH is on (which saves data, not requests), and
+    by scraping the thread's pages otherwise.
+
+    """
+    if hasattr(settings, 'FORUM_API_KEY'):
+        try:
+            if api_thread_rules_out_fic(page.object):
+                return False
+            if settings.ELIGIBILITY_API_SEARCH:
+                return validate_thread_fic_api(page.object)
+        except (ForumAPIError, KeyError):
+            pass
+    return validate_thread_fic_html(page)
 
+
+def validate_thread_fic(page):
+    """
+    Returns True if the given FicPage was likely updated in the current
+    year (and thus is eligible for nomination), or False otherwise.
+
+    """
+    # We need to check whether the 'fic was UPDATED in the awards year,
+    # i.e. whether the author made any post in the awards year.
     fic = page.object
+    author_ids = [author.user_id for author in fic.get_authors()]
+
+    # First see what we already know from the thread post index.
+    index = ThreadIndex.objects.filter(thread_id=fic.thread_id).first()
+    if index is not None:
+        if index.has_author_post_between(author_ids, ELIGIBILITY_START, ELIGIBILITY_END):
+            return True
+        # If only a few pages are missing from the index, fetching just
+        # those is cheaper than searching the thread, and then we can
+        # answer from the index alone.
+        if page.get_last_page_number() - index.get_resume_page() < 2 * page.get_last_page_number().bit_length():
+            index.top_up(page)
+            return index.has_author_post_between(author_ids, ELIGIBILITY_START, ELIGIBILITY_END)
+
+    return fetch_thread_fic_eligibility(page)
+
+
+def get_known_eligibility(fic):
+    """
+    Returns whether the given fic is eligible to be nominated (this year)
+    if we can tell without going to the forum, or None if we can't.
 
+    """
     # First, check the eligibility cache
-    cached_eligible = FicEligibility.objects.get_eligible(fic.thread_id, fic.post_id)
-    eligible = cached_eligible
+    eligible = FicEligibility.objects.get_eligible(fic.thread_id, fic.post_id)
 
-    if cached_eligible is None:
-        # We didn't have eligibility info; figure out if the fic is
-        # actually eligible
+    if eligible is None:
         if fic.posted_date and check_in_awards_year(fic.posted_date):
             # If the posted_date is within the awards year, then the fic
             # must be eligible
@@ -137,20 +273,68 @@ def check_eligible(page):
             # Otherwise, is the fic already nominated? Then we must have
             # already checked it for eligibility
             eligible = True
-        else:
-            # Do the full eligibility check
-            try:
-                eligible = validate_post_fic(page) if fic.post_id else validate_thread_fic(page)
-            except ValueError as e:
-                # Invalid link, probably!
-                raise ValidationError(str(e))
-
-        # Save the info we just fetched in the eligibility cache, but
-        # only if we're past the awards year (otherwise the fic could
-        # later become eligible for this year)
-        if timezone.now().year > settings.YEAR:
-            FicEligibility.objects.set_eligible(eligible, fic.thread_id, fic.post_id)
+    return eligible
+
+
+def get_known_eligibilities(fics):
+    """
+    Like get_known_eligibility, but for a list of fics at once: returns a
+    list of whether each fic is eligible (or None if we can't tell), with
+    one query for the eligibility cache and one for this year's
+    nominations rather than two per fic.
+
+    """
+    cached = FicEligibility.objects.get_eligible_many([(fic.thread_id, fic.post_id) for fic in fics])
+    fic_ids = [fic.pk for fic in fics if fic.pk is not None]
+    nominated = set(Nomination.objects.from_year().filter(fic__in=fic_ids).values_list('fic_id', flat=True)) if fic_ids else set()
+
+    eligibilities = []
+    for fic in fics:
+        eligible = cached.get((fic.thread_id, fic.post_id))
+        if eligible is None and (fic.posted_date and check_in_awards_year(fic.posted_date) or fic.pk in nominated):
+            eligible = True
+        eligibilities.append(eligible)
+    return eligibilities
+
+
+def fetch_eligibility(page):
+    """
+    Does the full eligibility check for the given FicPage on the forum.
 
+    """
+    fic = page.object
+    try:
+        return validate_post_fic(page) if fic.post_id else validate_thread_fic(page)
+    except ValueError as e:
+        # Invalid link, probably!
+        raise ValidationError(str(e))
+
+
+def _fetch_eligibility_in_thread(page):
+    try:
+        return fetch_eligibility(page)
+    finally:
+        # Each check runs on a pool thread with its own connection
+        connections.close_all()
+
+
+def save_eligibility(fic, eligible):
+    """
+    Saves the result of a full eligibility check for the given fic in
+    the eligibility cache - but only if we're past the awards year, since
+    otherwise the fic could later become eligible for this year.
+
+    """
+    if datetime.now(timezone.utc).year > settings.YEAR:
+        FicEligibility.objects.set_eligible(eligible, fic.thread_id, fic.post_id)
+
+
+def confirm_eligible(fic, eligible):
+    """
+    Raises a ValidationError if the given fic isn't eligible, and makes
+    sure it's saved if it is.
+
+    """
     if not eligible:
         raise ValidationError(ELIGIBILITY_ERROR_MESSAGE)
     else:
@@ -159,6 +343,75 @@ def check_eligible(page):
         fic.save()
 
 
+def check_eligible(page):
+    """
+    Check if the given ForumPage is eligible to be nominated (this year).
+
+    """
+    # Only fics do actual eligibility checks at the moment
+    if not isinstance(page.object, Fic):
+        return True
+
+    fic = page.object
+
+    eligible = get_known_eligibility(fic)
+
+    if eligible is None:
+        # We didn't have eligibility info; do the full eligibility check
+        eligible = fetch_eligibility(page)
+        save_eligibility(fic, eligible)
+
+    confirm_eligible(fic, eligible)
+
+
+def check_all_eligible(pages):
+    """
+    Checks the eligibility of all the given ForumPages like
+    check_eligible, but together: what we already know is looked up in
+    bulk, each fic is only checked once, and the full checks on the
+    forum run concurrently (up to ELIGIBILITY_CHECK_THREADS at a time).
+
+    Returns a list with the ValidationError for each page that isn't
+    eligible, or None for each page that is, in order.
+
+    """
+    errors = [None] * len(pages)
+    fic_indices = [i for i, page in enumerate(pages) if isinstance(page.object, Fic)]
+    if not fic_indices:
+        return errors
+
+    # The same fic may well turn up more than once
+    checks = {}
+    for i in fic_indices:
+        checks.setdefault((pages[i].object.thread_id, pages[i].object.post_id), []).append(i)
+    keys = list(checks)
+    eligibilities = dict(zip(keys, get_known_eligibilities([pages[checks[key][0]].object for key in keys])))
+    unknown = [key for key in keys if eligibilities[key] is None]
+
+    futures = {}
+    if len(unknown) > 1 and settings.ELIGIBILITY_CHECK_THREADS > 1:
+        with ThreadPoolExecutor(max_workers=min(len(unknown), settings.ELIGIBILITY_CHECK_THREADS), thread_name_prefix='eligibility') as executor:
+            futures = {key: executor.submit(_fetch_eligibility_in_thread, pages[checks[key][0]]) for key in unknown}
+
+    for key in unknown:
+        try:
+            eligibilities[key] = futures[key].result() if key in futures else fetch_eligibility(pages[checks[key][0]])
+        except ValidationError as e:
+            for i in checks[key]:
+                errors[i] = e
+            continue
+        save_eligibility(pages[checks[key][0]].object, eligibilities[key])
+
+    for key in keys:
+        for i in checks[key]:
+            if errors[i] is None:
+                try:
+                    confirm_eligible(pages[i].object, eligibilities[key])
+                except ValidationError as e:
+                    errors[i] = e
+    return errors
+
+
 @receiver(member_user_id_updated)
 def update_nominations_votes_on_user_id_updated(sender, instance, old_instance, **kwargs):
     old_instance.nominations.update(nominee_id=instance)
@@ -171,6 +424,15 @@ def verify_current_on_manual_verify(sender, instance, **kwargs):
     verify_current(instance)
 
 
+def is_finished(year):
+    """
+    Returns True if the awards for the given year are over, so that
+    their results can be shown (and won't change any more).
+
+    """
+    return int(year) < settings.YEAR or int(year) == settings.YEAR and Phase.get_current() == 'finished'
+
+
 def verify_current(member):
     """
     Find any current nominations/votes by this member and verify them.
@@ -351,7 +613,7 @@ class NominationSet(object):
     def get_nominator_details(self):
         return [{
             'member': nomination.member,
-            'comment': nomination.comment,
+            'comment': nomination.comment_html(),
             'link': nomination.link
         } for nomination in self.nominations]
 
@@ -359,7 +621,7 @@ class NominationSet(object):
         self.nominations.append(nomination)
 
     def get_votes(self):
-        return sum(len(nomination.votes.all()) for nomination in self.nominations)
+        return sum(nomination.vote_count for nomination in self.nominations)
 
     @property
     def modified_date(self):
@@ -369,6 +631,45 @@ class NominationSet(object):
         return getattr(self.nominations[0], name)
 
 
+def rank_nomination_sets(nomination_sets):
+    """
+    Sorts the given NominationSets (whose nominations must have vote
+    counts) by votes and gives each one its place, as a [highest,
+    lowest] pair - [1, 1] for an outright winner, or e.g. [2, 3] for
+    sets tied for second place.
+
+    """
+    nomination_sets.sort(key=lambda nomination_set: nomination_set.get_votes(), reverse=True)
+    for votes, tied in groupby(enumerate(nomination_sets), key=lambda item: item[1].get_votes()):
+        tied = list(tied)
+        place = [tied[0][0] + 1, tied[-1][0] + 1]
+        for i, nomination_set in tied:
+            nomination_set.place = place
+    return nomination_sets
+
+
+def get_distinct_nominations(nominations, award, with_votes=False):
+    """
+    Groups the given nominations for an award (in the order they were
+    made) into NominationSets by their distinguishing keys. With votes,
+    the nominations must have vote counts, and the sets are ranked.
+
+    """
+    if with_votes:
+        nominations = sorted(nominations, key=lambda nomination: nomination.vote_count, reverse=True)
+    nomination_sets = {}
+    for nomination in nominations:
+        key = nomination.get_distinguishing_key(award)
+        if key in nomination_sets:
+            nomination_sets[key].add(nomination)
+        else:
+            nomination_sets[key] = NominationSet(nomination)
+    distinct_nominations = list(nomination_sets.values())
+    if with_votes:
+        rank_nomination_sets(distinct_nominations)
+    return distinct_nominations
+
+
 class YearAwardManager(YearlyManager):
     def get_with_distinct_nominations(self, year=None, with_votes=False):
         """
@@ -376,17 +677,25 @@ class YearAwardManager(YearlyManager):
         each of them, in the form of NominationSets that eliminate
         duplicates.
 
+        All the year's nominations are fetched in one go and grouped by
+        their distinguishing key, rather than comparing each nomination
+        against every set found so far.
+
         """
-        year_awards = self.from_year(year).prefetch_related('award__category')
+        year_awards = list(self.from_year(year).select_related('award__category'))
+        awards = {year_award.award_id: year_award.award for year_award in year_awards}
+        if with_votes:
+            vote_counts = Vote.objects.get_counts(year or CURRENT_YEAR)
+
+        nominations = defaultdict(list)
+        for nomination in Nomination.objects.get_verified(year or CURRENT_YEAR, awards):
+            nomination.award = awards[nomination.award_id]
+            if with_votes:
+                nomination.vote_count = vote_counts.get(nomination.pk, 0)
+            nominations[nomination.award_id].append(nomination)
+
         for year_award in year_awards:
-            year_award.distinct_nominations = []
-            for nomination in year_award.get_nominations(with_votes):
-                for existing_nominations in year_award.distinct_nominations:
-                    if not nomination.is_distinct_from(existing_nominations):
-                        existing_nominations.add(nomination)
-                        break
-                else:
-                    year_award.distinct_nominations.append(NominationSet(nomination))
+            year_award.distinct_nominations = get_distinct_nominations(nominations[year_award.award_id], year_award.award, with_votes)
         return year_awards
 
 
@@ -414,11 +723,21 @@ class YearAward(YearlyData):
     def get_nominations(self, with_votes=False):
         nominations = Nomination.objects.from_year(self.year).filter(verified=True, award=self.award).distinct()
         if with_votes:
-            nominations = nominations.prefetch_related(Prefetch('votes', Vote.objects.filter(verified=True).distinct()))
-            nominations = sorted(nominations, key=lambda nomination: len(nomination.votes.all()), reverse=True)
+            nominations = nominations.annotate(vote_count=Count('votes', filter=Q(votes__verified=True))).order_by('-vote_count', 'pk')
         return nominations
 
 
+class NominationManager(YearlyManager):
+    def get_verified(self, year, awards):
+        """
+        Returns the verified nominations for the given awards in the
+        given year, in the order they were made, with everything needed
+        to display them.
+
+        """
+        return self.from_year(year).filter(verified=True, award__in=awards).select_related('member', 'nominee', 'fic').prefetch_related('fic__authors').order_by('pk')
+
+
 class Nomination(YearlyData):
     """
     A nomination for an award. Note that the 'member' field is the
@@ -436,6 +755,8 @@ class Nomination(YearlyData):
     modified_date = models.DateTimeField(auto_now=True)
     verified = models.BooleanField(default=False)
 
+    objects = NominationManager()
+
     def __str__(self):
         return u"{award} ({year}): {nomination} ({member})".format(
             award=self.award,
@@ -471,23 +792,27 @@ class Nomination(YearlyData):
                 )
             )
 
+    def get_distinguishing_key(self, award=None):
+        """
+        Returns a hashable key that is the same for nominations for the
+        same thing and different otherwise. Only the fields that apply
+        to the award (by default, the nomination's own) are included.
+
+        """
+        award = award or self.award
+        return (
+            self.fic_id if award.has_fic else None,
+            self.nominee_id if award.has_person else None,
+            self.detail if award.has_detail else None,
+        )
+
     def is_distinct_from(self, nomination):
         """
         Returns True if this nomination is different from the given
         nomination and False otherwise.
 
         """
-        distinguishing_fields = []
-        if self.award.has_fic:
-            distinguishing_fields.append('fic')
-        if self.award.has_person:
-            distinguishing_fields.append('nominee')
-        if self.award.has_detail:
-            distinguishing_fields.append('detail')
-        for field in distinguishing_fields:
-            if getattr(self, field) != getattr(nomination, field):
-                return True
-        return False
+        return self.get_distinguishing_key() != nomination.get_distinguishing_key(self.award)
 
     def nomination_text(self):
         if self.detail:
@@ -547,6 +872,23 @@ class Nomination(YearlyData):
             return None
         return bbcode_to_html(self.detail)
 
+    def comment_html(self):
+        if not self.comment:
+            return u""
+        return bbcode_to_html(self.comment)
+
+
+class VoteManager(YearlyManager):
+    def get_counts(self, year=None):
+        """
+        Returns a dict of the number of verified votes for each verified
+        nomination (by ID) in the given year, counted in the database.
+        Nominations without any votes are left out.
+
+        """
+        counts = self.filter(verified=True, nomination__year=year or CURRENT_YEAR, nomination__verified=True).values('nomination_id').annotate(votes=Count('pk')).order_by()
+        return {count['nomination_id']: count['votes'] for count in counts}
+
 
 class Vote(YearlyData):
     """
@@ -560,6 +902,8 @@ class Vote(YearlyData):
     nomination = models.ForeignKey(Nomination, related_name='votes', on_delete=models.CASCADE)
     verified = models.BooleanField(default=False)
 
+    objects = VoteManager()
+
     class Meta:
         unique_together = ('member', 'award', 'year')
 
@@ -581,6 +925,16 @@ class EligibilityManager(models.Manager):
         else:
             return entry.is_eligible
 
+    def get_eligible_many(self, keys, year=CURRENT_YEAR):
+        """
+        Returns the cached eligibility of each of the given (thread ID,
+        post ID) pairs that we have an entry for, as a dict, in one query.
+
+        """
+        keys = set(keys)
+        entries = self.filter(thread_id__in={thread_id for thread_id, post_id in keys}, year=year).values_list('thread_id', 'post_id', 'is_eligible')
+        return {(thread_id, post_id): is_eligible for thread_id, post_id, is_eligible in entries if (thread_id, post_id) in keys}
+
     def set_eligible(self, eligible, thread_id, post_id=None, year=CURRENT_YEAR):
         return self.update_or_create(thread_id=thread_id, post_id=post_id, year=year, defaults={'is_eligible': eligible})
 
@@ -612,7 +966,7 @@ class PageViewManager(models.Manager):
 
     def get_last_pageview(self, user, page):
         pageview = self.filter(user=user, page=page).first() if user.is_authenticated else None
-        return pageview.viewed_time if pageview else timezone.now()
+        return pageview.viewed_time if pageview else datetime.now(timezone.utc)
 
 
 class PageView(models.Model):
@@ -632,3 +986,113 @@ class PageView(models.Model):
 
     def __str__(self):
         return u"%s viewed %s at %s" % (self.user, self.page, self.viewed_time)
+
+
+class SnapshotNomination(object):
+    """
+    A nomination as stored in a ResultsSnapshot: just what the
+    nomination and results pages show, already rendered. It stands in
+    for a Nomination in NominationSets.
+
+    """
+    def __init__(self, key, data):
+        self.key = key
+        self.pk = data['pk']
+        self.member = Member(user_id=data['member'][0], username=data['member'][1])
+        self.link = data['link']
+        self.vote_count = data['votes']
+        self.modified_date = parse_datetime(data['modified_date'])
+        self._comment_html = data['comment']
+        self._nomination_html = data['html']
+        self._nomination_bbcode = data['bbcode']
+
+    def get_distinguishing_key(self, award=None):
+        return self.key
+
+    def comment_html(self):
+        return self._comment_html
+
+    def nomination_html(self):
+        return self._nomination_html
+
+    def nomination_bbcode(self):
+        return self._nomination_bbcode
+
+
+class ResultsSnapshotManager(models.Manager):
+    def build(self, year):
+        """
+        Saves (or replaces) the snapshot of the given year's
+        nominations and votes.
+
+        """
+        vote_counts = Vote.objects.get_counts(year)
+        data = []
+        for year_award in YearAward.objects.get_with_distinct_nominations(year=year):
+            award = year_award.award
+            data.append({
+                'award': {'pk': award.pk, 'name': award.name, 'category': [award.category.pk, award.category.name], 'has_samples': award.has_samples},
+                'nominations': [[{
+                    'pk': nomination.pk,
+                    'member': [nomination.member.user_id, nomination.member.username],
+                    'link': nomination.link,
+                    'comment': nomination.comment_html(),
+                    'html': nomination.nomination_html(),
+                    'bbcode': nomination.nomination_bbcode(),
+                    'votes': vote_counts.get(nomination.pk, 0),
+                    'modified_date': nomination.modified_date.isoformat(),
+                } for nomination in nomination_set.nominations] for nomination_set in year_award.distinct_nominations]
+            })
+        snapshot, created = self.update_or_create(year=year, defaults={'data': data})
+        return snapshot
+
+    def get_or_build(self, year):
+        """
+        Returns the snapshot for the given year, building it first if
+        the year is finished and doesn't have one yet, or None if it
+        isn't finished.
+
+        """
+        snapshot = self.filter(year=year).first()
+        if snapshot is None and is_finished(year) and YearAward.objects.from_year(year).exists():
+            snapshot = self.build(year)
+        return snapshot
+
+
+class ResultsSnapshot(models.Model):
+    """
+    The nominations and results of a finished awards year, with the
+    nominations already grouped, counted and rendered. Once voting is
+    over none of this changes, so the nomination and results pages for
+    the year are served from here instead of being worked out from the
+    nominations and votes on every visit.
+
+    """
+    year = models.PositiveIntegerField(unique=True)
+    data = models.JSONField()
+    modified_date = models.DateTimeField(auto_now=True)
+
+    objects = ResultsSnapshotManager()
+
+    def __str__(self):
+        return u"Results snapshot for %s" % self.year
+
+    def get_year_awards(self, with_votes=False):
+        """
+        Returns the year's awards with their distinct_nominations, like
+        YearAward.objects.get_with_distinct_nominations, but from the
+        snapshot. The awards and nominations are unsaved stand-ins.
+
+        """
+        year_awards = []
+        for award_data in self.data:
+            category = Category(pk=award_data['award']['category'][0], name=award_data['award']['category'][1])
+            award = Award(pk=award_data['award']['pk'], name=award_data['award']['name'], category=category, has_samples=award_data['award']['has_samples'])
+            year_award = YearAward(year=self.year, award=award)
+            nominations = [SnapshotNomination(key, nomination_data) for key, nomination_set_data in enumerate(award_data['nominations']) for nomination_data in nomination_set_data]
+            # The nominations must be in the order they were made for
+            # the sets to come out in the same order as they do live
+            nominations.sort(key=lambda nomination: nomination.pk)
+            year_award.distinct_nominations = get_distinct_nominations(nominations, award, with_votes)
+            year_awards.append(year_award)
+        return year_awards
@@ -1,3 +1,316 @@
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.test import TestCase
+from django.test.utils import override_settings
+from forum.models import Fic, Member
+from forum.replay import load_recording, replay_forum
 
-# Create your tests here.
+# The awards app is switched off in INSTALLED_APPS by default, and its
+# models can't be imported unless it's on
+AWARDS_INSTALLED = apps.is_installed('awards')
+if AWARDS_INSTALLED:
+    from awards.forms import VotingForm
+    from awards.management.commands.benchmark_eligibility import RECORDING, Command as BenchmarkEligibilityCommand, awards_year
+    from awards.models import (
+        ELIGIBILITY_END, ELIGIBILITY_ERROR_MESSAGE, ELIGIBILITY_START, Award, Category, Nomination, NominationSet, Vote, YearAward,
+        check_all_eligible, rank_nomination_sets, search_thread_pages,
+    )
+
+
+@skipUnless(AWARDS_INSTALLED, "The awards app isn't enabled.")
+class EligibilityBenchmarkTests(TestCase):
+    """
+    Replays the recorded threads the eligibility benchmark uses.
+
+    """
+    def run_backends(self, years):
+        command = BenchmarkEligibilityCommand()
+        results = {}
+        with replay_forum(load_recording(RECORDING)) as forum, override_settings(FORUM_API_KEY='replay', FORUM_PREFETCH_PAGES=0):
+            for year in years:
+                with awards_year(year):
+                    for url in forum.get_thread_urls():
+                        results[(year, url)] = {name: command.run_check(check, url)[:2] for name, check in command.get_backends()}
+        return results
+
+    def test_backends_agree(self):
+        for (year, url), results in self.run_backends([2014, 2019, 2024]).items():
+            with self.subTest(year=year, url=url):
+                self.assertEqual(len({result for result, requests in results.values()}), 1, results)
+
+    def test_search_beats_linear_walk_on_long_threads(self):
+        results = self.run_backends([2018])
+        long_thread = results[(2018, 'https://forum.replay.invalid/threads/3/')]
+        self.assertTrue(long_thread["binary search (HTML)"][0])
+        self.assertLess(long_thread["binary search (HTML)"][1] * 4, long_thread["linear walk (HTML)"][1])
+        self.assertLess(long_thread["binary search (API)"][1] * 4, long_thread["linear walk (HTML)"][1])
+
+    def test_thread_dates_settle_threads_started_after_the_year(self):
+        results = self.run_backends([2012])
+        thread = results[(2012, 'https://forum.replay.invalid/threads/2/')]
+        self.assertEqual(thread["dates (API), then HTML"], (False, 1))
+        self.assertGreater(thread["binary search (HTML)"][1], 5)
+
+
+@skipUnless(AWARDS_INSTALLED, "The awards app isn't enabled.")
+class SearchThreadPagesTests(TestCase):
+    """
+    search_thread_pages against made-up threads with one post per day.
+
+    """
+    AUTHOR_ID = 1
+    OTHER_ID = 2
+
+    def make_thread(self, first_day, author_days=(), posts_per_page=5):
+        """
+        Returns a get_posts for a thread starting first_day days after
+        the start of the awards year, with the author posting on the
+        given days and someone else on every other day, and a list that
+        the numbers of the pages it's asked for are added to.
+
+        """
+        requested = []
+
+        def get_posts(number):
+            requested.append(number)
+            days = range(first_day + (number - 1) * posts_per_page, first_day + number * posts_per_page)
+            return [(self.AUTHOR_ID if day in author_days else self.OTHER_ID, ELIGIBILITY_START + timedelta(days=day)) for day in days]
+        return get_posts, requested
+
+    def search(self, first_day, last_page, author_days):
+        get_posts, requested = self.make_thread(first_day, author_days)
+        return search_thread_pages(last_page, get_posts, {self.AUTHOR_ID}), requested
+
+    def test_matches_linear_walk(self):
+        year_days = (ELIGIBILITY_END - ELIGIBILITY_START).days
+        for first_day in (-2000, -400, -30, 0, 100, year_days - 3, year_days + 10):
+            for last_page in (1, 2, 7, 100):
+                for author_day in (None, -1, 0, 50, year_days - 1, year_days):
+                    author_days = () if author_day is None else (author_day,)
+                    get_posts, requested = self.make_thread(first_day, author_days)
+                    expected = any(
+                        author_id == self.AUTHOR_ID and ELIGIBILITY_START <= posted_date < ELIGIBILITY_END
+                        for number in range(1, last_page + 1) for author_id, posted_date in get_posts(number)
+                    )
+                    with self.subTest(first_day=first_day, last_page=last_page, author_day=author_day):
+                        self.assertEqual(search_thread_pages(last_page, get_posts, {self.AUTHOR_ID}), expected)
+
+    def test_gallops_from_the_end_of_long_threads(self):
+        # 2000 pages of 5 posts a day, ending 30 days into the awards
+        # year, with the author's update on its first day
+        eligible, requested = self.search(30 - 2000 * 5, 2000, author_days=(0,))
+        self.assertTrue(eligible)
+        self.assertLess(len(set(requested)), 30)
+
+    def test_skips_threads_finished_before_the_year(self):
+        eligible, requested = self.search(-2000, 100, author_days=(-1999,))
+        self.assertFalse(eligible)
+        self.assertEqual(set(requested), {100})
+
+
+class AwardsTestMixin(object):
+    """
+    Builds awards, members, fics and nominations for tests.
+
+    """
+    def create_award(self, name, year=settings.YEAR, **kwargs):
+        category, created = Category.objects.get_or_create(name="Test awards")
+        award = Award.objects.create(category=category, name=name, **kwargs)
+        YearAward.objects.create(award=award, year=year)
+        return award
+
+    def create_member(self, user_id):
+        return Member.objects.get_or_create(user_id=user_id, defaults={'username': "Member%s" % user_id})[0]
+
+    def create_fic(self, *authors):
+        fic = Fic.objects.create(title="Fic %s" % (Fic.objects.count() + 1), thread_id=Fic.objects.count() + 1, posted_date=ELIGIBILITY_START)
+        fic.authors.add(*authors)
+        return fic
+
+    def nominate(self, award, member, year=settings.YEAR, **kwargs):
+        kwargs.setdefault('verified', True)
+        return Nomination.objects.create(award=award, member=member, year=year, **kwargs)
+
+
+@skipUnless(AWARDS_INSTALLED, "The awards app isn't enabled.")
+class DistinctNominationTests(AwardsTestMixin, TestCase):
+    def setUp(self):
+        self.fic_award = self.create_award("Best Fic", has_fic=True)
+        self.scene_award = self.create_award("Best Scene", has_fic=True, has_detail=True)
+        self.person_award = self.create_award("Best Author", has_person=True)
+        self.author = self.create_member(1)
+        self.fics = [self.create_fic(self.author), self.create_fic(self.author)]
+        self.nominators = [self.create_member(user_id) for user_id in range(10, 14)]
+
+    def get_sets(self, award):
+        for year_award in YearAward.objects.get_with_distinct_nominations():
+            if year_award.award == award:
+                return [[nomination.pk for nomination in nomination_set.nominations] for nomination_set in year_award.distinct_nominations]
+
+    def test_groups_by_fic(self):
+        # The detail doesn't matter for an award that doesn't ask for one
+        first = self.nominate(self.fic_award, self.nominators[0], fic=self.fics[0])
+        other = self.nominate(self.fic_award, self.nominators[1], fic=self.fics[1])
+        same = self.nominate(self.fic_award, self.nominators[2], fic=self.fics[0], detail="Stray detail")
+        self.nominate(self.fic_award, self.nominators[3], fic=self.fics[1], verified=False)
+        self.assertEqual(self.get_sets(self.fic_award), [[first.pk, same.pk], [other.pk]])
+        self.assertFalse(same.is_distinct_from(first))
+        self.assertTrue(other.is_distinct_from(first))
+
+    def test_groups_by_detail(self):
+        first = self.nominate(self.scene_award, self.nominators[0], fic=self.fics[0], detail="The duel")
+        same = self.nominate(self.scene_award, self.nominators[1], fic=self.fics[0], detail="The duel")
+        other_detail = self.nominate(self.scene_award, self.nominators[2], fic=self.fics[0], detail="The duel.")
+        other_fic = self.nominate(self.scene_award, self.nominators[3], fic=self.fics[1], detail="The duel")
+        self.assertEqual(self.get_sets(self.scene_award), [[first.pk, same.pk], [other_detail.pk], [other_fic.pk]])
+        self.assertEqual(first.get_distinguishing_key(), (self.fics[0].pk, None, "The duel"))
+
+    def test_groups_by_nominee(self):
+        other_author = self.create_member(2)
+        first = self.nominate(self.person_award, self.nominators[0], nominee=self.author)
+        other = self.nominate(self.person_award, self.nominators[1], nominee=other_author)
+        same = self.nominate(self.person_award, self.nominators[2], nominee=self.author, fic=self.fics[0])
+        self.assertEqual(self.get_sets(self.person_award), [[first.pk, same.pk], [other.pk]])
+        # Keys are compared under the other nomination's award
+        self.assertEqual(same.get_distinguishing_key(self.fic_award), (self.fics[0].pk, None, None))
+
+
+@skipUnless(AWARDS_INSTALLED, "The awards app isn't enabled.")
+class RankingTests(AwardsTestMixin, TestCase):
+    def make_sets(self, *votes):
+        return [NominationSet(SimpleNamespace(vote_count=vote_count, name=i)) for i, vote_count in enumerate(votes)]
+
+    def test_tied_places(self):
+        ranked = rank_nomination_sets(self.make_sets(3, 7, 3, 1, 7, 3))
+        self.assertEqual([(nomination_set.name, nomination_set.place) for nomination_set in ranked], [
+            (1, [1, 2]), (4, [1, 2]),
+            (0, [3, 5]), (2, [3, 5]), (5, [3, 5]),
+            (3, [6, 6]),
+        ])
+
+    def test_outright_winner(self):
+        ranked = rank_nomination_sets(self.make_sets(0, 2, 1))
+        self.assertEqual([nomination_set.place for nomination_set in ranked], [[1, 1], [2, 2], [3, 3]])
+
+    def test_merged_sets_rank_by_combined_votes(self):
+        award = self.create_award("Best Fic", has_fic=True)
+        fics = [self.create_fic(self.create_member(1)), self.create_fic(self.create_member(2))]
+        nominators = [self.create_member(user_id) for user_id in range(10, 13)]
+        # Two nominations of the first fic with two votes each, and one of
+        # the second with three, plus one vote that isn't verified
+        nominations = [self.nominate(award, nominators[0], fic=fics[0]), self.nominate(award, nominators[1], fic=fics[0]), self.nominate(award, nominators[2], fic=fics[1])]
+        for user_id, nomination, verified in [(20, 0, True), (21, 0, True), (22, 1, True), (23, 1, True), (24, 2, True), (25, 2, True), (26, 2, True), (27, 2, False)]:
+            Vote.objects.create(member=self.create_member(user_id), award=award, nomination=nominations[nomination], verified=verified)
+
+        year_award, = YearAward.objects.get_with_distinct_nominations(with_votes=True)
+        self.assertEqual([(nomination_set.fic, nomination_set.get_votes(), nomination_set.place) for nomination_set in year_award.distinct_nominations], [
+            (fics[0], 4, [1, 1]),
+            (fics[1], 3, [2, 2]),
+        ])
+
+
+@skipUnless(AWARDS_INSTALLED, "The awards app isn't enabled.")
+@override_settings(PHASE='voting')
+class VotingFormQueryTests(AwardsTestMixin, TestCase):
+    """
+    The voting form takes the same number of queries however many awards
+    there are.
+
+    """
+    QUERIES = 7
+
+    def create_year(self, year, awards):
+        """
+        Sets up the given number of fic awards for the given year, each
+        with two nominations of co-written fics, and returns the POST
+        data for voting for the first nomination in each.
+
+        """
+        nominators = [self.create_member(user_id) for user_id in (10, 11)]
+        data = {}
+        for i in range(awards):
+            award = self.create_award("Award %s" % i, year=year, has_fic=True)
+            nominations = [
+                self.nominate(award, nominator, year=year, fic=self.create_fic(self.create_member(100 + 2 * j), self.create_member(101 + 2 * j)))
+                for j, nominator in enumerate(nominators)
+            ]
+            data['award_%s' % award.pk] = str(nominations[0].pk)
+        return data
+
+    def test_queries_dont_grow_with_awards(self):
+        voter = self.create_member(1)
+        for year, awards in [(2019, 3), (2020, 10)]:
+            data = self.create_year(year, awards)
+            with self.subTest(awards=awards):
+                with self.assertNumQueries(self.QUERIES):
+                    form = VotingForm(year, voter, data)
+                    self.assertTrue(form.is_valid(), form.errors)
+                    form.save()
+                self.assertEqual(Vote.objects.filter(member=voter, year=year).count(), awards)
+
+    def test_changing_votes(self):
+        voter = self.create_member(1)
+        data = self.create_year(2020, 3)
+        form = VotingForm(2020, voter, data)
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        Vote.objects.filter(member=voter).update(verified=True)
+
+        changed = dict(data)
+        award_id = next(iter(data))
+        changed[award_id] = str(Nomination.objects.filter(award_id=award_id[len('award_'):]).exclude(pk=data[award_id]).get().pk)
+        form = VotingForm(2020, voter, changed)
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+
+        votes = {'award_%s' % vote.award_id: (str(vote.nomination_id), vote.verified) for vote in Vote.objects.filter(member=voter)}
+        self.assertEqual(votes, {key: (value, True) for key, value in changed.items()})
+
+
+@skipUnless(AWARDS_INSTALLED, "The awards app isn't enabled.")
+class CheckAllEligibleTests(AwardsTestMixin, TestCase):
+    def make_page(self, thread_id, posted_date=None):
+        # Posted before the awards year by default, so we can't tell if
+        # it's eligible without checking
+        return SimpleNamespace(object=Fic(title="Fic %s" % thread_id, thread_id=thread_id, posted_date=posted_date or ELIGIBILITY_START - timedelta(days=1)))
+
+    def test_errors_map_back_to_pages(self):
+        # Threads 1 and 2 are found eligible and ineligible on the forum,
+        # thread 3 is a bad link and thread 4 was posted this year
+        def fetch_eligibility(page):
+            fetched.append(page.object.thread_id)
+            if page.object.thread_id == 3:
+                raise ValidationError(u"Invalid link!")
+            return page.object.thread_id == 1
+
+        for threads in (1, 4):
+            fetched = []
+            pages = [
+                SimpleNamespace(object=self.create_member(1)),
+                self.make_page(1),
+                self.make_page(2),
+                self.make_page(1),
+                self.make_page(3),
+                self.make_page(4, ELIGIBILITY_START),
+                self.make_page(3),
+            ]
+            with self.subTest(threads=threads), self.settings(ELIGIBILITY_CHECK_THREADS=threads), \
+                    mock.patch('awards.models.fetch_eligibility', side_effect=fetch_eligibility):
+                errors = check_all_eligible(pages)
+                self.assertEqual([error.messages if error else None for error in errors], [
+                    None,
+                    None,
+                    [ELIGIBILITY_ERROR_MESSAGE],
+                    None,
+                    [u"Invalid link!"],
+                    None,
+                    [u"Invalid link!"],
+                ])
+                # Each fic is checked once, and only if we don't know
+                self.assertEqual(sorted(fetched), [1, 2, 3])
+                # Eligible fics are saved
+                self.assertEqual([page.object.pk is not None for page in pages[1:]], [True, False, True, False, True, False])
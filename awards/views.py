@@ -12,7 +12,7 @@ from django.contrib import messages
 from django.contrib.auth import login
 from extra_views.formsets import FormSetView
 from awards.forms import YearAwardForm, BaseYearAwardFormSet, NominationForm, BaseNominationFormSet, VotingForm, AwardsVerificationForm
-from awards.models import YearAward, Nomination, Phase, PageView, check_eligible, verify_current
+from awards.models import YearAward, Nomination, Phase, PageView, ResultsSnapshot, check_eligible, get_known_eligibility, is_finished, verify_current
 from forum.models import Member, MemberPage, Fic
 from forum.forms import TempUserProfileForm
 from forum.views import LoginRequiredMixin, ForumObjectLookupView, VerificationView
@@ -54,6 +54,43 @@ class PageViewMixin(object):
         return context
 
 
+class ResultsSnapshotMixin(object):
+    """
+    A mixin for views listing a year's nominations, which serves
+    finished years from their ResultsSnapshot (building it on the first
+    visit). Staff can rebuild the snapshot by posting to the view.
+
+    """
+    with_votes = False
+
+    def get_year(self):
+        return int(self.kwargs.get('year') or settings.YEAR)
+
+    def get_snapshot(self):
+        if not hasattr(self, 'snapshot'):
+            self.snapshot = ResultsSnapshot.objects.get_or_build(self.get_year())
+        return self.snapshot
+
+    def get_queryset(self):
+        snapshot = self.get_snapshot()
+        if snapshot is not None:
+            return snapshot.get_year_awards(self.with_votes)
+        return YearAward.objects.get_with_distinct_nominations(year=self.get_year(), with_votes=self.with_votes)
+
+    def get_context_data(self, **kwargs):
+        context = super(ResultsSnapshotMixin, self).get_context_data(**kwargs)
+        context['snapshot'] = self.get_snapshot()
+        return context
+
+    def post(self, *args, **kwargs):
+        if not self.request.user.is_staff:
+            raise PermissionDenied
+        if is_finished(self.get_year()):
+            ResultsSnapshot.objects.build(self.get_year())
+            messages.success(self.request, u"The saved nominations and results for %s have been rebuilt." % self.get_year())
+        return HttpResponseRedirect(self.request.path)
+
+
 class YearAwardsMassEditView(FormSetView):
     form_class = YearAwardForm
     formset_class = BaseYearAwardFormSet
@@ -157,19 +194,22 @@ class NominationView(TempUserMixin, FormSetView):
 
     def get_context_data(self, **kwargs):
         context = super(NominationView, self).get_context_data(**kwargs)
-        context['all_fics'] = Fic.objects.prefetch_related('authors')
-        context['all_authors'] = Member.objects.all()
+        # Only the fics/members selected on the page are sent along;
+        # anything else is looked up through the typeahead search
+        known_objects = context['formset'].get_known_objects()
+        authors = dict(known_objects['nominee'])
+        for fic in known_objects['fic'].values():
+            authors.update((str(author.pk), author) for author in fic.authors.all())
+        context['known_fics'] = known_objects['fic'].values()
+        context['known_authors'] = authors.values()
         return context
 
 
-class AllNominationsView(PageViewMixin, ListView):
+class AllNominationsView(PageViewMixin, ResultsSnapshotMixin, ListView):
     page_name = 'all_nominations'
     context_object_name = 'year_awards'
     template_name = "all_nominations.html"
 
-    def get_queryset(self):
-        return YearAward.objects.get_with_distinct_nominations(year=self.kwargs.get('year') or settings.YEAR)
-
     def get_context_data(self, **kwargs):
         context = super(AllNominationsView, self).get_context_data(**kwargs)
 
@@ -224,10 +264,23 @@ class AdminNominationView(NominationView):
 class NominationLookupView(ForumObjectLookupView):
     model = None
 
-    def get_page(self):
-        page = super(NominationLookupView, self).get_page()
+    def get_page(self, url, object_type=None):
+        page = super(NominationLookupView, self).get_page(url, object_type)
 
-        check_eligible(page)
+        if page is not None:
+            check_eligible(page)
+
+        return page
+
+    def get_saved_page(self, url, object_type=None):
+        page = super(NominationLookupView, self).get_saved_page(url, object_type)
+
+        # Only answer straight away if we can tell whether a fic is
+        # eligible without going to the forum
+        if page is not None and isinstance(page.object, Fic) and get_known_eligibility(page.object) is None:
+            return None
+        if page is not None:
+            check_eligible(page)
 
         return page
 
@@ -261,34 +314,20 @@ class VotingView(TempUserMixin, FormView):
         return super(VotingView, self).form_valid(form)
 
 
-class ResultsView(ListView):
+class ResultsView(ResultsSnapshotMixin, ListView):
     """
     A view that lets people view voting results from concluded awards.
 
     """
     context_object_name = 'year_awards'
     template_name = 'results.html'
-
-    def get_queryset(self):
-        awards = YearAward.objects.get_with_distinct_nominations(with_votes=True, year=self.kwargs.get('year') or settings.YEAR)
-
-        for award in awards:
-            for i, nomination in enumerate(award.distinct_nominations):
-                num_votes = nomination.get_votes()
-                high_place = i
-                low_place = i
-                while high_place > 0 and award.distinct_nominations[high_place - 1].get_votes() == num_votes:
-                    high_place -= 1
-                while low_place < len(award.distinct_nominations) - 1 and award.distinct_nominations[low_place + 1].get_votes() == num_votes:
-                    low_place += 1
-                nomination.place = [high_place + 1, low_place + 1]
-        return awards
+    with_votes = True
 
     def get_context_data(self, **kwargs):
         context = super(ResultsView, self).get_context_data(**kwargs)
 
-        context['year'] = int(self.kwargs.get('year') or settings.YEAR)
-        context['results_ready'] = context['year'] < settings.YEAR or Phase.get_current() == 'finished'
+        context['year'] = self.get_year()
+        context['results_ready'] = is_finished(context['year'])
 
         return context
 
@@ -5,6 +5,7 @@ Django settings for sppfawards project.
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 import os
+import tempfile
 from datetime import datetime, timedelta
 
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
@@ -81,9 +82,51 @@ FORUM_URL = os.environ.get('FORUM_URL')
 fic_forums = os.environ.get('VALID_FIC_FORUMS')
 VALID_FIC_FORUMS = fic_forums.split(', ') if fic_forums else ()
 
+# Forum connection settings
+FORUM_CONNECT_TIMEOUT = float(os.environ.get('FORUM_CONNECT_TIMEOUT', 5))
+FORUM_READ_TIMEOUT = float(os.environ.get('FORUM_READ_TIMEOUT', 20))
+FORUM_MAX_RETRIES = int(os.environ.get('FORUM_MAX_RETRIES', 3))
+FORUM_RETRY_BACKOFF = float(os.environ.get('FORUM_RETRY_BACKOFF', 0.5))
+FORUM_POOL_SIZE = int(os.environ.get('FORUM_POOL_SIZE', 10))
+# How many pages ahead to fetch in the background when walking a thread
+FORUM_PREFETCH_PAGES = int(os.environ.get('FORUM_PREFETCH_PAGES', 4))
+
+# How long (in seconds) responses to GET requests to the forum API are cached
+FORUM_API_CACHE_TTL = int(os.environ.get('FORUM_API_CACHE_TTL', 60))
+
+# Rate limits for requests to the forum, by kind of request: (requests
+# per second, burst size). Shared by all the worker processes on a machine
+# through files in FORUM_LOCK_DIR.
+FORUM_RATE_LIMITS = {
+    'html': (float(os.environ.get('FORUM_HTML_RATE', 4)), int(os.environ.get('FORUM_HTML_BURST', 20))),
+    'api': (float(os.environ.get('FORUM_API_RATE', 5)), int(os.environ.get('FORUM_API_BURST', 10))),
+}
+FORUM_RATE_LIMIT_MAX_WAIT = float(os.environ.get('FORUM_RATE_LIMIT_MAX_WAIT', 20))
+# Where the lock/state files shared between worker processes live
+FORUM_LOCK_DIR = os.environ.get('FORUM_LOCK_DIR', tempfile.gettempdir())
+
+# Whether lookups of forum objects we don't have yet are queued for the
+# process_lookups command rather than done during the request
+FORUM_LOOKUP_QUEUE = bool(int(os.environ.get('FORUM_LOOKUP_QUEUE', 1)))
+FORUM_LOOKUP_THREADS = int(os.environ.get('FORUM_LOOKUP_THREADS', 4))
+# How long (in seconds) a lookup can run before it's assumed lost and requeued
+FORUM_LOOKUP_TIMEOUT = int(os.environ.get('FORUM_LOOKUP_TIMEOUT', 5 * 60))
+
+# How long (in seconds) fetched forum pages are cached, by page type
+FORUM_PAGE_CACHE_TTL = {
+    'member': int(os.environ.get('FORUM_MEMBER_CACHE_TTL', 24 * 60 * 60)),
+    'thread': int(os.environ.get('FORUM_THREAD_CACHE_TTL', 10 * 60)),
+    'post': int(os.environ.get('FORUM_POST_CACHE_TTL', 60 * 60)),
+}
+# How long (in seconds) cached forum pages are kept at all once fetched
+FORUM_PAGE_CACHE_MAX_AGE = int(os.environ.get('FORUM_PAGE_CACHE_MAX_AGE', 7 * 24 * 60 * 60))
+
 ENABLED_APPS = ['reviewblitz']
 
 
+# How long (in seconds) each process caches the current review blitz
+CURRENT_BLITZ_CACHE_TTL = int(os.environ.get('CURRENT_BLITZ_CACHE_TTL', 30))
+
 # Forum awards settings
 
 MIN_YEAR = 2008
@@ -110,6 +153,11 @@ RESULTS_THREAD = os.environ.get('RESULTS_THREAD', '')
 MAX_FIC_NOMINATIONS = int(os.environ.get('MAX_FIC_NOMINATIONS', 5))
 MAX_PERSON_NOMINATIONS = int(os.environ.get('MAX_PERSON_NOMINATIONS', 6))
 MIN_DIFFERENT_NOMINATIONS = int(os.environ.get('MIN_DIFFERENT_NOMINATIONS', 4))
+# How many fic eligibility checks a nomination form submission runs at once
+ELIGIBILITY_CHECK_THREADS = int(os.environ.get('ELIGIBILITY_CHECK_THREADS', 4))
+# Whether eligibility checks search a thread's posts through the API
+# (when we have a key) rather than its pages
+ELIGIBILITY_API_SEARCH = bool(int(os.environ.get('ELIGIBILITY_API_SEARCH', 0)))
 
 
 # Database
@@ -1,7 +1,7 @@
 from django.urls import reverse_lazy, re_path
 from django.views.generic.base import TemplateView, RedirectView
 from django.contrib.auth.views import LoginView, LogoutView
-from forum.views import VerificationView, RegisterView, EditUserInfoView, ForumObjectLookupView, PasswordResetLookupView, PasswordResetView, CatalogView, CatalogAuthorView, CatalogFicView, CatalogSearchView, CatalogGenreView, CatalogTagView
+from forum.views import VerificationView, RegisterView, EditUserInfoView, ForumObjectLookupView, LookupStatusView, ForumObjectSearchView, PasswordResetLookupView, PasswordResetView, CatalogView, CatalogAuthorView, CatalogFicView, CatalogSearchView, CatalogGenreView, CatalogTagView
 from reviewblitz.views import BlitzReviewSubmissionFormView, BlitzReviewApprovalQueueView, BlitzLeaderboardView, BlitzUserView, BlitzHistoryView, BlitzView, HasReviewedView
 from forum.models import Member, Fic, Chapter
 
@@ -28,6 +28,10 @@ urlpatterns = [
     re_path(r'^lookup/fic/$', ForumObjectLookupView.as_view(model=Fic), name='lookup_fic'),
     re_path(r'^lookup/member/$', ForumObjectLookupView.as_view(model=Member), name='lookup_member'),
     re_path(r'^lookup/chapter/$', ForumObjectLookupView.as_view(model=Chapter), name='lookup_chapter'),
+    re_path(r'^lookup/status/(?P<pk>[0-9a-f-]+)/$', LookupStatusView.as_view(), name='lookup_status'),
+
+    re_path(r'^search/fic/$', ForumObjectSearchView.as_view(model=Fic, search_field='title'), name='search_fic'),
+    re_path(r'^search/member/$', ForumObjectSearchView.as_view(model=Member, search_field='username'), name='search_member'),
 
     re_path(r'^blitz/history/$', BlitzHistoryView.as_view(), name="blitz_history"),
     re_path(r'^blitz/submit/$', BlitzReviewSubmissionFormView.as_view(), name="blitz_review_submit"),
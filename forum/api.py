@@ -1,23 +1,107 @@
-from django.conf import settings
+"""
+A client for the XenForo API.
+
+Requests go through the shared forum transport (so they're pooled, timed
+out, retried and rate limited like everything else). Idempotent GETs are
+cached for a short while (FORUM_API_CACHE_TTL), and failures are raised
+as ForumAPIError subclasses rather than being passed on as bad data.
+
+"""
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
 import requests
+from django.conf import settings
+from django.core.cache import cache
+from forum import transport
+
+
+class ForumAPIError(Exception):
+    """
+    Something went wrong talking to the forum API. status_code is the
+    HTTP status of the response, if we got one.
+
+    """
+    def __init__(self, message, status_code=None):
+        super(ForumAPIError, self).__init__(message)
+        self.status_code = status_code
+
+
+class ForumAPIUnavailable(ForumAPIError):
+    """The API couldn't be reached, or didn't give us a usable response."""
+
+
+class ForumAPINotFound(ForumAPIError):
+    """The requested user/thread/etc. doesn't exist."""
+
+
+class ForumAPIPermissionDenied(ForumAPIError):
+    """The API key isn't allowed to do what we asked."""
+
+
+def get_cache_key(endpoint, params=None):
+    query = urlencode(sorted((params or {}).items()))
+    return 'forum-api:%s' % hashlib.md5(('%s?%s' % (endpoint, query)).encode('utf-8')).hexdigest()
+
+
+def get_error_message(resp, data):
+    try:
+        return u"; ".join(error['message'] for error in data['errors'])
+    except (KeyError, TypeError):
+        return u"API request failed with status %s" % resp.status_code
 
-def make_api_request(method, endpoint, payload=None, params=None):
-    resp = requests.request(
-        method,
-        'https://%sapi/%s' % (settings.FORUM_URL, endpoint),
-        params=params,
-        data=payload,
-        headers={
-            'XF-Api-Key': settings.FORUM_API_KEY,
-            'XF-Api-User': '1'
-        }
-    )
 
-    return resp.json()
+def make_api_request(method, endpoint, payload=None, params=None, use_cache=True):
+    """
+    Makes a request to the forum API and returns the decoded response.
+
+    GET responses are cached for FORUM_API_CACHE_TTL seconds unless
+    use_cache is False. Raises a ForumAPIError if the request fails.
+
+    """
+    cache_key = None
+    if method == 'GET' and use_cache and settings.FORUM_API_CACHE_TTL:
+        cache_key = get_cache_key(endpoint, params)
+        data = cache.get(cache_key)
+        if data is not None:
+            return data
+
+    try:
+        resp = transport.request(
+            method,
+            'https://%sapi/%s' % (settings.FORUM_URL, endpoint),
+            kind='api',
+            params=params,
+            data=payload,
+            headers={
+                'XF-Api-Key': settings.FORUM_API_KEY,
+                'XF-Api-User': '1'
+            }
+        )
+    except requests.RequestException as e:
+        raise ForumAPIUnavailable(u"Could not reach the forum API: %s" % e)
+
+    try:
+        data = resp.json()
+    except ValueError:
+        data = None
+
+    if resp.status_code == 404:
+        raise ForumAPINotFound(get_error_message(resp, data), resp.status_code)
+    elif resp.status_code in (401, 403):
+        raise ForumAPIPermissionDenied(get_error_message(resp, data), resp.status_code)
+    elif resp.status_code >= 400 or data is None:
+        raise ForumAPIUnavailable(get_error_message(resp, data), resp.status_code)
+
+    if cache_key:
+        cache.set(cache_key, data, settings.FORUM_API_CACHE_TTL)
+    return data
 
 def add_user_to_group(user_id, group_id):
     try:
-        user_data = make_api_request('GET', 'users/%s' % user_id)
+        # Don't risk dropping a group that was added in the meantime
+        user_data = make_api_request('GET', 'users/%s' % user_id, use_cache=False)
 
         groups = user_data['user']['secondary_group_ids']
         if group_id not in groups:
@@ -25,61 +109,122 @@ def add_user_to_group(user_id, group_id):
             # Must use tuples for PHP array format
             payload = [('secondary_group_ids[]', str(group_id)) for group_id in groups]
             resp = make_api_request('POST', 'users/%s' % user_id, payload)
+            cache.delete(get_cache_key('users/%s' % user_id))
             return resp.get('success')
-    except Exception as e:
+    except (ForumAPIError, KeyError) as e:
         return False
     return True
 
 
-def get_user_info(user_id):
+def get_user_info(user_id, use_cache=True):
+    """
+    Returns a (username, verification code) tuple for the given user.
+    Raises a ForumAPIError if we can't get them (ForumAPINotFound if the
+    user doesn't exist).
+
+    """
+    user_data = make_api_request('GET', 'users/%s' % user_id, use_cache=use_cache)
     try:
-        user_data = make_api_request('GET', 'users/%s' % user_id)
-    except Exception as e:
-        return (None, None)
-    else:
         return (user_data['user']['username'], user_data['user']['custom_fields'].get('verificationcode', ''))
+    except (KeyError, TypeError, AttributeError):
+        raise ForumAPIUnavailable(u"Unexpected response for user %s." % user_id)
 
 
 def get_user_threads(user_id, page=1):
     return make_api_request('GET', 'threads', params={'starter_id': user_id, 'page': page})
 
 
+def get_thread_posts_page(thread_id, page=1):
+    return make_api_request('GET', 'threads/%s/posts' % thread_id, params={'page': page})
+
+
 class ThreadAPIIterator:
+    """
+    Iterates over the posts of a thread through the API.
+
+    Once the first page tells us how many pages there are, up to prefetch
+    of the following pages are fetched concurrently while the caller works
+    through the current one.
+    As with forum.models.ThreadIterator, use it as a context manager (or
+    call close()) if you might stop before the end.
+
+    """
     page = None
     page_posts = None
     index = None
 
-    def __init__(self, thread_id):
+    def __init__(self, thread_id, prefetch=None):
         self.thread_id = thread_id
         self.page = 0
         self.response = {'posts': [], 'pagination': {'last_page': 1}}
         self.index = 0
+        self.prefetch = settings.FORUM_PREFETCH_PAGES if prefetch is None else prefetch
+        self.executor = None
+        self.pending = {}
+
+    def __iter__(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     def __next__(self):
         if self.index >= len(self.response['posts']):
             if self.page >= self.response['pagination']['last_page']:
+                self.close()
                 raise StopIteration
 
             self.page += 1
             try:
-                self.response = make_api_request('GET', 'threads/%s/posts' % self.thread_id, params={'page': self.page})
+                self.response = self.get_page(self.page)
             except Exception:
-                raise StopIteration
+                self.close()
+                raise
             if not self.response.get('posts'):
+                self.close()
                 raise StopIteration
             self.index = 0
+            self.schedule()
         post = self.response['posts'][self.index]
         self.index += 1
         return post
 
+    def get_page(self, page):
+        future = self.pending.pop(page, None)
+        if future is not None:
+            return future.result()
+        return get_thread_posts_page(self.thread_id, page)
+
+    def schedule(self):
+        if self.prefetch <= 0:
+            return
+        last_page = self.response['pagination']['last_page']
+        if self.executor is None:
+            if last_page <= self.page:
+                return
+            self.executor = ThreadPoolExecutor(max_workers=min(self.prefetch, settings.FORUM_POOL_SIZE), thread_name_prefix='api-prefetch')
+        for page in range(self.page + 1, min(self.page + self.prefetch, last_page) + 1):
+            if page not in self.pending:
+                self.pending[page] = self.executor.submit(get_thread_posts_page, self.thread_id, page)
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        self.pending = {}
+
 
 class ThreadPosts:
-    def __init__(self, thread_id):
+    def __init__(self, thread_id, prefetch=None):
         self.thread_id = thread_id
+        self.prefetch = prefetch
 
     def __iter__(self):
-        return ThreadAPIIterator(self.thread_id)
+        return ThreadAPIIterator(self.thread_id, self.prefetch)
 
 
-def get_thread_posts(thread_id):
-    return ThreadPosts(thread_id)
+def get_thread_posts(thread_id, prefetch=None):
+    return ThreadPosts(thread_id, prefetch)
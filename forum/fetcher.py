@@ -0,0 +1,92 @@
+"""
+Concurrent fetching of forum pages for bulk jobs.
+
+Management commands that need to resolve a lot of forum objects at once
+(e.g. importing a year's nominations) would otherwise fetch every page
+one after the other. The engine here runs the blocking fetches on a
+thread pool driven by asyncio, with a cap on how many requests are in
+flight to any one host, and hands pages back as they arrive.
+
+fetch_many() is the synchronous way in; it can't be called from code
+that's already running inside an event loop (use iter_fetched there).
+
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from bs4 import BeautifulSoup
+from django.conf import settings
+from django.db import connections
+
+from forum import transport
+from forum.parsing import HTML_PARSER
+
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_text(url):
+    return transport.fetch(url).text
+
+
+def _call_fetch(fetch, url):
+    try:
+        return fetch(url)
+    finally:
+        # The fetch function may have gone through the page cache from a
+        # worker thread; don't leave its connection lying around.
+        connections.close_all()
+
+
+async def iter_fetched(urls, fetch=fetch_text, per_host=None):
+    """
+    Fetches the given URLs concurrently, yielding (url, result) pairs in
+    the order they complete. result is whatever fetch returned for the
+    URL (its HTML, by default), or the exception it raised.
+
+    At most per_host requests (FORUM_POOL_SIZE by default) are made to
+    any one host at a time.
+
+    """
+    urls = list(dict.fromkeys(urls))
+    if not urls:
+        return
+    per_host = per_host or settings.FORUM_POOL_SIZE
+    hosts = {urlsplit(url).netloc for url in urls}
+    semaphores = defaultdict(lambda: asyncio.Semaphore(per_host))
+    loop = asyncio.get_running_loop()
+
+    with ThreadPoolExecutor(max_workers=min(len(urls), per_host * len(hosts)), thread_name_prefix='forum-fetch') as executor:
+        async def fetch_one(url):
+            async with semaphores[urlsplit(url).netloc]:
+                try:
+                    return url, await loop.run_in_executor(executor, _call_fetch, fetch, url)
+                except Exception as e:
+                    return url, e
+
+        for result in asyncio.as_completed([fetch_one(url) for url in urls]):
+            yield await result
+
+
+def fetch_many(urls, fetch=fetch_text, per_host=None, as_soup=True):
+    """
+    Fetches the given URLs concurrently and returns a dictionary mapping
+    each URL to its soup (or to whatever fetch returned, if as_soup is
+    False). URLs that couldn't be fetched are left out, so callers can
+    fall back to fetching those the normal way (and getting the normal
+    errors).
+
+    """
+    async def collect():
+        results = {}
+        async for url, result in iter_fetched(urls, fetch, per_host):
+            if isinstance(result, Exception):
+                logger.warning(u"Couldn't fetch %s: %s", url, result)
+                continue
+            results[url] = BeautifulSoup(result, HTML_PARSER) if as_soup else result
+        return results
+
+    return asyncio.run(collect())
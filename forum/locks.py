@@ -0,0 +1,106 @@
+"""
+Locks shared between all the worker processes on a machine.
+
+These are advisory file locks (flock) on small files in a directory every
+worker can get to. On platforms without fcntl they fall back to plain
+in-process locks, which is fine for a single-process development server.
+
+There's also SingleFlight, for coalescing identical calls made at the
+same time by different threads within a process.
+
+"""
+import hashlib
+import os
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+_local_locks = {}
+_local_locks_lock = threading.Lock()
+
+
+def _get_local_lock(path):
+    with _local_locks_lock:
+        if path not in _local_locks:
+            _local_locks[path] = threading.Lock()
+        return _local_locks[path]
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Holds an exclusive lock on the given path (creating the file if need
+    be) for the duration of the with block.
+
+    """
+    if fcntl is None:
+        with _get_local_lock(path):
+            yield
+        return
+
+    # Each caller opens its own file descriptor, so threads within the
+    # same process exclude each other as well as other processes.
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def key_lock(namespace, key, stripes=256):
+    """
+    Returns a file lock for the given key. Keys are hashed onto a fixed
+    number of lock files per namespace, so we don't leave a file behind
+    for every key we've ever seen; the odd unrelated key having to wait
+    its turn is harmless.
+
+    """
+    stripe = int(hashlib.sha1(key.encode('utf-8')).hexdigest(), 16) % stripes
+    return file_lock(os.path.join(settings.FORUM_LOCK_DIR, 'forum-%s-%03d.lock' % (namespace, stripe)))
+
+
+class SingleFlight(object):
+    """
+    Makes sure that only one call per key is in flight at a time: if a
+    thread asks for a key that another thread is already working on, it
+    waits for and shares that result (or exception) rather than doing
+    the work again.
+
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+
+        if not leader:
+            return call.result()
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
@@ -0,0 +1,14 @@
+# -*- coding: utf8 -*-
+from django.core.management.base import BaseCommand
+from forum.models import ThreadIndex
+
+
+class Command(BaseCommand):
+    help = "Forgets the post index for the given threads, so they're crawled again from the start the next time they're needed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('thread_ids', nargs='+', type=int, help="IDs of the threads to forget.")
+
+    def handle(self, *args, **options):
+        deleted, counts = ThreadIndex.objects.invalidate(options['thread_ids'])
+        self.stdout.write("Forgot %s indexed threads (%s posts)." % (counts.get('forum.ThreadIndex', 0), counts.get('forum.IndexedPost', 0)))
@@ -0,0 +1,66 @@
+# -*- coding: utf8 -*-
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from forum.models import CachedPage, LookupJob
+
+
+logger = logging.getLogger(__name__)
+
+
+def run_job(job):
+    try:
+        job.run()
+    finally:
+        # Each job runs on a pool thread with its own connection
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Processes queued forum object lookups (see LookupJob) until stopped."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=settings.FORUM_LOOKUP_THREADS, help="How many lookups to run at once.")
+        parser.add_argument('--poll-interval', type=float, default=1.0, dest='poll_interval', help="How long (in seconds) to wait between checks for new jobs when idle.")
+        parser.add_argument('--once', action='store_true', default=False, help="Exit once the queue is empty instead of waiting for more jobs.")
+
+    def handle(self, *args, **options):
+        threads = max(options['threads'], 1)
+        running = {}
+        last_purge = 0
+
+        self.stdout.write("Processing lookups with %s threads..." % threads)
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='lookup') as executor:
+            while True:
+                LookupJob.objects.requeue_stale(settings.FORUM_LOOKUP_TIMEOUT)
+
+                jobs = LookupJob.objects.claim(threads - len(running)) if len(running) < threads else []
+                for job in jobs:
+                    self.stdout.write("Looking up %s" % job.url)
+                    running[executor.submit(run_job, job)] = job
+
+                if not running:
+                    if options['once']:
+                        break
+                    if time.monotonic() - last_purge > 60 * 60:
+                        LookupJob.objects.purge(24 * 60 * 60)
+                        CachedPage.objects.purge()
+                        last_purge = time.monotonic()
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                # Wait for a free thread, but keep an eye out for new jobs
+                done, _ = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception:
+                        # Lookup errors are dealt with in the job itself, so
+                        # something else went wrong; don't take the worker
+                        # down with it
+                        logger.exception(u"Lookup of %s failed", job.url)
+                        job.fail()
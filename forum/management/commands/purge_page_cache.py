@@ -0,0 +1,15 @@
+# -*- coding: utf8 -*-
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from forum.models import CachedPage
+
+
+class Command(BaseCommand):
+    help = "Deletes cached forum pages that haven't been fetched for a while (FORUM_PAGE_CACHE_MAX_AGE). process_lookups does this hourly by itself."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--age', type=int, default=settings.FORUM_PAGE_CACHE_MAX_AGE, help="Delete pages last fetched more than this many seconds ago.")
+
+    def handle(self, *args, **options):
+        deleted, _ = CachedPage.objects.purge(options['age'])
+        self.stdout.write("Deleted %s cached pages." % deleted)
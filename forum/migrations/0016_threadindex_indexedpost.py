@@ -0,0 +1,42 @@
+# Generated by Django 5.1.4 on 2026-10-15 09:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0015_cachedpage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThreadIndex',
+            fields=[
+                ('thread_id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('crawled_pages', models.PositiveIntegerField(default=0)),
+                ('last_page', models.PositiveIntegerField(default=0)),
+                ('updated_date', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'thread indexes',
+            },
+        ),
+        migrations.CreateModel(
+            name='IndexedPost',
+            fields=[
+                ('post_id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('posted_date', models.DateTimeField()),
+                ('page', models.PositiveIntegerField()),
+                ('word_count', models.PositiveIntegerField()),
+                ('threadmark_title', models.CharField(blank=True, max_length=255)),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='indexed_posts', to='forum.member')),
+                ('thread', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='posts', to='forum.threadindex')),
+            ],
+            options={
+                'ordering': ('post_id',),
+                'indexes': [models.Index(fields=['thread', 'page'], name='forum_index_thread__6d85ad_idx'), models.Index(fields=['thread', 'author', 'posted_date'], name='forum_index_thread__75a228_idx')],
+            },
+        ),
+    ]
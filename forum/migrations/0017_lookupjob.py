@@ -0,0 +1,32 @@
+# Generated by Django 5.1.4 on 2026-10-15 09:55
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0016_threadindex_indexedpost'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LookupJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('view', models.CharField(max_length=200)),
+                ('model', models.CharField(max_length=100)),
+                ('url', models.CharField(max_length=500)),
+                ('object_type', models.CharField(blank=True, max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('result', models.TextField(blank=True)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('started_date', models.DateTimeField(blank=True, null=True)),
+                ('finished_date', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_date'], name='forum_looku_status_904fc0_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-15 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0017_lookupjob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='fic',
+            name='title',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='member',
+            name='username',
+            field=models.CharField(db_index=True, max_length=50),
+        ),
+    ]
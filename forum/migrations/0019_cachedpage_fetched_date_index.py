@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-15 10:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0018_fic_title_member_username_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cachedpage',
+            name='fetched_date',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
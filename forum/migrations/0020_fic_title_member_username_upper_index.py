@@ -0,0 +1,65 @@
+# Generated by Django 5.1.4 on 2026-10-15 16:20
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+UPPER_INDEXES = [
+    ('fic', 'title', 'fic_title_upper_idx'),
+    ('member', 'username', 'member_username_upper_idx'),
+]
+
+
+def create_upper_indexes(apps, schema_editor):
+    # Without text_pattern_ops, PostgreSQL can only use the indexes for
+    # LIKE 'prefix%' in the C locale
+    for model_name, field_name, index_name in UPPER_INDEXES:
+        model = apps.get_model('forum', model_name)
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute('CREATE INDEX %s ON %s (UPPER(%s) text_pattern_ops)' % (
+                schema_editor.quote_name(index_name),
+                schema_editor.quote_name(model._meta.db_table),
+                schema_editor.quote_name(model._meta.get_field(field_name).column),
+            ))
+        else:
+            schema_editor.add_index(model, models.Index(django.db.models.functions.text.Upper(field_name), name=index_name))
+
+
+def drop_upper_indexes(apps, schema_editor):
+    for model_name, field_name, index_name in UPPER_INDEXES:
+        model = apps.get_model('forum', model_name)
+        schema_editor.remove_index(model, models.Index(django.db.models.functions.text.Upper(field_name), name=index_name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0019_cachedpage_fetched_date_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='fic',
+            name='title',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='member',
+            name='username',
+            field=models.CharField(max_length=50),
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(create_upper_indexes, drop_upper_indexes),
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='fic',
+                    index=models.Index(django.db.models.functions.text.Upper('title'), name='fic_title_upper_idx'),
+                ),
+                migrations.AddIndex(
+                    model_name='member',
+                    index=models.Index(django.db.models.functions.text.Upper('username'), name='member_username_upper_idx'),
+                ),
+            ],
+        ),
+    ]
@@ -1,19 +1,34 @@
 # -*- coding: utf-8 -*-
+import json
+import logging
 import re
-import requests
 import string
 import secrets
-from datetime import datetime, timezone
-from django.db import models
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from django.apps import apps
+from django.db import connections, models
 from django.db.models import Q
+from django.db.models.functions import Upper
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.contrib.auth import logout
 from django.contrib.auth.models import AbstractUser
-from forum.api import get_user_info
+from django.utils.module_loading import import_string
+from forum.api import ForumAPIError, ForumAPINotFound, get_user_info
+from forum.fetcher import fetch_many
+from forum.parsing import HTML_PARSER, parse_thread_page
+from forum.locks import SingleFlight, key_lock
+from forum.resolver import canonical_url, resolve_url
+from forum.transport import fetch
+from forum.utils import write_transaction
 from bs4 import BeautifulSoup
 
 
+logger = logging.getLogger(__name__)
+
+
 def get_tz_string(offset):
     return '{:0=+3d}00'.format(offset)
 
@@ -24,9 +39,20 @@ def pretty_join(items, word='and'):
     return u', '.join(new_list)
 
 
-def get_soup(url):
-    request = requests.get(url)
-    return BeautifulSoup(request.text, 'html.parser')
+def get_html(url, page_type=None, force_download=False):
+    """
+    Fetches the given URL and returns its HTML. If a page type is given,
+    the page is read through the page cache (see CachedPage);
+    force_download skips the cache and always fetches the live page.
+
+    """
+    if page_type is not None:
+        return CachedPage.objects.fetch(url, page_type, force_download)
+    return fetch(url).text
+
+
+def get_soup(url, page_type=None, force_download=False):
+    return BeautifulSoup(get_html(url, page_type, force_download), HTML_PARSER)
 
 
 class ForumPage(object):
@@ -35,19 +61,21 @@ class ForumPage(object):
     from this to work with fic threads/profiles.
 
     """
-    object_id_regexen = []
     object_class = None
+    page_type = None
 
-    def __init__(self, obj, soup=None):
+    def __init__(self, obj, soup=None, force_download=False, html=None):
         self.object = obj
         self._soup = soup
+        self._html = html
         self._time_info = None
+        self.force_download = force_download
 
     def __str__(self):
         return u"Forum page for %s" % self.object
 
     @classmethod
-    def from_url(cls, url, force_download=False, save=False):
+    def from_url(cls, url, force_download=False, save=False, soup=None, html=None):
         """
         Takes a URL to a forum page for this object type and returns
         a corresponding page instance.
@@ -55,11 +83,36 @@ class ForumPage(object):
         If force_download is True, the page will always be fetched and
         parsed; otherwise, it'll just grab the relevant parameters from
         the URL and find an existing object matching those parameters,
-        if one exists.
+        if one exists. If the page has already been fetched, its soup or
+        HTML can be passed in to be parsed instead.
 
         """
         params = cls.get_params_from_url(url)  # Will raise ValueError if the URL is invalid
-        return cls.from_params(force_download=force_download, url=url, save=save, **params)
+        return cls.from_params(force_download=force_download, url=url, save=save, soup=soup, html=html, **params)
+
+    @classmethod
+    def from_urls(cls, urls, force_download=False, save=False):
+        """
+        Like from_url, but for many URLs at once: returns a dictionary
+        mapping each URL to its page instance. The pages for any objects
+        that aren't already in the database are fetched concurrently.
+
+        """
+        # Will raise ValueError if any of the URLs is invalid
+        params = {url: cls.get_params_from_url(url) for url in urls}
+
+        pages = {}
+        if not force_download:
+            for url, url_params in params.items():
+                obj = cls.find_object(**url_params)
+                if obj is not None:
+                    pages[url] = cls(obj)
+
+        fetch_urls = {url: cls.get_fetch_url(url) for url in params if url not in pages}
+        fetched = fetch_many(fetch_urls.values(), fetch=lambda url: get_html(url, cls.page_type, force_download), as_soup=False)
+        for url, fetch_url in fetch_urls.items():
+            pages[url] = cls.from_params(force_download=force_download, url=url, save=save, html=fetched.get(fetch_url), **params[url])
+        return pages
 
     @classmethod
     def from_url_direct(cls, url):
@@ -76,44 +129,74 @@ class ForumPage(object):
         return page
 
     @classmethod
-    def from_params(cls, save=False, force_download=False, url=None, object_type=None, **kwargs):
+    def from_params(cls, save=False, force_download=False, url=None, object_type=None, soup=None, html=None, **kwargs):
         """
-        Returns a page object corresponding to the given params.
+        Returns a page object corresponding to the given params. If the
+        page has already been fetched, its soup or HTML can be passed in
+        and it will be parsed rather than looked up in the database.
 
         """
-        lookup_kwargs = dict(**kwargs)
-        if 'post_id' in lookup_kwargs and object_type != 'post':
-            lookup_kwargs.pop('post_id')
-        if lookup_kwargs and not force_download:
-            try:
-                # See if we can get the object from the database just from the
-                # parameters
-                obj = cls.object_class.objects.get(**lookup_kwargs)
+        if soup is None and html is None and not force_download:
+            # See if we can get the object from the database just from the
+            # parameters
+            obj = cls.find_object(object_type, **kwargs)
+            if obj is not None:
                 return cls(obj)
-            except (cls.object_class.DoesNotExist, cls.object_class.MultipleObjectsReturned):
-                pass
         # Either this doesn't exist in the database, we can't uniquely
         # determine the object from the URL parameters, or we simply need to
         # refetch it for validation purposes, so fetch it from the forums
         obj = cls.object_class(**kwargs)
-        page = cls(obj, get_soup(url) if url else None)
+        if soup is None and html is None and url:
+            html = get_html(cls.get_fetch_url(url), cls.page_type, force_download)
+        page = cls(obj, soup=soup, html=html, force_download=force_download)
         page.load_object(save, object_type)
         return page
 
+    @classmethod
+    def find_object(cls, object_type=None, **kwargs):
+        """
+        Returns the object in the database matching the given params, or
+        None if there isn't exactly one.
+
+        """
+        lookup_kwargs = dict(**kwargs)
+        if 'post_id' in lookup_kwargs and object_type != 'post':
+            lookup_kwargs.pop('post_id')
+        if not lookup_kwargs:
+            return None
+        try:
+            return cls.object_class.objects.get(**lookup_kwargs)
+        except (cls.object_class.DoesNotExist, cls.object_class.MultipleObjectsReturned):
+            return None
+
+    @classmethod
+    def get_fetch_url(cls, url):
+        """
+        Returns the URL to actually fetch for the page at the given URL.
+
+        """
+        return url
+
     @classmethod
     def get_params_from_url(cls, url, allow_offsite=False):
         """
         Extracts relevant parameters from a forum URL.
 
         """
-        base_url = ".+" if allow_offsite else re.escape(settings.FORUM_URL)
-        for regex in cls.object_id_regexen:
-            url_regex = re.compile(r'^(?:https?://(?:www\.)?%s|/(?:index\.php\?)?)?%s' % (base_url, regex), re.U)
-            match = url_regex.match(url)
-            if match and match.group(1):  # The URL is invalid if the object ID match is zero-length
-                return match.groupdict()
-        else:
+        resolved = resolve_url(url, allow_offsite)
+        params = cls.get_params_from_resolved(resolved) if resolved else None
+        if params is None:
             raise ValueError(u"Invalid %s URL (%s)." % (cls.__name__, url))
+        return params
+
+    @classmethod
+    def get_params_from_resolved(cls, resolved):
+        """
+        Returns the parameters for this type of page from a ResolvedURL,
+        or None if the URL isn't to this type of page.
+
+        """
+        return None
 
     def load_object(self, save=True, object_type=None):
         """
@@ -136,7 +219,11 @@ class ForumPage(object):
 
         """
         if self._soup is None:
-            self._soup = get_soup(self.get_url())
+            if self._html is not None:
+                self._soup = BeautifulSoup(self._html, HTML_PARSER)
+                self._html = None
+            else:
+                self._soup = get_soup(self.get_url(), self.page_type, self.force_download)
         return self._soup
 
 
@@ -177,6 +264,51 @@ class MemberQuerySet(models.QuerySet):
         latest_guest = self.guests().order_by('-user_id').first()
         return latest_guest.user_id + 1 if latest_guest else 1000000
 
+    def _find_authors(self, user_ids, guest_names):
+        members = self.filter(Q(user_id__in=user_ids) | Q(user_id__gte=1000000, username__in=guest_names)).order_by('user_id')
+        by_id = {}
+        guests = {}
+        for member in members:
+            by_id[member.user_id] = member
+            if member.is_guest():
+                guests.setdefault(member.username, member)
+        return by_id, guests
+
+    def resolve_authors(self, authors):
+        """
+        Takes an iterable of (user ID, username) pairs as found on a forum
+        page - where the user ID is None for guests - and returns a
+        dictionary mapping each pair to a Member. Existing members are
+        fetched in one query, and any missing ones are created in bulk.
+
+        """
+        authors = set(authors)
+        user_ids = {user_id for user_id, username in authors if user_id is not None}
+        guest_names = {username for user_id, username in authors if user_id is None}
+
+        by_id, guests = self._find_authors(user_ids, guest_names)
+
+        new_members = {user_id: Member(user_id=user_id, username=username) for user_id, username in authors if user_id is not None and user_id not in by_id}
+        missing_guests = sorted(guest_names - set(guests))
+        if missing_guests:
+            next_guest_id = self.get_next_guest_id()
+            for i, username in enumerate(missing_guests):
+                new_members[next_guest_id + i] = Member(user_id=next_guest_id + i, username=username)
+
+        if new_members:
+            # Another worker may have created some of these in the meantime,
+            # so ignore conflicts and then fetch what actually got saved.
+            self.bulk_create(new_members.values(), ignore_conflicts=True)
+            by_id, guests = self._find_authors(user_ids, guest_names)
+            for username in guest_names - set(guests):
+                # Our guest ID was taken by a different guest; fall back to
+                # creating this one the slow way.
+                guest = Member(username=username)
+                guest.save()
+                guests[username] = guest
+
+        return {(user_id, username): by_id[user_id] if user_id is not None else guests[username] for user_id, username in authors}
+
 
 class Member(ForumObject, models.Model):
     user_id = models.PositiveIntegerField(unique=True, primary_key=True)
@@ -186,6 +318,12 @@ class Member(ForumObject, models.Model):
 
     class Meta:
         ordering = ['username']
+        indexes = [
+            # For case-insensitive prefix searches (see
+            # ForumObjectSearchView); created with text_pattern_ops on
+            # PostgreSQL by the migration
+            models.Index(Upper('username'), name='member_username_upper_idx'),
+        ]
 
     def __str__(self):
         return self.username
@@ -222,18 +360,24 @@ class Member(ForumObject, models.Model):
 
 
 class MemberPage(ForumPage):
-    object_id_regexen = [r'members/(?:[^&.]*\.)?(?P<user_id>\d+)']
     object_class = Member
+    page_type = 'member'
+
+    @classmethod
+    def get_params_from_resolved(cls, resolved):
+        if resolved.kind != 'member':
+            return None
+        return {'user_id': resolved.user_id}
 
     @classmethod
-    def from_params(self, save=False, force_download=False, url=None, object_type=None, **kwargs):
-        if url and not url.endswith('/about/'):
-            # Trim off fragment identifier, if any
-            # Allows app to accept e.g. https://forums.example.com/index.php?members/negrek.1/#about
-            if url.rfind('#') > -1:
-                url = url[:url.rfind('#')]
-            url += '/about/'
-        return super(MemberPage, self).from_params(save, force_download, url, object_type, **kwargs)
+    def get_fetch_url(cls, url):
+        # Always fetch the About tab of the profile, whatever part of the
+        # profile we were given a link to
+        # (e.g. https://forums.example.com/index.php?members/negrek.1/#about)
+        resolved = resolve_url(url)
+        if resolved is None or resolved.kind != 'member':
+            return url
+        return u"https://%smembers/%s/about/" % (settings.FORUM_URL, resolved.user_id)
 
     def get_bio(self):
         soup = self.get_soup()
@@ -257,8 +401,10 @@ class MemberPage(ForumPage):
             if hasattr(settings, 'FORUM_API_KEY'):
                 try:
                     username, _ = get_user_info(self.object.user_id)
-                except Exception as e:
+                except ForumAPINotFound:
                     raise ValidationError("This user does not seem to exist! Please verify that you've got the correct link.")
+                except ForumAPIError:
+                    raise ValidationError("Could not fetch user profile! Please try again in a little while.")
             else:
                 raise ValidationError("Could not fetch user profile! Please verify that you've got the correct link.")
         else:
@@ -295,9 +441,11 @@ class User(AbstractUser):
     def validate_verification_code(self, page):
         member = page.object
         if hasattr(settings, 'FORUM_API_KEY'):
-            username, verification_code = get_user_info(page.object.user_id)
-
-            if verification_code is None:
+            try:
+                # The user has probably only just updated their profile, so
+                # don't go by a cached copy
+                username, verification_code = get_user_info(page.object.user_id, use_cache=False)
+            except ForumAPIError:
                 raise ValidationError("Could not fetch verification code from your profile! Please contact %s staff for assistance." % settings.FORUM_NAME)
 
             if self.verification_code != verification_code.strip():
@@ -360,6 +508,10 @@ class Fic(ForumObject, models.Model):
     class Meta:
         unique_together = ['thread_id', 'post_id']
         ordering = ['title', 'thread_id', 'post_id']
+        indexes = [
+            # As for Member.username
+            models.Index(Upper('title'), name='fic_title_upper_idx'),
+        ]
 
     def __str__(self):
         return u"%s by %s" % (self.title, self.get_author_names())
@@ -420,13 +572,27 @@ class Fic(ForumObject, models.Model):
 
 
 class ThreadIterator:
+    """
+    Iterates over the posts of a thread, starting from the given post.
+
+    If prefetch is more than zero, up to that many of the following pages
+    are fetched on a small thread pool while the caller works through the
+    current page, so walking a whole thread isn't held up waiting on the
+    forum for every single page. The pool is shut down once the posts run
+    out; if you might stop before then, use the iterator as a context
+    manager (or call close()) so that it's shut down regardless.
+
+    """
     page = None
     page_posts = None
     index = None
+    prefetch = 0
+    executor = None
 
-    def __init__(self, page, post_id):
+    def __init__(self, page, post_id, prefetch=0):
         self.page = page
         self.page_posts = page.get_page_posts()
+        self.page.index_posts()
         for i, post in enumerate(self.page_posts):
             if post.post_id == post_id:
                 self.index = i
@@ -434,20 +600,91 @@ class ThreadIterator:
         else:
             self.index = 0
 
+        # Prefetching goes by page number, so we need to know the thread
+        self.first_page = page
+        self.pending = {}
+        if prefetch > 0 and page.object.thread_id:
+            self.prefetch = prefetch
+            self.executor = ThreadPoolExecutor(max_workers=min(prefetch, settings.FORUM_POOL_SIZE), thread_name_prefix='thread-prefetch')
+            self.schedule()
+
+    def __iter__(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
     def __next__(self):
         if self.index >= len(self.page_posts):
-            if not self.page.has_next_page():
+            try:
+                page = self.get_next_page()
+            except Exception:
+                self.close()
+                raise
+            if page is None:
+                self.close()
                 raise StopIteration
 
-            self.page = self.page.get_next_page()
+            self.page = page
             self.page_posts = self.page.get_page_posts()
             if len(self.page_posts) == 0:
+                self.close()
                 raise StopIteration
+            self.page.index_posts()
             self.index = 0
+            self.schedule()
         post = self.page_posts[self.index]
         self.index += 1
         return post
 
+    def fetch_page(self, number):
+        try:
+            page = self.first_page.get_page_by_number(number)
+            page.get_snapshot()
+            return page
+        finally:
+            # Worker threads get their own database connections (for the
+            # page cache); don't leave them lying around.
+            connections.close_all()
+
+    def schedule(self):
+        if not self.executor:
+            return
+        current = self.page.get_page_number()
+        last = self.page.get_last_page_number()
+        for number in range(current + 1, min(current + self.prefetch, last) + 1):
+            if number not in self.pending:
+                self.pending[number] = self.executor.submit(self.fetch_page, number)
+
+    def get_next_page(self):
+        if not self.executor:
+            return self.page.get_next_page()
+
+        if not self.page.has_next_page():
+            return None
+        number = self.page.get_page_number() + 1
+        future = self.pending.pop(number, None)
+        page = future.result() if future else self.first_page.get_page_by_number(number)
+        if page.get_page_number() != number:
+            # The thread must have shrunk (posts deleted) since we last
+            # looked; we'd only be seeing posts we've already seen.
+            return None
+        return page
+
+    def close(self):
+        """
+        Shuts down the prefetching, cancelling any page fetches that
+        haven't started yet.
+
+        """
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        self.pending = {}
+
 
 class Thread:
     thread_id = None
@@ -485,59 +722,102 @@ class Thread:
 
 
 class ThreadPage(ForumPage):
-    # Matches URL queries for threads/posts including
-    # - threads/<threadid>/
-    # - threads/<threadid>/unread
-    # - threads/fic-title.<threadid>/
-    # - threads/<threadid>/#post-<postid>
-    # - threads/<threadid>/page-2#post-<postid>
-    # - posts/<postid>/
-    # ...which should cover every sensible URL a person could enter for a
-    # XenForo thread/post.
-    object_id_regexen = [
-        r'threads/(?:[^&.]*\.)?(?P<thread_id>\d+)(?:/page-\d+|/unread)?/?(?:#?post-(?P<post_id>\d+))?',
-        r'posts/(?P<post_id>\d+)'
-    ]
-
     object_class = Thread
+    page_type = 'thread'
 
-    _pagination = None
+    _snapshot = None
+    _post_authors = None
+    _indexed = False
+
+    @classmethod
+    def get_params_from_resolved(cls, resolved):
+        # Any thread or post URL will do
+        if resolved.kind == 'thread':
+            return {'thread_id': resolved.thread_id, 'post_id': resolved.post_id}
+        elif resolved.kind == 'post':
+            return {'post_id': resolved.post_id}
+        return None
 
     def __iter__(self):
-        return ThreadIterator(self, self.object.post_id)
+        return self.iter_posts()
+
+    def iter_posts(self, prefetch=None):
+        """
+        Returns an iterator over the posts of the thread from this page
+        onward, fetching up to prefetch pages ahead in the background
+        (FORUM_PREFETCH_PAGES by default; 0 to fetch pages one by one).
+
+        """
+        if prefetch is None:
+            prefetch = settings.FORUM_PREFETCH_PAGES
+        return ThreadIterator(self, self.object.post_id, prefetch)
 
     def get_page_class(self):
         return ThreadPage
 
+    def get_snapshot(self):
+        """
+        Returns the parsed contents of this page, parsing it (and
+        fetching it, if need be) the first time. The soup/HTML is
+        dropped once parsed.
+
+        """
+        if self._snapshot is None:
+            if self._soup is not None:
+                markup = self._soup
+            elif self._html is not None:
+                markup = self._html
+            else:
+                markup = get_html(self.get_url(), self.page_type, self.force_download)
+            self._snapshot = parse_thread_page(markup)
+            self._soup = None
+            self._html = None
+        return self._snapshot
+
     def get_forum_link(self):
-        return self.get_soup().find(class_="p-breadcrumbs").find_all('li')[-1].a['href']
+        return self.get_snapshot().forum_link
 
     def is_fic(self):
         return self.get_forum_link() in settings.VALID_FIC_FORUMS
 
     def get_pagination(self):
-        if not self._pagination:
-            soup = self.get_soup()
-            self._pagination = soup.find('nav', class_="pageNavWrapper")
-        return self._pagination
-
-    def get_page(self, page_link):
-        page = self.get_page_class().from_url(u"https://{}{}".format(settings.FORUM_URL.rsplit('/', 1)[0], page_link['href']), force_download=True)
-        # Override the object (but not the soup)
-        page.object = self.object
-        return page
+        return self.get_snapshot().pagination
+
+    def get_page_at_url(self, url):
+        # Other pages of the thread belong to the same object, so there's
+        # no need to look the object up or load it again; just fetch the
+        # page (through the page cache, unless we're forcing downloads).
+        page_class = self.get_page_class()
+        return page_class(self.object, html=get_html(url, page_class.page_type, self.force_download), force_download=self.force_download)
+
+    def get_page(self, href):
+        return self.get_page_at_url(u"https://{}{}".format(settings.FORUM_URL.rsplit('/', 1)[0], href))
+
+    def get_page_by_number(self, number):
+        """
+        Returns the given page of this thread, fetched directly by its
+        page-N URL rather than by following pagination links. The forum
+        gives us the last page if the number is past the end.
+
+        """
+        if number == self.get_page_number():
+            return self
+        url = u"https://{}threads/{}/".format(settings.FORUM_URL, self.object.thread_id)
+        if number > 1:
+            url += u"page-{}".format(number)
+        return self.get_page_at_url(url)
 
     def get_last_page(self):
         pagination = self.get_pagination()
-        if pagination is None:
+        if pagination is None or not pagination.last_href or pagination.current_page == pagination.last_page:
             return self
-        page_links = [link for link in pagination.ul.find_all('li') if "pageNav-page--skip" not in link['class']]
-        last_page_link = page_links[-1].a if page_links else None
+        return self.get_page(pagination.last_href)
 
-        if last_page_link:
-            return self.get_page(last_page_link)
-        else:
-            return self
+    def get_last_page_number(self):
+        pagination = self.get_pagination()
+        if pagination is None:
+            return 1
+        return pagination.last_page
 
     def has_pages(self):
         pagination = self.get_pagination()
@@ -545,76 +825,79 @@ class ThreadPage(ForumPage):
 
     def has_next_page(self):
         pagination = self.get_pagination()
-        if pagination is None:
-            return False
-        nextlink = pagination.find('a', class_="pageNav-jump--next")
-        return bool(nextlink)
+        return pagination is not None and pagination.next_href is not None
 
     def has_prev_page(self):
         pagination = self.get_pagination()
-        if pagination is None:
-            return False
-        prevlink = pagination.find('a', string="pageNav-jump--prev")
-        return bool(prevlink)
+        return pagination is not None and pagination.prev_href is not None
 
     def get_page_number(self):
         pagination = self.get_pagination()
         if pagination is None:
             return 1
-        pagelink = pagination.find('li', class_="pageNav-page--current").a
-        if pagelink:
-            return int(pagelink.get_text(strip=True))
-        else:
-            return 1
+        return pagination.current_page
 
     def get_next_page(self):
-        pagination = self.get_pagination()
-        if pagination is None:
-            return None
-        nextlink = pagination.find('a', class_="pageNav-jump--next")
-        if nextlink:
-            return self.get_page(nextlink)
+        if self.has_next_page():
+            return self.get_page(self.get_pagination().next_href)
         else:
             return None
 
     def get_prev_page(self):
-        pagination = self.get_pagination()
-        if pagination is None:
-            return None
-        prevlink = pagination.find('a', string="pageNav-jump--prev")
-        if prevlink:
-            return self.get_page(prevlink)
+        if self.has_prev_page():
+            return self.get_page(self.get_pagination().prev_href)
         else:
             return None
 
     def get_post(self):
+        snapshot = self.get_snapshot()
         if self.object.post_id:
-            return Post(self, self.get_soup().find(id="js-post-%s" % self.object.post_id))
+            post = snapshot.get_post(int(self.object.post_id))
         else:
-            return Post(self, self.get_soup().find(class_="block--messages").find('article'))
+            post = snapshot.posts[0] if snapshot.posts else None
+        return Post(self, post) if post else None
 
     def get_page_posts(self):
-        soup = self.get_soup()
-        return [Post(self, post, post_index=i) for i, post in enumerate(soup.find(class_="block--messages").find_all('article', class_="message--post"))]
+        return [Post(self, post, post_index=i) for i, post in enumerate(self.get_snapshot().posts)]
+
+    def get_thread_link(self):
+        return self.get_snapshot().thread_link
+
+    def get_post_authors(self):
+        """
+        Returns a dictionary mapping the (user ID, username) of each
+        post author on this page to their Member, resolving them all at
+        once the first time it's called.
+
+        """
+        if self._post_authors is None:
+            self._post_authors = Member.objects.resolve_authors((post.author_id, post.author_name) for post in self.get_snapshot().posts)
+        return self._post_authors
+
+    def index_posts(self):
+        """
+        Records the posts on this page in the thread post index (see
+        ThreadIndex), if we haven't already.
+
+        """
+        if not self._indexed and self.object.thread_id:
+            ThreadIndex.objects.index_page(self)
+            self._indexed = True
 
     def get_title(self):
-        return self.get_soup().find('h1', class_="p-title-value").find(text=True, recursive=False)
+        return self.get_snapshot().title
 
     def get_prefix(self):
-        prefix_label = self.get_soup().find('h1', class_="p-title-value").find(class_="label")
-        return prefix_label.get_text() if prefix_label else ''
+        return self.get_snapshot().prefix
 
     def load_object(self, save=True, object_type=None):
         if self.object.thread_id is None and self.object.post_id is None:
             raise ValidationError(u"No parameters given.")
 
-        soup = self.get_soup()
-
         thread_title = self.get_title()
 
         if self.object.thread_id is None:
-            thread_link = soup.find(class_="message-attribution-main").a
-            self.object.thread_id = self.__class__.get_params_from_url(thread_link['href'])['thread_id']
+            self.object.thread_id = self.__class__.get_params_from_url(self.get_thread_link())['thread_id']
 
         if object_type != 'post':
             self.object.post_id = None
@@ -671,10 +954,13 @@ class FicTag(models.Model):
 
 
 class Post(object):
-    def __init__(self, page, post_soup, post_index=None):
+    """
+    A post on a thread page, backed by the PostSnapshot parsed from it.
+
+    """
+    def __init__(self, page, snapshot, post_index=None):
         self.page = page
-        self._soup = post_soup
-        self._body_text = None
+        self.snapshot = snapshot
         self.post_index = post_index
 
     def __str__(self):
@@ -685,65 +971,44 @@ class Post(object):
 
     @property
     def post_id(self):
-        return int(self._soup['id'][8:])
+        return self.snapshot.post_id
 
     @property
     def posted_date(self):
-        date_elem = self._soup.find(class_="message-attribution-main").time
-
-        return datetime.fromtimestamp(int(date_elem['data-time']), timezone.utc)
-
-    @property
-    def body_text(self):
-        if self._body_text is not None:
-            return self._body_text
-        post_body = self._soup.find(class_="message-body")
-        for blockquote in post_body.find_all("blockquote"):
-            blockquote.decompose()
-        self._body_text = post_body.get_text()
-        return self._body_text
+        return self.snapshot.posted_date
 
     @property
     def word_count(self):
-        return len(self.body_text.split())
+        return self.snapshot.word_count
 
     @property
     def author(self):
-        user_elem = self._soup.find('h4', class_="message-name")
-        if user_elem.a:
-            # It's a registered user's linked username
-            username = user_elem.a.get_text(strip=True)
-            try:
-                user_id = int(MemberPage.get_params_from_url(user_elem.a['href'])['user_id'])
-            except ValueError:
-                # It's a deleted post and we can't get a proper URL - let's make it a guest.
-                user_id = None
-        else:
-            # It's (presumably) a guest
-            username = user_elem.span.get_text(strip=True)
-            user_id = None
-        member, created = Member.objects.get_or_create(user_id=user_id, defaults={"username": username})
-        return member
+        return self.page.get_post_authors()[(self.snapshot.author_id, self.snapshot.author_name)]
 
     @property
     def threadmark_title(self):
-        threadmark_elem = self._soup.find(class_="threadmarkLabel")
-        return threadmark_elem.get_text() if threadmark_elem else ""
+        return self.snapshot.threadmark_title
 
 
 class PostPage(ThreadPage):
-    object_id_regexen = (
-        r'threads/(?:[^&.]*\.)?(?:\d+)(?:/page-\d+|/unread)?/?(?:#?post-(?P<post_id>\d+))',
-        r'posts/(?P<post_id>\d+)'
-    )
+    page_type = 'post'
+
+    @classmethod
+    def get_params_from_resolved(cls, resolved):
+        # Thread URLs will only do if they're to a particular post
+        if resolved.kind in ('thread', 'post') and resolved.post_id:
+            return {'post_id': resolved.post_id}
+        return None
 
     @classmethod
     def from_params(cls, save=False, force_download=False, url=None, object_type=None, **kwargs):
         return super().from_params(save, force_download, url, 'post', **kwargs)
 
-    def load_object(self, save=True, object_type=None, allow_offsite=False):
-        soup = self.get_soup()
+    @classmethod
+    def find_object(cls, object_type=None, **kwargs):
+        return super().find_object('post', **kwargs)
 
+    def load_object(self, save=True, object_type=None, allow_offsite=False):
         post = self.get_post()
         self.object.author = post.author
         self.object.posted_date = post.posted_date
@@ -751,10 +1016,10 @@ class PostPage(ThreadPage):
         if hasattr(self.object, 'threadmark_title'):
             self.object.threadmark_title = post.threadmark_title
 
-        thread_link = soup.find(class_="message-attribution-main").a
+        thread_link = self.get_thread_link()
         if not thread_link:
             raise ValidationError("Could not fetch forum thread.")
-        self.object.thread_id = ThreadPage.get_params_from_url(thread_link['href'])['thread_id']
+        self.object.thread_id = ThreadPage.get_params_from_url(thread_link)['thread_id']
 
         if save:
             self.object.save()
@@ -800,7 +1065,7 @@ class ReviewPage(PostPage):
         self.object = super(ReviewPage, self).load_object(save=False, allow_offsite=allow_offsite)
 
         if not allow_offsite:
-            thread_params = ThreadPage.get_params_from_url(self.get_soup().find(class_="message-attribution-main").a["href"])
+            thread_params = ThreadPage.get_params_from_url(self.get_thread_link())
             self.object.fic = FicPage.from_params(thread_id=thread_params["thread_id"], save=True).object
 
         self.object.chapters = 1
@@ -851,7 +1116,7 @@ class ChapterPage(PostPage):
 
         self.object = super(ChapterPage, self).load_object(save=False)
 
-        thread_params = ThreadPage.get_params_from_url(self.get_soup().find(class_="message-attribution-main").a["href"])
+        thread_params = ThreadPage.get_params_from_url(self.get_thread_link())
         self.object.fic = FicPage.from_params(thread_id=thread_params["thread_id"], save=True).object
 
         if self.object.author not in self.object.fic.get_authors():
@@ -861,3 +1126,408 @@ class ChapterPage(PostPage):
             self.object.save()
 
         return self.object
+
+
+page_fetches = SingleFlight()
+
+
+class CachedPageManager(models.Manager):
+    def fetch(self, url, page_type, force_download=False):
+        """
+        Returns the HTML for the given forum URL, reading through the
+        cache. Entries older than the TTL for their page type are
+        revalidated with the forum (using ETag/Last-Modified if we got
+        them) rather than downloaded again outright.
+
+        Identical fetches are coalesced: threads in this process asking
+        for the same page at the same time share one fetch, and only one
+        worker process at a time fetches any given page - the rest wait
+        for it and then read its result from the cache.
+
+        """
+        url = canonical_url(url)
+        return page_fetches.do((url, force_download), self._fetch, url, page_type, force_download)
+
+    def _fetch(self, url, page_type, force_download):
+        started = datetime.now(timezone.utc)
+        entry = self.filter(url=url).first()
+        if entry is not None and not force_download and entry.is_fresh(started):
+            return entry.content
+
+        with key_lock('fetch', url):
+            # Someone else may have fetched the page while we were waiting
+            # for the lock. If we're forcing a download, it has to have
+            # been fetched since we were asked for it.
+            entry = self.filter(url=url).first()
+            if entry is not None and (entry.fetched_date >= started if force_download else entry.is_fresh()):
+                return entry.content
+            return self._download(url, page_type, entry, force_download)
+
+    def _download(self, url, page_type, entry, force_download):
+        now = datetime.now(timezone.utc)
+        headers = {}
+        if entry is not None and not force_download:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+
+        response = fetch(url, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            entry.fetched_date = now
+            entry.save(update_fields=['fetched_date'])
+            return entry.content
+
+        if response.status_code == 200:
+            # Only cache successful responses - we don't want to hang on to
+            # an error page for the whole TTL.
+            with write_transaction():
+                self.update_or_create(url=url, defaults={
+                    'page_type': page_type,
+                    'content': response.text,
+                    'etag': response.headers.get('ETag', ''),
+                    'last_modified': response.headers.get('Last-Modified', ''),
+                    'fetched_date': now,
+                })
+        return response.text
+
+    def purge(self, age=None):
+        """
+        Deletes cached pages that were last fetched more than age seconds
+        (FORUM_PAGE_CACHE_MAX_AGE by default) ago. The TTLs only decide
+        when a page is revalidated, so without this the cache would just
+        keep growing.
+
+        """
+        if age is None:
+            age = settings.FORUM_PAGE_CACHE_MAX_AGE
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=age)
+        return self.filter(fetched_date__lt=cutoff).delete()
+
+
+class CachedPage(models.Model):
+    """
+    A cached copy of a page fetched from the forum, shared between all
+    workers. How long a page is considered fresh depends on its type;
+    see the FORUM_PAGE_CACHE_TTL setting.
+
+    """
+    url = models.CharField(max_length=500, unique=True)
+    page_type = models.CharField(max_length=10)
+    content = models.TextField()
+    etag = models.CharField(max_length=255, blank=True)
+    last_modified = models.CharField(max_length=64, blank=True)
+    fetched_date = models.DateTimeField(db_index=True)
+
+    objects = CachedPageManager()
+
+    def __str__(self):
+        return u"Cached %s page %s (fetched %s)" % (self.page_type, self.url, self.fetched_date)
+
+    def is_fresh(self, now=None):
+        ttl = settings.FORUM_PAGE_CACHE_TTL.get(self.page_type, 0)
+        return (now or datetime.now(timezone.utc)) - self.fetched_date < timedelta(seconds=ttl)
+
+
+class ThreadIndexManager(models.Manager):
+    def index_page(self, page):
+        """
+        Records the posts on the given ThreadPage in the index for its
+        thread, and returns the ThreadIndex.
+
+        If the page's posts don't match what we have for it (posts were
+        deleted or moved since), the ones that are gone are dropped, and
+        the pages after it are marked as needing another crawl, since
+        their posts will have shifted too. If nothing has changed, nothing
+        is written.
+
+        """
+        thread_id = page.object.thread_id
+        number = page.get_page_number()
+        last_page = page.get_last_page_number()
+        authors = page.get_post_authors()
+        posts = [
+            IndexedPost(
+                post_id=post.post_id,
+                thread_id=thread_id,
+                author=authors[(post.author_id, post.author_name)],
+                posted_date=post.posted_date,
+                page=number,
+                word_count=post.word_count,
+                threadmark_title=post.threadmark_title or '',
+            ) for post in page.get_snapshot().posts
+        ]
+        fields = ('post_id', 'author_id', 'posted_date', 'word_count', 'threadmark_title')
+        fetched = {tuple(getattr(post, field) for field in fields) for post in posts}
+
+        index = self.filter(thread_id=thread_id).first()
+        if index is not None:
+            stored = set(IndexedPost.objects.filter(thread=index, page=number).values_list(*fields))
+            if stored == fetched and index.last_page == last_page and number != index.crawled_pages + 1:
+                # Nothing new; don't hold up everyone else with a write
+                return index
+
+        with write_transaction():
+            index, created = self.select_for_update().get_or_create(thread_id=thread_id)
+            post_ids = [post.post_id for post in posts]
+            moved = index.posts.filter(page=number).exclude(post_id__in=post_ids).delete()[0] > 0 or \
+                index.posts.filter(post_id__in=post_ids).exclude(page=number).exists()
+            IndexedPost.objects.bulk_create(posts, update_conflicts=True, unique_fields=['post_id'], update_fields=['thread', 'author', 'posted_date', 'page', 'word_count', 'threadmark_title'])
+
+            index.last_page = last_page
+            if number <= index.crawled_pages + 1:
+                if moved:
+                    # This page is up to date, but the ones after it can't
+                    # be trusted until they've been crawled again
+                    index.crawled_pages = number
+                else:
+                    # See how far we can now get from the first page without
+                    # any gaps (other pages may have been indexed out of
+                    # order)
+                    indexed_pages = set(index.posts.filter(page__gt=number).values_list('page', flat=True).distinct())
+                    index.crawled_pages = max(index.crawled_pages, number)
+                    while index.crawled_pages + 1 in indexed_pages:
+                        index.crawled_pages += 1
+            index.save()
+        return index
+
+    def invalidate(self, thread_ids):
+        """
+        Forgets everything in the index about the given threads, so that
+        they're crawled again from the start the next time they're
+        needed.
+
+        """
+        return self.filter(thread_id__in=thread_ids).delete()
+
+
+class ThreadIndex(models.Model):
+    """
+    How much of a thread we have in the post index. Pages 1 through
+    crawled_pages have all been indexed; last_page is how many pages the
+    thread had when we last looked.
+
+    Pages other than the last don't change (short of posts being deleted
+    or moved), so after the first crawl we only ever need to fetch the
+    pages we haven't seen yet to bring the index up to date.
+
+    """
+    thread_id = models.PositiveIntegerField(primary_key=True)
+    crawled_pages = models.PositiveIntegerField(default=0)
+    last_page = models.PositiveIntegerField(default=0)
+    updated_date = models.DateTimeField(auto_now=True)
+
+    objects = ThreadIndexManager()
+
+    class Meta:
+        verbose_name_plural = "thread indexes"
+
+    def __str__(self):
+        return u"Index of thread %s (%s/%s pages)" % (self.thread_id, self.crawled_pages, self.last_page)
+
+    def get_resume_page(self):
+        """
+        Returns the first page we need to fetch to bring the index up to
+        date: the one after the last we've crawled, or the last one again
+        if it was the end of the thread (it may have gained posts since).
+
+        """
+        if self.crawled_pages >= self.last_page:
+            return max(self.crawled_pages, 1)
+        return self.crawled_pages + 1
+
+    def top_up(self, page):
+        """
+        Fetches and indexes the pages of the thread past the ones we've
+        already crawled, given any page of the thread.
+
+        """
+        start_page = page.get_page_by_number(self.get_resume_page())
+        with start_page.iter_posts() as posts:
+            for post in posts:
+                # Iterating over the pages indexes them
+                pass
+        self.refresh_from_db()
+
+    def is_complete(self):
+        return self.crawled_pages >= self.last_page > 0
+
+    def get_author_posts(self, author_ids):
+        return self.posts.filter(author_id__in=author_ids)
+
+    def has_author_post_between(self, author_ids, start, end):
+        return self.get_author_posts(author_ids).filter(posted_date__gte=start, posted_date__lt=end).exists()
+
+    def get_author_post_dates(self, author_ids):
+        """
+        Returns the dates of the first and last posts by the given
+        authors that we have in the index, or (None, None).
+
+        """
+        dates = self.get_author_posts(author_ids).aggregate(first=models.Min('posted_date'), last=models.Max('posted_date'))
+        return dates['first'], dates['last']
+
+    def get_chapters(self, author_ids=None):
+        """
+        Returns the indexed threadmarked posts in the thread (by the given
+        authors, if any), oldest first.
+
+        """
+        posts = self.posts.exclude(threadmark_title='')
+        if author_ids is not None:
+            posts = posts.filter(author_id__in=author_ids)
+        return posts.order_by('posted_date', 'post_id')
+
+
+class IndexedPost(models.Model):
+    """
+    A post in the thread post index, with just enough about it to answer
+    questions about a thread (like when its author last posted, or what
+    chapters it has) without going to the forum.
+
+    """
+    post_id = models.PositiveIntegerField(primary_key=True)
+    thread = models.ForeignKey(ThreadIndex, related_name='posts', on_delete=models.CASCADE)
+    author = models.ForeignKey(Member, related_name='indexed_posts', on_delete=models.CASCADE)
+    posted_date = models.DateTimeField()
+    page = models.PositiveIntegerField()
+    word_count = models.PositiveIntegerField()
+    threadmark_title = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        ordering = ('post_id',)
+        indexes = [
+            models.Index(fields=['thread', 'page']),
+            models.Index(fields=['thread', 'author', 'posted_date']),
+        ]
+
+    def __str__(self):
+        return u"Post #%s by %s in thread %s (page %s)" % (self.post_id, self.author_id, self.thread_id, self.page)
+
+    @property
+    def is_threadmarked(self):
+        return bool(self.threadmark_title)
+
+
+class LookupJobManager(models.Manager):
+    def enqueue(self, view, url, object_type=None):
+        """
+        Queues a lookup of the given URL through the given lookup view
+        (see ForumObjectLookupView) and returns the job. If the same
+        lookup is already queued or running, that job is returned instead.
+
+        """
+        params = {
+            'view': '%s.%s' % (view.__class__.__module__, view.__class__.__qualname__),
+            'model': view.model._meta.label,
+            'url': url,
+            'object_type': object_type or '',
+        }
+        job = self.filter(status__in=(LookupJob.PENDING, LookupJob.RUNNING), **params).first()
+        if job is None:
+            job = self.create(**params)
+        return job
+
+    def claim(self, limit):
+        """
+        Marks up to limit of the oldest pending jobs as running and
+        returns them, making sure no other worker gets the same jobs.
+
+        """
+        with write_transaction():
+            pks = list(self.select_for_update(skip_locked=True).filter(status=LookupJob.PENDING).order_by('created_date').values_list('pk', flat=True)[:limit])
+            self.filter(pk__in=pks).update(status=LookupJob.RUNNING, started_date=datetime.now(timezone.utc))
+        return list(self.filter(pk__in=pks).order_by('created_date'))
+
+    def requeue_stale(self, timeout):
+        """
+        Puts jobs that have been running for longer than timeout seconds
+        (presumably because their worker died) back in the queue.
+
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=timeout)
+        return self.filter(status=LookupJob.RUNNING, started_date__lt=cutoff).update(status=LookupJob.PENDING, started_date=None)
+
+    def purge(self, age):
+        """
+        Deletes finished jobs older than age seconds; nobody is going to
+        ask about them any more.
+
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=age)
+        return self.filter(status__in=(LookupJob.DONE, LookupJob.FAILED), finished_date__lt=cutoff).delete()
+
+
+class LookupJob(models.Model):
+    """
+    A queued lookup of a forum object by URL, so that fetching it from the
+    forum doesn't hold up a web worker. Jobs are processed by the
+    process_lookups management command; the result is the JSON the lookup
+    view would have returned.
+
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, u"Pending"),
+        (RUNNING, u"Running"),
+        (DONE, u"Done"),
+        (FAILED, u"Failed"),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    view = models.CharField(max_length=200)
+    model = models.CharField(max_length=100)
+    url = models.CharField(max_length=500)
+    object_type = models.CharField(max_length=20, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    result = models.TextField(blank=True)
+    created_date = models.DateTimeField(auto_now_add=True)
+    started_date = models.DateTimeField(blank=True, null=True)
+    finished_date = models.DateTimeField(blank=True, null=True)
+
+    objects = LookupJobManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_date']),
+        ]
+
+    def __str__(self):
+        return u"Lookup of %s (%s)" % (self.url, self.status)
+
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    def get_result(self):
+        return json.loads(self.result) if self.result else None
+
+    def run(self):
+        """
+        Does the lookup and saves the result.
+
+        """
+        view_class = import_string(self.view)
+        view = view_class(model=apps.get_model(self.model))
+        try:
+            result = view.lookup(self.url, self.object_type or None)
+        except Exception:
+            logger.exception(u"Lookup of %s failed", self.url)
+            self.fail()
+        else:
+            self.finish(self.DONE, result)
+
+    def fail(self):
+        """
+        Marks the lookup as failed.
+
+        """
+        self.finish(self.FAILED, {'error': u"Lookup failed. Please try again later."})
+
+    def finish(self, status, result):
+        self.status = status
+        self.result = json.dumps(result)
+        self.finished_date = datetime.now(timezone.utc)
+        self.save(update_fields=['status', 'result', 'finished_date'])
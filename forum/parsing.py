@@ -0,0 +1,204 @@
+"""
+Single-pass parsing of forum thread pages.
+
+Rather than keeping a full BeautifulSoup tree around and searching it
+again every time we want to know something about a post, thread pages
+are parsed once - only the parts of the page we actually use are built
+into a tree at all - and boiled down to a few small immutable records.
+The parse tree is thrown away as soon as we're done with it.
+
+"""
+import re
+from datetime import datetime, timezone
+from importlib.util import find_spec
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+
+# lxml is considerably faster than the built-in parser, so use it if it's
+# installed.
+HTML_PARSER = 'lxml' if find_spec('lxml') else 'html.parser'
+
+member_link_regex = re.compile(r'^(?:https?://[^?#]+?/|/)?(?:index\.php\?)?members/(?:[^&.]*\.)?(?P<user_id>\d+)', re.U)
+
+
+class Snapshot(object):
+    """
+    A base class for immutable, slotted records of parsed page data.
+
+    """
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            object.__setattr__(self, name, kwargs.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(u"%s is immutable." % self.__class__.__name__)
+
+    def __delattr__(self, name):
+        raise AttributeError(u"%s is immutable." % self.__class__.__name__)
+
+    def __repr__(self):
+        return u'<%s %s>' % (self.__class__.__name__, u', '.join(u'%s=%r' % (name, getattr(self, name)) for name in self.__slots__))
+
+
+class PostSnapshot(Snapshot):
+    """
+    The parts of a post we care about. author_id is None for guests (and
+    for posts whose author we can't link to, e.g. deleted users).
+
+    """
+    __slots__ = ('post_id', 'author_id', 'author_name', 'posted_date', 'word_count', 'threadmark_title')
+
+
+class PaginationSnapshot(Snapshot):
+    """
+    A summary of a thread page's page navigation. The hrefs are the
+    paths as they appear on the page, or None if there is no such link.
+
+    """
+    __slots__ = ('current_page', 'last_page', 'next_href', 'prev_href', 'last_href')
+
+
+class ThreadPageSnapshot(Snapshot):
+    """
+    Everything we use from a single page of a thread. pagination is None
+    if the thread only has one page.
+
+    """
+    __slots__ = ('title', 'prefix', 'forum_link', 'thread_link', 'pagination', 'posts')
+
+    def get_post(self, post_id):
+        for post in self.posts:
+            if post.post_id == post_id:
+                return post
+        return None
+
+
+def _has_class(attrs, class_name):
+    classes = attrs.get('class') or ''
+    if not isinstance(classes, str):
+        classes = ' '.join(classes)
+    return class_name in classes.split()
+
+
+def _is_thread_page_part(name, attrs):
+    return (
+        name == 'article' and _has_class(attrs, 'message--post') or
+        name == 'h1' and _has_class(attrs, 'p-title-value') or
+        name == 'nav' and _has_class(attrs, 'pageNavWrapper') or
+        _has_class(attrs, 'p-breadcrumbs')
+    )
+
+
+thread_page_strainer = SoupStrainer(_is_thread_page_part)
+
+
+def parse_post(article):
+    user_elem = article.find('h4', class_="message-name")
+    author_id = None
+    if user_elem.a:
+        # It's a registered user's linked username
+        author_name = user_elem.a.get_text(strip=True)
+        match = member_link_regex.match(user_elem.a.get('href', ''))
+        if match:
+            author_id = int(match.group('user_id'))
+        # Otherwise it's a deleted post and we can't get a proper URL - it
+        # will be treated as a guest.
+    else:
+        # It's (presumably) a guest
+        author_name = user_elem.span.get_text(strip=True)
+
+    date_elem = article.find(class_="message-attribution-main").time
+
+    word_count = 0
+    post_body = article.find(class_="message-body")
+    if post_body:
+        for blockquote in post_body.find_all("blockquote"):
+            blockquote.decompose()
+        word_count = len(post_body.get_text().split())
+
+    threadmark_elem = article.find(class_="threadmarkLabel")
+
+    return PostSnapshot(
+        post_id=int(article['id'][8:]),
+        author_id=author_id,
+        author_name=author_name,
+        posted_date=datetime.fromtimestamp(int(date_elem['data-time']), timezone.utc),
+        word_count=word_count,
+        threadmark_title=threadmark_elem.get_text() if threadmark_elem else "",
+    )
+
+
+def parse_pagination(nav):
+    if nav is None:
+        return None
+
+    current_page = 1
+    current = nav.find('li', class_="pageNav-page--current")
+    if current and current.a:
+        current_page = int(current.a.get_text(strip=True))
+
+    last_href = None
+    last_page = current_page
+    page_links = [link for link in nav.ul.find_all('li') if "pageNav-page--skip" not in link.get('class', [])] if nav.ul else []
+    if page_links and page_links[-1].a:
+        last_href = page_links[-1].a['href']
+        last_page = int(page_links[-1].a.get_text(strip=True))
+
+    nextlink = nav.find('a', class_="pageNav-jump--next")
+    prevlink = nav.find('a', class_="pageNav-jump--prev")
+
+    return PaginationSnapshot(
+        current_page=current_page,
+        last_page=max(last_page, current_page),
+        next_href=nextlink['href'] if nextlink else None,
+        prev_href=prevlink['href'] if prevlink else None,
+        last_href=last_href,
+    )
+
+
+def parse_thread_page(markup):
+    """
+    Parses a thread page, given either its HTML or an existing soup, and
+    returns a ThreadPageSnapshot. A soup passed in is decomposed after
+    parsing, so don't use it afterwards.
+
+    """
+    if isinstance(markup, str):
+        soup = BeautifulSoup(markup, HTML_PARSER, parse_only=thread_page_strainer)
+    else:
+        soup = markup
+
+    try:
+        title = None
+        prefix = ''
+        title_elem = soup.find('h1', class_="p-title-value")
+        if title_elem:
+            title = title_elem.find(text=True, recursive=False)
+            prefix_label = title_elem.find(class_="label")
+            prefix = prefix_label.get_text() if prefix_label else ''
+
+        forum_link = None
+        breadcrumbs = soup.find(class_="p-breadcrumbs")
+        if breadcrumbs:
+            crumbs = breadcrumbs.find_all('li')
+            if crumbs and crumbs[-1].a:
+                forum_link = crumbs[-1].a.get('href')
+
+        thread_link = None
+        attribution = soup.find(class_="message-attribution-main")
+        if attribution and attribution.a:
+            thread_link = attribution.a.get('href')
+
+        return ThreadPageSnapshot(
+            title=str(title) if title is not None else None,
+            prefix=prefix,
+            forum_link=forum_link,
+            thread_link=thread_link,
+            pagination=parse_pagination(soup.find('nav', class_="pageNavWrapper")),
+            posts=tuple(parse_post(article) for article in soup.find_all('article', class_="message--post")),
+        )
+    finally:
+        soup.decompose()
@@ -0,0 +1,124 @@
+"""
+Rate limiting for requests to the forum.
+
+Each kind of request ('html' for page scrapes, 'api' for API calls) gets
+its own token bucket, configured by FORUM_RATE_LIMITS. The buckets'
+state lives in small files guarded by file locks, so every gunicorn
+worker on the machine draws from the same budget. When the forum tells
+us to slow down (429/503), the bucket is blocked for everyone until the
+forum is ready for us again.
+
+"""
+import json
+import os
+import time
+from contextlib import contextmanager
+
+import requests
+from django.conf import settings
+
+from forum.locks import file_lock
+
+
+class RateLimitExceeded(requests.RequestException):
+    """
+    Raised when a request would have to wait for longer than
+    FORUM_RATE_LIMIT_MAX_WAIT before it could be made.
+
+    """
+
+
+class TokenBucket(object):
+    """
+    A token bucket holding up to burst tokens, refilled at rate tokens
+    per second. Every request takes one token.
+
+    """
+    def __init__(self, name, rate, burst, directory=None):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        directory = directory or settings.FORUM_LOCK_DIR
+        self.path = os.path.join(directory, 'forum-ratelimit-%s.json' % name)
+        self.lock_path = self.path + '.lock'
+
+    def __repr__(self):
+        return u'<TokenBucket %s (%s/s, burst %s)>' % (self.name, self.rate, self.burst)
+
+    @contextmanager
+    def state(self):
+        with file_lock(self.lock_path):
+            try:
+                with open(self.path) as state_file:
+                    state = json.load(state_file)
+            except (OSError, ValueError):
+                state = {}
+
+            yield state
+
+            with open(self.path, 'w') as state_file:
+                json.dump(state, state_file)
+
+    def try_acquire(self):
+        """
+        Takes a token if one is available and returns 0; otherwise,
+        returns how long (in seconds) to wait before trying again.
+
+        """
+        with self.state() as state:
+            now = time.time()
+            elapsed = max(0, now - state.get('updated', now))
+            tokens = min(self.burst, state.get('tokens', self.burst) + elapsed * self.rate)
+            state['updated'] = now
+
+            blocked = state.get('blocked_until', 0) - now
+            if blocked > 0:
+                state['tokens'] = tokens
+                return blocked
+            if tokens >= 1:
+                state['tokens'] = tokens - 1
+                return 0
+            state['tokens'] = tokens
+            return (1 - tokens) / self.rate
+
+    def acquire(self, max_wait=None):
+        """
+        Waits until a token is available and takes it. Returns how long
+        (in seconds) we had to wait.
+
+        """
+        if max_wait is None:
+            max_wait = settings.FORUM_RATE_LIMIT_MAX_WAIT
+        waited = 0.0
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return waited
+            if waited + wait > max_wait:
+                raise RateLimitExceeded(u"The forum is too busy right now (waited %.1fs for a %s request, need %.1fs more)." % (waited, self.name, wait))
+            time.sleep(wait)
+            waited += wait
+
+    def block(self, seconds):
+        """
+        Stops anyone from taking tokens for the next given number of
+        seconds.
+
+        """
+        with self.state() as state:
+            state['blocked_until'] = max(state.get('blocked_until', 0), time.time() + seconds)
+
+
+_buckets = {}
+
+
+def get_bucket(kind):
+    """
+    Returns the token bucket for the given kind of request, or None if
+    that kind of request isn't rate limited.
+
+    """
+    if kind not in _buckets:
+        rate, burst = settings.FORUM_RATE_LIMITS.get(kind, (0, 0))
+        _buckets[kind] = TokenBucket(kind, rate, max(burst, 1)) if rate > 0 else None
+    return _buckets[kind]
@@ -0,0 +1,199 @@
+"""
+A stand-in for the forum that serves recorded threads, so that anything
+that walks through threads (benchmarks, tests) can be run again and
+again with the same results, without the network.
+
+Recordings are (optionally gzipped) JSON of the form
+
+    {"forum": "/forums/fanfiction.4/",
+     "threads": {"<thread ID>": {"title": "...",
+                                 "users": {"<user ID>": "<username>", ...},
+                                 "posts": [[post ID, user ID, posted timestamp], ...]}}}
+
+with the posts oldest first. Thread pages, post links, profile pages and
+the thread API endpoints are rebuilt from them in the forum's own format,
+and everything still goes through the real transport (so request stats
+are kept as usual).
+
+"""
+import gzip
+import hashlib
+import json
+import re
+from contextlib import contextmanager
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+from django.test.utils import override_settings
+from requests import Response, Session
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from forum import ratelimit
+
+
+REPLAY_FORUM_URL = 'forum.replay.invalid/'
+POSTS_PER_PAGE = 20
+
+
+def load_recording(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class RecordedForum(object):
+    """
+    Renders the pages of the recorded threads.
+
+    """
+    def __init__(self, recording):
+        self.forum = recording['forum']
+        self.threads = {int(thread_id): thread for thread_id, thread in recording['threads'].items()}
+        self.post_pages = {}
+        for thread_id, thread in self.threads.items():
+            for i, post in enumerate(thread['posts']):
+                self.post_pages[post[0]] = (thread_id, i // POSTS_PER_PAGE + 1)
+
+    def get_thread_urls(self):
+        return [u"https://%sthreads/%s/" % (REPLAY_FORUM_URL, thread_id) for thread_id in sorted(self.threads)]
+
+    def get_last_page(self, thread_id):
+        return max(1, (len(self.threads[thread_id]['posts']) + POSTS_PER_PAGE - 1) // POSTS_PER_PAGE)
+
+    def get_page_posts(self, thread_id, page):
+        return self.threads[thread_id]['posts'][(page - 1) * POSTS_PER_PAGE:page * POSTS_PER_PAGE]
+
+    def get_username(self, thread_id, user_id):
+        return self.threads[thread_id]['users'][str(user_id)]
+
+    def render_page_nav(self, thread_id, page, last_page):
+        if last_page == 1:
+            return ''
+        items = []
+        for number in range(1, last_page + 1):
+            if number in (1, last_page) or abs(number - page) <= 2:
+                current = ' pageNav-page--current' if number == page else ''
+                items.append('<li class="pageNav-page%s"><a href="/threads/t.%d/page-%d">%d</a></li>' % (current, thread_id, number, number))
+            elif abs(number - page) == 3:
+                items.append('<li class="pageNav-page pageNav-page--skip"><a>...</a></li>')
+        prev_link = '<a class="pageNav-jump pageNav-jump--prev" href="/threads/t.%d/page-%d">Prev</a>' % (thread_id, page - 1) if page > 1 else ''
+        next_link = '<a class="pageNav-jump pageNav-jump--next" href="/threads/t.%d/page-%d">Next</a>' % (thread_id, page + 1) if page < last_page else ''
+        return '<nav class="pageNavWrapper"><div class="pageNav">%s<ul class="pageNav-main">%s</ul>%s</div></nav>' % (prev_link, ''.join(items), next_link)
+
+    def render_thread_page(self, thread_id, page):
+        last_page = self.get_last_page(thread_id)
+        page = min(page, last_page)
+        articles = []
+        for post_id, user_id, timestamp in self.get_page_posts(thread_id, page):
+            username = self.get_username(thread_id, user_id)
+            user = '<a href="/members/%s.%d/">%s</a>' % (username.lower(), user_id, username) if user_id else '<span>%s</span>' % username
+            articles.append(
+                '<article class="message message--post" id="js-post-%d"><h4 class="message-name">%s</h4>'
+                '<ul class="message-attribution-main"><li><a href="/threads/t.%d/post-%d"><time data-time="%d">x</time></a></li></ul>'
+                '<div class="message-body"><div class="bbWrapper">Post %d</div></div></article>' % (post_id, user, thread_id, post_id, timestamp, post_id)
+            )
+        nav = self.render_page_nav(thread_id, page, last_page)
+        return (
+            '<html><head><title>%s</title></head><body>'
+            '<div class="p-breadcrumbs"><ul><li><a href="/">Home</a></li><li><a href="%s">Fics</a></li></ul></div>'
+            '<h1 class="p-title-value">%s</h1>%s<div class="block block--messages">%s</div>%s</body></html>'
+        ) % (self.threads[thread_id]['title'], self.forum, self.threads[thread_id]['title'], nav, ''.join(articles), nav)
+
+    def render_member_page(self, user_id):
+        return '<html><body><h1 class="p-title-value">User%s</h1></body></html>' % user_id
+
+    def get_api_post(self, thread_id, post):
+        post_id, user_id, timestamp = post
+        return {'post_id': post_id, 'thread_id': thread_id, 'user_id': user_id, 'username': self.get_username(thread_id, user_id), 'post_date': timestamp, 'message': 'Post %d' % post_id}
+
+    def get_api_response(self, path, query):
+        match = re.match(r'^threads/(\d+)(/posts)?/?$', path)
+        if not match or int(match.group(1)) not in self.threads:
+            return None
+        thread_id = int(match.group(1))
+        posts = self.threads[thread_id]['posts']
+        if match.group(2):
+            page = int(query.get('page', ['1'])[0])
+            return {
+                'posts': [self.get_api_post(thread_id, post) for post in self.get_page_posts(thread_id, page)],
+                'pagination': {'current_page': page, 'last_page': self.get_last_page(thread_id)},
+            }
+        return {'thread': {'thread_id': thread_id, 'title': self.threads[thread_id]['title'], 'post_date': posts[0][2], 'last_post_date': posts[-1][2], 'reply_count': len(posts) - 1}}
+
+    def get_html(self, path):
+        match = re.match(r'^posts/(\d+)/?$', path)
+        if match:
+            if int(match.group(1)) not in self.post_pages:
+                return None
+            return self.render_thread_page(*self.post_pages[int(match.group(1))])
+        match = re.match(r'^threads/(?:[^/]*\.)?(\d+)/?(?:page-(\d+))?', path)
+        if match:
+            if int(match.group(1)) not in self.threads:
+                return None
+            return self.render_thread_page(int(match.group(1)), int(match.group(2) or 1))
+        match = re.match(r'^members/(?:[^/]*\.)?(\d+)', path)
+        if match:
+            return self.render_member_page(match.group(1))
+        return None
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    A requests transport adapter answering from a RecordedForum.
+
+    """
+    def __init__(self, forum):
+        super(ReplayAdapter, self).__init__()
+        self.forum = forum
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        path = parts.path.lstrip('/')
+        headers = {}
+        if path.startswith('api/'):
+            data = self.forum.get_api_response(path[len('api/'):], parse_qs(parts.query))
+            body = json.dumps(data) if data is not None else None
+            headers['Content-Type'] = 'application/json'
+        else:
+            body = self.forum.get_html(path)
+            headers['Content-Type'] = 'text/html; charset=utf-8'
+
+        if body is None:
+            return self.build_response(request, 404, b'', {})
+        content = body.encode('utf-8')
+        headers['ETag'] = '"%s"' % hashlib.md5(content).hexdigest()
+        if request.headers.get('If-None-Match') == headers['ETag']:
+            return self.build_response(request, 304, b'', headers)
+        return self.build_response(request, 200, content, headers)
+
+    def build_response(self, request, status_code, content, headers):
+        response = Response()
+        response.status_code = status_code
+        response._content = content
+        response.headers = CaseInsensitiveDict(headers)
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@contextmanager
+def replay_forum(recording):
+    """
+    Points the forum settings at the given recording (a dict, as loaded
+    by load_recording) and routes all forum requests to it instead of the
+    network, without rate limiting. Yields the RecordedForum.
+
+    """
+    forum = RecordedForum(recording)
+    session = Session()
+    session.mount('https://', ReplayAdapter(forum))
+    session.mount('http://', ReplayAdapter(forum))
+    with override_settings(FORUM_URL=REPLAY_FORUM_URL, VALID_FIC_FORUMS=(forum.forum,), FORUM_RATE_LIMITS={}), \
+            mock.patch.dict(ratelimit._buckets, clear=True), \
+            mock.patch('forum.transport.get_session', return_value=session):
+        yield forum
@@ -0,0 +1,102 @@
+"""
+Resolution of forum URLs.
+
+Every kind of forum URL we understand is matched by a single compiled
+regex, which tells us what kind of object the URL points to (a member,
+a thread or a post) and its IDs in one go. Each resolved URL also gets a
+canonical form, so that equivalent URLs - with or without the title slug,
+page-2#post-N, /unread and so on - share the same cache entries.
+
+Resolutions are memoized, since the same URL tends to get resolved over
+and over again (by form fields, lookups and page loading).
+
+"""
+import re
+from collections import namedtuple
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit
+
+from django.conf import settings
+
+
+# The kinds of object URL we know, matching e.g.
+# - members/<userid>/, members/username.<userid>/about/
+# - threads/<threadid>/, threads/fic-title.<threadid>/
+# - threads/<threadid>/unread, threads/<threadid>/page-2
+# - threads/<threadid>/#post-<postid>, threads/<threadid>/page-2#post-<postid>
+# - threads/<threadid>/post-<postid>
+# - posts/<postid>/
+# ...which should cover every sensible URL a person could enter for a
+# XenForo profile/thread/post.
+OBJECT_PATTERNS = (
+    r'members/(?:[^&.]*\.)?(?P<user_id>\d+)(?P<about>/about)?',
+    r'threads/(?:[^&.]*\.)?(?P<thread_id>\d+)(?:/page-(?P<page>\d+)|/unread)?/?(?:(?P<fragment>#)?post-(?P<thread_post_id>\d+))?',
+    r'posts/(?P<post_id>\d+)',
+)
+
+ResolvedURL = namedtuple('ResolvedURL', ['kind', 'user_id', 'thread_id', 'post_id', 'page', 'canonical_url'])
+
+
+@lru_cache(maxsize=None)
+def get_url_regex(base_url):
+    return re.compile(r'^(?:https?://(?:www\.)?%s|/(?:index\.php\?)?)?(?:%s)' % (base_url, '|'.join(OBJECT_PATTERNS)), re.U)
+
+
+@lru_cache(maxsize=4096)
+def _resolve_url(url, allow_offsite, forum_url):
+    match = get_url_regex('.+' if allow_offsite else re.escape(forum_url)).match(url)
+    if not match:
+        return None
+
+    user_id = match.group('user_id')
+    thread_id = match.group('thread_id')
+    post_id = match.group('post_id') or match.group('thread_post_id')
+    page = None
+    if user_id:
+        kind = 'member'
+        path = u'members/%s/%s' % (user_id, 'about/' if match.group('about') else '')
+    elif thread_id:
+        kind = 'thread'
+        page = int(match.group('page') or 1)
+        if post_id and not match.group('fragment'):
+            # threads/<threadid>/post-<postid> is the forum's own link to a
+            # post, which takes you to whichever page the post is on
+            path = u'posts/%s/' % post_id
+        else:
+            path = u'threads/%s/%s' % (thread_id, 'page-%s' % page if page > 1 else '')
+    else:
+        kind = 'post'
+        path = u'posts/%s/' % post_id
+
+    # We can only say what the canonical URL is on our own forum
+    canonical = None if allow_offsite else u'https://%s%s' % (forum_url, path)
+    return ResolvedURL(kind, user_id, thread_id, post_id, page, canonical)
+
+
+def resolve_url(url, allow_offsite=False):
+    """
+    Returns a ResolvedURL for the given forum URL, or None if it isn't a
+    URL to a forum object we know about. kind is 'member', 'thread' or
+    'post'; thread URLs may also have a post_id (for links to a post
+    within a thread). IDs are strings, as they appear in the URL.
+
+    The URL must be to the forum defined in the settings unless
+    allow_offsite is True (in which case there's no canonical URL).
+
+    """
+    return _resolve_url(url, allow_offsite, settings.FORUM_URL)
+
+
+def canonical_url(url):
+    """
+    Returns the canonical form of the given forum URL, for use as a key
+    for caches and lookups. URLs that don't resolve to an object are just
+    normalized: always HTTPS, lowercase host and no fragment (which never
+    makes it to the server anyway).
+
+    """
+    resolved = resolve_url(url)
+    if resolved is not None:
+        return resolved.canonical_url
+    parts = urlsplit(url)
+    return urlunsplit(('https', parts.netloc.lower(), parts.path, parts.query, ''))
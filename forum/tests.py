@@ -1,3 +1,166 @@
+import os
+import threading
+from io import StringIO
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.urls import reverse
+from django.test.utils import CaptureQueriesContext
+from forum import transport
+from forum.fetcher import fetch_many
+from forum.models import CachedPage, Fic, FicPage, IndexedPost, LookupJob, Member, ThreadIndex
+from forum.replay import load_recording, replay_forum
 
-# Create your tests here.
+
+RECORDING = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'awards', 'benchmarks', 'eligibility_threads.json.gz')
+
+
+class CachedPagePurgeTests(TestCase):
+    def create_page(self, url, age):
+        return CachedPage.objects.create(url=url, page_type='thread', content='<html></html>', fetched_date=datetime.now(timezone.utc) - timedelta(seconds=age))
+
+    def test_purge_deletes_only_old_pages(self):
+        self.create_page('https://forum.example/threads/1/', 10 * 24 * 60 * 60)
+        self.create_page('https://forum.example/threads/2/', 60 * 60)
+
+        CachedPage.objects.purge(7 * 24 * 60 * 60)
+
+        self.assertEqual(list(CachedPage.objects.values_list('url', flat=True)), ['https://forum.example/threads/2/'])
+
+    def test_purge_defaults_to_max_age_setting(self):
+        self.create_page('https://forum.example/threads/1/', 2 * 60 * 60)
+        self.create_page('https://forum.example/threads/2/', 60)
+
+        with self.settings(FORUM_PAGE_CACHE_MAX_AGE=60 * 60):
+            CachedPage.objects.purge()
+
+        self.assertEqual(list(CachedPage.objects.values_list('url', flat=True)), ['https://forum.example/threads/2/'])
+
+
+def fetch_uncached(url, page_type, force_download=False):
+    return transport.fetch(url).text
+
+
+# The in-memory test database can't be written to from the prefetching
+# threads while a test's transaction is open, so they skip the page cache
+@mock.patch.object(CachedPage.objects, 'fetch', fetch_uncached)
+class ThreadIteratorTests(TestCase):
+    def get_prefetch_threads(self):
+        return [thread for thread in threading.enumerate() if thread.name.startswith('thread-prefetch')]
+
+    def test_close_on_early_exit(self):
+        with replay_forum(load_recording(RECORDING)) as forum:
+            page = FicPage.from_url(forum.get_thread_urls()[1])
+            with page.iter_posts(prefetch=4) as posts:
+                for i, post in enumerate(posts):
+                    if i == 30:
+                        break
+                self.assertIsNotNone(posts.executor)
+            self.assertIsNone(posts.executor)
+            self.assertEqual(posts.pending, {})
+
+        for thread in self.get_prefetch_threads():
+            thread.join(5)
+        self.assertEqual(self.get_prefetch_threads(), [])
+
+    def test_walks_whole_thread(self):
+        with replay_forum(load_recording(RECORDING)) as forum:
+            page = FicPage.from_url(forum.get_thread_urls()[1])
+            with page.iter_posts(prefetch=4) as posts:
+                post_ids = [post.post_id for post in posts]
+        self.assertEqual(len(post_ids), 1000)
+        self.assertEqual(post_ids, sorted(post_ids))
+
+
+@mock.patch.object(CachedPage.objects, 'fetch', fetch_uncached)
+class ThreadIndexTests(TestCase):
+    def walk_thread(self, recording):
+        with replay_forum(recording) as forum:
+            page = FicPage.from_url(forum.get_thread_urls()[0])
+            with page.iter_posts(prefetch=0) as posts:
+                for post in posts:
+                    pass
+        return ThreadIndex.objects.get(thread_id=1)
+
+    def test_indexes_whole_thread(self):
+        index = self.walk_thread(load_recording(RECORDING))
+        self.assertEqual((index.crawled_pages, index.last_page), (5, 5))
+        self.assertEqual(index.posts.count(), 100)
+
+    def test_walking_again_writes_nothing(self):
+        recording = load_recording(RECORDING)
+        self.walk_thread(recording)
+        with CaptureQueriesContext(connection) as queries:
+            self.walk_thread(recording)
+        writes = [query['sql'] for query in queries if 'forum_indexedpost' in query['sql'] or 'forum_threadindex' in query['sql']]
+        self.assertFalse([sql for sql in writes if not sql.startswith('SELECT')], writes)
+
+    def test_deleted_posts_are_dropped(self):
+        recording = load_recording(RECORDING)
+        self.walk_thread(recording)
+        deleted = recording['threads']['1']['posts'].pop(30)
+
+        index = self.walk_thread(recording)
+        self.assertFalse(IndexedPost.objects.filter(post_id=deleted[0]).exists())
+        self.assertEqual(index.posts.count(), 99)
+        self.assertEqual(index.crawled_pages, 5)
+        # The posts after it have all moved back a page
+        self.assertEqual(index.posts.get(post_id=recording['threads']['1']['posts'][39][0]).page, 2)
+
+    def test_invalidate(self):
+        self.walk_thread(load_recording(RECORDING))
+        ThreadIndex.objects.invalidate([1])
+        self.assertFalse(ThreadIndex.objects.filter(thread_id=1).exists())
+        self.assertFalse(IndexedPost.objects.filter(thread_id=1).exists())
+
+
+class FetchManyTests(TestCase):
+    def test_failed_fetches_are_logged_and_left_out(self):
+        def fetch(url):
+            if url.endswith('2/'):
+                raise ValueError("Nope")
+            return url
+
+        with self.assertLogs('forum.fetcher', level='WARNING') as logs:
+            results = fetch_many(['https://forum.example/threads/1/', 'https://forum.example/threads/2/'], fetch=fetch, as_soup=False)
+
+        self.assertEqual(results, {'https://forum.example/threads/1/': 'https://forum.example/threads/1/'})
+        self.assertIn("https://forum.example/threads/2/", logs.output[0])
+
+
+class ProcessLookupsTests(TestCase):
+    def test_broken_job_is_marked_failed(self):
+        broken = LookupJob.objects.create(view='forum.views.NoSuchView', model='forum.Fic', url='https://forum.example/threads/1/')
+        stdout = StringIO()
+
+        with self.assertLogs('forum.management.commands.process_lookups', level='ERROR'):
+            call_command('process_lookups', once=True, threads=1, stdout=stdout)
+
+        broken.refresh_from_db()
+        self.assertEqual(broken.status, LookupJob.FAILED)
+        self.assertIn('error', broken.get_result())
+        self.assertIn("Looking up https://forum.example/threads/1/", stdout.getvalue())
+
+
+class ForumObjectSearchTests(TestCase):
+    def setUp(self):
+        for user_id, username in enumerate(["alice", "Alicia", "bob", "MALICE"], start=1):
+            Member.objects.create(user_id=user_id, username=username)
+        for thread_id, title in enumerate(["The Long Road", "the lost", "Another Theory"], start=1):
+            Fic.objects.create(title=title, thread_id=thread_id, posted_date=datetime(2024, 1, 1, tzinfo=timezone.utc))
+
+    def search(self, name, field, query):
+        response = self.client.get(reverse(name), {'q': query})
+        return [result['object'][field] for result in response.json()['results']]
+
+    def test_case_insensitive_prefix(self):
+        self.assertCountEqual(self.search('search_member', 'username', "ALI"), ["alice", "Alicia"])
+        self.assertCountEqual(self.search('search_fic', 'title', "the lo"), ["The Long Road", "the lost"])
+
+    def test_uses_upper(self):
+        # So that the UPPER() indexes apply
+        with CaptureQueriesContext(connection) as queries:
+            self.search('search_member', 'username', "ali")
+        self.assertIn('UPPER("forum_member"."username")', queries[0]['sql'])
@@ -0,0 +1,200 @@
+"""
+The HTTP transport used for all traffic to the forum, whether we're
+scraping pages or talking to the XenForo API.
+
+Each worker process keeps a single pooled requests.Session, so repeated
+fetches (e.g. walking through the pages of a thread) reuse a kept-alive
+connection rather than doing a fresh TLS handshake every time. Requests
+time out rather than hanging a worker, idempotent requests are retried
+with backoff, and every call is timed so we can see how long we spend
+waiting on the forum.
+
+Requests are also rate limited (see forum.ratelimit), and when the forum
+answers 429 Too Many Requests or 503 Service Unavailable, we back off -
+for as long as its Retry-After header asks, if it sends one - before
+anyone tries again.
+
+"""
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from forum import ratelimit
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+# Responses meaning the forum wants us to slow down. These are handled by
+# request() rather than by urllib3's retries, so that the backoff applies
+# to every worker and not just the one that got the response.
+THROTTLE_STATUSES = (429, 503)
+
+
+def create_session():
+    retry = Retry(
+        total=settings.FORUM_MAX_RETRIES,
+        backoff_factor=settings.FORUM_RETRY_BACKOFF,
+        status_forcelist=(500, 502, 504),
+        allowed_methods=('GET', 'HEAD'),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=settings.FORUM_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive',
+    })
+    return session
+
+
+def get_session():
+    """
+    Returns the session for this worker process, creating it if needed.
+
+    Gunicorn forks its workers after the app has been imported, so the
+    session is tied to the PID that created it; otherwise forked workers
+    could end up sharing sockets.
+
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = create_session()
+                _session_pid = pid
+    return _session
+
+
+class FetchStats(object):
+    """
+    Latency counters for forum requests in this process, kept per kind
+    of request ('html' for page scrapes, 'api' for API calls), including
+    how long requests spent queued behind the rate limiter and how often
+    the forum throttled us.
+
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counters = defaultdict(lambda: {'calls': 0, 'errors': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'bytes': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0, 'throttled': 0})
+
+    def record(self, kind, seconds, size=0, error=False):
+        with self._lock:
+            counter = self._counters[kind]
+            counter['calls'] += 1
+            counter['seconds'] += seconds
+            counter['max_seconds'] = max(counter['max_seconds'], seconds)
+            counter['bytes'] += size
+            if error:
+                counter['errors'] += 1
+
+    def record_wait(self, kind, seconds):
+        with self._lock:
+            counter = self._counters[kind]
+            counter['wait_seconds'] += seconds
+            counter['max_wait_seconds'] = max(counter['max_wait_seconds'], seconds)
+
+    def record_throttle(self, kind):
+        with self._lock:
+            self._counters[kind]['throttled'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {kind: dict(counter) for kind, counter in self._counters.items()}
+
+
+stats = FetchStats()
+
+
+def get_stats():
+    """
+    Returns a dictionary of request counters by kind, e.g.
+    {'html': {'calls': 3, 'errors': 0, 'seconds': 1.2, ...}}.
+
+    """
+    return stats.snapshot()
+
+
+def get_retry_after(response):
+    """
+    Returns the number of seconds the response's Retry-After header asks
+    us to wait, or None if it doesn't have a (valid) one.
+
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def request(method, url, kind='html', **kwargs):
+    """
+    Makes a request to the forum through the shared session, once the
+    rate limiter lets us, and records how long it took.
+
+    If the forum throttles us, everyone backs off for as long as it asks
+    (or exponentially longer each time, if it doesn't say) and GET/HEAD
+    requests are retried up to FORUM_MAX_RETRIES times.
+
+    """
+    kwargs.setdefault('timeout', (settings.FORUM_CONNECT_TIMEOUT, settings.FORUM_READ_TIMEOUT))
+    bucket = ratelimit.get_bucket(kind)
+    attempt = 0
+    while True:
+        if bucket:
+            stats.record_wait(kind, bucket.acquire())
+
+        start = time.monotonic()
+        try:
+            response = get_session().request(method, url, **kwargs)
+        except requests.RequestException:
+            stats.record(kind, time.monotonic() - start, error=True)
+            raise
+        stats.record(kind, time.monotonic() - start, len(response.content), error=response.status_code >= 400)
+
+        if response.status_code not in THROTTLE_STATUSES:
+            return response
+
+        stats.record_throttle(kind)
+        delay = get_retry_after(response)
+        if delay is None:
+            delay = settings.FORUM_RETRY_BACKOFF * 2 ** attempt
+        if bucket:
+            bucket.block(delay)
+
+        if method.upper() not in ('GET', 'HEAD') or attempt >= settings.FORUM_MAX_RETRIES:
+            return response
+        attempt += 1
+        if not bucket:
+            time.sleep(delay)
+
+
+def fetch(url, **kwargs):
+    """
+    Fetches a forum page.
+
+    """
+    return request('GET', url, kind='html', **kwargs)
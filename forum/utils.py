@@ -1,5 +1,8 @@
+from contextlib import contextmanager
+
 import bbcode
 from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
 
 
 bbcode_formatter = bbcode.Parser()
@@ -11,3 +14,35 @@ def bbcode_to_html(text):
 
 def forum_url_from_path(path):
     return "https://{}{}".format(settings.FORUM_URL.rsplit('/', 1)[0], path)
+
+
+@contextmanager
+def write_transaction(using=None):
+    """
+    Like transaction.atomic(), but on SQLite the transaction takes the
+    write lock as soon as it begins (BEGIN IMMEDIATE) rather than when it
+    first writes. Use it for transactions that read before they write
+    while other threads may be writing too (e.g. pages being fetched in
+    the background): otherwise SQLite can't upgrade the read lock and
+    fails straight away with "database is locked" instead of waiting.
+
+    Elsewhere (and when nested in another transaction) it's the same as
+    transaction.atomic().
+
+    """
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    if connection.vendor != 'sqlite' or not connection.get_autocommit():
+        with transaction.atomic(using=using):
+            yield
+        return
+
+    connection.ensure_connection()
+    transaction_mode = connection.transaction_mode
+    connection.transaction_mode = 'IMMEDIATE'
+    try:
+        with transaction.atomic(using=using):
+            # The transaction has begun; anything else goes back to normal
+            connection.transaction_mode = transaction_mode
+            yield
+    finally:
+        connection.transaction_mode = transaction_mode
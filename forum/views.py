@@ -11,12 +11,14 @@ from django.views.generic.list import ListView
 from django.views.generic.detail import SingleObjectMixin, DetailView
 from django.views.generic.edit import FormMixin, FormView, CreateView, UpdateView
 from django.urls import reverse, reverse_lazy
+from django.utils.cache import patch_cache_control
 from django.utils.decorators import method_decorator
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout, update_session_auth_hash
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import AuthenticationForm
-from forum.models import User, Member, Fic, Genre, get_verification_code
+from django.db.models.functions import Upper
+from forum.models import User, Member, Fic, Genre, LookupJob, get_verification_code
 from forum.forms import VerificationForm, RegisterForm, UserInfoForm, UserLookupForm, PasswordResetForm, CatalogSearchForm, CatalogFicForm
 
 
@@ -228,42 +230,162 @@ class PasswordResetView(SingleObjectMixin, FormView):
 
 
 class ForumObjectLookupView(JSONViewMixin, View):
+    """
+    Looks up a forum object by URL for the AJAX lookup fields.
+
+    Objects we already have are answered straight from the database.
+    Anything that means going to the forum is queued as a LookupJob
+    (unless FORUM_LOOKUP_QUEUE is off) and the response is just the job
+    ID and a URL to poll for the result, so that a slow forum can't tie
+    up the web workers.
+
+    """
     model = None
 
-    def get_page(self):
+    def get_params(self, url):
         try:
-            url = self.request.GET['url']
-        except KeyError:
+            return self.model.get_page_class().get_params_from_url(url)
+        except ValueError:
+            return None
+
+    def get_page(self, url, object_type=None):
+        params = self.get_params(url)
+        if params is None:
             return None
+        return self.model.get_page_class().from_params(save=True, object_type=object_type, **params)
 
+    def get_saved_page(self, url, object_type=None):
+        """
+        Returns a page for the object at the given URL if it's already in
+        the database and can be looked up without going to the forum, or
+        None otherwise.
+
+        """
+        params = self.get_params(url)
+        if params is None:
+            return None
         page_class = self.model.get_page_class()
+        obj = page_class.find_object(object_type, **params)
+        return page_class(obj) if obj is not None else None
+
+    def get_page_context(self, page):
+        if page is not None and page.object is not None:
+            obj = page.object
+            if isinstance(obj, Fic):
+                other_objects = [author.to_dict() for author in obj.authors.all()]
+            else:
+                other_objects = []
 
+            context = obj.to_dict()
+            context['other_objects'] = other_objects
+        else:
+            context = {'error': u"Lookup failed. Please double-check that you entered a valid URL."}
+        return context
+
+    def lookup(self, url, object_type=None):
+        """
+        Looks up the object at the given URL, going to the forum if need
+        be, and returns the response data.
+
+        """
         try:
-            params = page_class.get_params_from_url(url)
-        except ValueError:
-            return None
-        return page_class.from_params(save=True, object_type=self.request.GET.get('type'), **params)
+            page = self.get_page(url, object_type)
+        except ValidationError as e:
+            return {'error': e.message}
+        return self.get_page_context(page)
 
     def get(self, *args, **kwargs):
         try:
-            page = self.get_page()
+            url = self.request.GET['url']
+        except KeyError:
+            return self.render_to_json_response(self.get_page_context(None))
+        object_type = self.request.GET.get('type')
+
+        if not settings.FORUM_LOOKUP_QUEUE:
+            return self.render_to_json_response(self.lookup(url, object_type))
+
+        if self.get_params(url) is None:
+            return self.render_to_json_response(self.get_page_context(None))
+
+        try:
+            page = self.get_saved_page(url, object_type)
         except ValidationError as e:
-            context = {'error': e.message}
-        else:
-            if page is not None and page.object is not None:
-                obj = page.object
-                if isinstance(obj, Fic):
-                    other_objects = [author.to_dict() for author in obj.authors.all()]
-                else:
-                    other_objects = []
-
-                context = obj.to_dict()
-                context['other_objects'] = other_objects
-            else:
-                context = {'error': u"Lookup failed. Please double-check that you entered a valid URL."}
+            return self.render_to_json_response({'error': e.message})
+        if page is not None:
+            return self.render_to_json_response(self.get_page_context(page))
+
+        job = LookupJob.objects.enqueue(self, url, object_type)
+        return self.render_to_json_response({
+            'job': str(job.pk),
+            'status': job.status,
+            'status_url': reverse('lookup_status', args=[job.pk]),
+        })
+
+
+class LookupStatusView(JSONViewMixin, View):
+    """
+    Reports on a queued lookup: just its status until it's finished, and
+    then the lookup result as well.
+
+    """
+    def get(self, request, pk, *args, **kwargs):
+        try:
+            job = LookupJob.objects.only('status', 'result').get(pk=pk)
+        except LookupJob.DoesNotExist:
+            return self.render_to_json_response({'error': u"Lookup not found. Please try again."}, status=404)
+
+        context = {'job': str(job.pk), 'status': job.status}
+        if job.is_finished():
+            context.update(job.get_result())
         return self.render_to_json_response(context)
 
 
+class ForumObjectSearchView(JSONViewMixin, View):
+    """
+    Finds fics or members whose title/username starts with the given
+    text (q), for typeahead fields, so that forms don't have to ship
+    every fic and member we know of to the browser. Specific objects
+    can also be fetched by primary key (pk, repeatable).
+
+    Results are limited, and the responses are cacheable for a while.
+
+    """
+    model = None
+    search_field = None
+    limit = 20
+    max_age = 300
+
+    def get_queryset(self):
+        queryset = self.model.objects.all()
+        if self.model is Fic:
+            queryset = queryset.prefetch_related('authors')
+        query = self.request.GET.get('q', '').strip()
+        pks = self.request.GET.getlist('pk')[:self.limit]
+        if pks:
+            try:
+                return queryset.filter(pk__in=[int(pk) for pk in pks])
+            except ValueError:
+                return queryset.none()
+        if not query:
+            return queryset.none()
+        # Rather than istartswith, so that the UPPER() indexes can be used
+        queryset = queryset.annotate(search_key=Upper(self.search_field)).filter(search_key__startswith=query.upper())
+        return queryset.order_by(self.search_field)[:self.limit]
+
+    def get(self, *args, **kwargs):
+        results = []
+        other_objects = {}
+        for obj in self.get_queryset():
+            results.append(obj.to_dict())
+            if isinstance(obj, Fic):
+                for author in obj.authors.all():
+                    other_objects[author.pk] = author.to_dict()
+
+        response = self.render_to_json_response({'results': results, 'other_objects': list(other_objects.values())})
+        patch_cache_control(response, public=True, max_age=self.max_age)
+        return response
+
+
 class VerificationRequiredMixin(AccessMixin):
     def dispatch(self, request, *args, **kwargs):
         if not request.user.verified:
@@ -0,0 +1,50 @@
+import decimal
+from django.core.management.base import BaseCommand, CommandError
+from reviewblitz.models import LeaderboardEntry, ReviewBlitz
+
+
+LEADERBOARD_FIELDS = ('points', 'reviews', 'chapters', 'words', 'effective_chapters', 'effective_chapters_received', 'heat_bonus')
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the materialized leaderboard of the given blitzes (all of them by default), or with --check, compares it against the leaderboard computed from scratch."
+
+    def add_arguments(self, parser):
+        parser.add_argument('blitz_ids', nargs='*', type=int, metavar='blitz_id')
+        parser.add_argument('--check', action='store_true', default=False, help="Only report differences; don't change anything.")
+
+    def get_differences(self, blitz):
+        expected = {row.id: row for row in blitz.compute_leaderboard()}
+        actual = {entry.blitz_user_id: entry for entry in blitz.get_leaderboard()}
+
+        for blitz_user_id in sorted(set(expected) | set(actual)):
+            if blitz_user_id not in actual:
+                yield "{}: missing from the leaderboard".format(expected[blitz_user_id].username)
+            elif blitz_user_id not in expected:
+                yield "{}: shouldn't be on the leaderboard".format(actual[blitz_user_id].username)
+            else:
+                for field in LEADERBOARD_FIELDS:
+                    expected_value = decimal.Decimal(str(getattr(expected[blitz_user_id], field) or 0)).quantize(decimal.Decimal('0.01'))
+                    actual_value = getattr(actual[blitz_user_id], field)
+                    if expected_value != actual_value:
+                        yield "{}: {} is {}, should be {}".format(actual[blitz_user_id].username, field, actual_value, expected_value)
+
+    def handle(self, blitz_ids, *args, **options):
+        blitzes = ReviewBlitz.objects.select_related('scoring').order_by('start_date')
+        if blitz_ids:
+            blitzes = blitzes.filter(pk__in=blitz_ids)
+
+        inconsistent = 0
+        for blitz in blitzes:
+            if options['check']:
+                differences = list(self.get_differences(blitz))
+                for difference in differences:
+                    self.stdout.write("{}: {}".format(blitz, difference))
+                if differences:
+                    inconsistent += 1
+            else:
+                entries = LeaderboardEntry.objects.refresh(blitz)
+                self.stdout.write("{}: {} entries".format(blitz, len(entries)))
+
+        if inconsistent:
+            raise CommandError("The leaderboards of {} blitz(es) don't match.".format(inconsistent))
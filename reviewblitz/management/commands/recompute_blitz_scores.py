@@ -0,0 +1,54 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand, CommandError
+from reviewblitz.models import ReviewBlitz
+from reviewblitz.scoring import BlitzScorer
+
+
+class Command(BaseCommand):
+    help = "Recomputes the scores and heat bonuses of every review in the given blitzes (the current one by default) under their current scoring rules, and shows what would change. Nothing is saved without --write."
+
+    def add_arguments(self, parser):
+        parser.add_argument('blitz_ids', nargs='*', type=int, metavar='blitz_id')
+        parser.add_argument('--write', action='store_true', default=False, help="Save the recomputed scores, overwriting the stored scores and heat bonuses (and so the leaderboard).")
+
+    def get_blitzes(self, blitz_ids):
+        if not blitz_ids:
+            try:
+                return [ReviewBlitz.get_current()]
+            except ReviewBlitz.DoesNotExist:
+                raise CommandError("There are no blitzes.")
+        blitzes = list(ReviewBlitz.objects.filter(pk__in=blitz_ids).select_related('scoring').order_by('start_date'))
+        if len(blitzes) != len(set(blitz_ids)):
+            raise CommandError("No such blitz: {}".format(", ".join(str(pk) for pk in sorted(set(blitz_ids) - {blitz.pk for blitz in blitzes}))))
+        return blitzes
+
+    def write_diff(self, changes):
+        # Per reviewer: [old approved points, new approved points, reviews changed]
+        users = defaultdict(lambda: [0, 0, 0])
+        for change in changes:
+            user = users[change.blitz_review.review.author_id]
+            if change.blitz_review.approved:
+                user[0] += change.old_score
+                user[1] += change.new_score
+            if change.old_score != change.new_score or change.old_heat_bonus != change.new_heat_bonus:
+                user[2] += 1
+                if self.verbosity > 1:
+                    self.stdout.write("    {}: score {} -> {}, heat bonus {} -> {}".format(change.blitz_review, change.old_score, change.new_score, change.old_heat_bonus, change.new_heat_bonus))
+
+        usernames = {change.blitz_review.review.author_id: change.blitz_review.review.author.username for change in changes}
+        for member_id, (old_points, new_points, changed) in sorted(users.items(), key=lambda item: usernames[item[0]].lower()):
+            if changed:
+                self.stdout.write("    {:<30} {:>8} -> {:>8} ({:+}) approved points, {} review(s) changed".format(usernames[member_id], old_points, new_points, new_points - old_points, changed))
+
+    def handle(self, blitz_ids, *args, **options):
+        self.verbosity = options['verbosity']
+        for blitz in self.get_blitzes(blitz_ids):
+            scorer = BlitzScorer(blitz)
+            changes = scorer.replay()
+            self.stdout.write("{} ({}):".format(blitz, blitz.scoring))
+            self.write_diff(changes)
+            if not options['write']:
+                self.stdout.write("Nothing saved; run again with --write to save these scores.")
+                continue
+            changed = scorer.save(changes)
+            self.stdout.write("Updated {} of {} reviews.".format(len(changed), len(changes)))
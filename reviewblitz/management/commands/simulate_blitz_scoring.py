@@ -0,0 +1,60 @@
+import csv
+import itertools
+from django.core.management.base import BaseCommand, CommandError
+from reviewblitz.models import ReviewBlitz
+from reviewblitz.simulation import BlitzSimulation, SCORING_PARAMETERS, np
+
+
+class Command(BaseCommand):
+    help = "Shows how a blitz's leaderboard would have come out under every combination of the given scoring parameters (anything not given is kept as it was), as CSV. Needs NumPy."
+
+    def add_arguments(self, parser):
+        parser.add_argument('blitz_id', nargs='?', type=int)
+        for name, integer in SCORING_PARAMETERS:
+            parser.add_argument('--%s' % name.replace('_', '-'), dest=name, nargs='+', type=int if integer else float, metavar='VALUE')
+        parser.add_argument('--per-user', action='store_true', dest='per_user', default=False, help="Output every participant's points and rank change under each configuration, rather than a summary per configuration.")
+
+    def get_blitz(self, blitz_id):
+        try:
+            if blitz_id is None:
+                return ReviewBlitz.get_current()
+            return ReviewBlitz.objects.select_related('scoring').get(pk=blitz_id)
+        except ReviewBlitz.DoesNotExist:
+            raise CommandError("No such blitz.")
+
+    def handle(self, blitz_id, *args, **options):
+        if np is None:
+            raise CommandError("The blitz simulator needs NumPy (pip install numpy).")
+
+        blitz = self.get_blitz(blitz_id)
+        varied = [name for name, integer in SCORING_PARAMETERS if options[name]]
+        # The blitz's actual scoring comes first, as the baseline
+        configs = [{}] + [dict(zip(varied, values)) for values in itertools.product(*[options[name] for name in varied])]
+
+        simulation = BlitzSimulation(blitz)
+        points, ranks = simulation.get_leaderboards(simulation.score(configs))
+        rank_changes = ranks[0] - ranks
+
+        writer = csv.writer(self.stdout)
+        if options['per_user']:
+            writer.writerow(['config'] + varied + ['username', 'points', 'rank', 'rank_change'])
+            for i, config in enumerate(configs):
+                values = [config.get(name, getattr(blitz.scoring, name)) for name in varied]
+                for j, username in enumerate(simulation.usernames):
+                    writer.writerow([i] + values + [username, '%.2f' % points[i, j], ranks[i, j], rank_changes[i, j]])
+            return
+
+        writer.writerow(['config'] + varied + ['leader', 'min', 'p25', 'median', 'p75', 'max', 'mean', 'moved', 'max_rise', 'max_drop'])
+        if not simulation.usernames:
+            return
+        quantiles = np.percentile(points, [0, 25, 50, 75, 100], axis=1)
+        for i, config in enumerate(configs):
+            values = [config.get(name, getattr(blitz.scoring, name)) for name in varied]
+            writer.writerow([i] + values + [
+                simulation.usernames[int(np.argmax(points[i]))],
+            ] + ['%.2f' % quantile for quantile in quantiles[:, i]] + [
+                '%.2f' % points[i].mean(),
+                int((rank_changes[i] != 0).sum()),
+                int(max(rank_changes[i].max(), 0)),
+                int(max(-rank_changes[i].min(), 0)),
+            ])
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.4 on 2026-10-15 09:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviewblitz', '0015_alter_reviewblitzscoring_max_heat_bonus_tier_1'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('points', models.DecimalField(decimal_places=2, max_digits=7)),
+                ('reviews', models.PositiveIntegerField()),
+                ('chapters', models.PositiveIntegerField()),
+                ('words', models.PositiveIntegerField()),
+                ('effective_chapters', models.PositiveIntegerField()),
+                ('effective_chapters_received', models.PositiveIntegerField()),
+                ('heat_bonus', models.DecimalField(decimal_places=2, max_digits=4)),
+                ('blitz', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_entries', to='reviewblitz.reviewblitz')),
+                ('blitz_user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_entry', to='reviewblitz.blitzuser')),
+            ],
+            options={
+                'verbose_name_plural': 'leaderboard entries',
+                'indexes': [models.Index(fields=['blitz', '-points'], name='reviewblitz_blitz_i_982e90_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,83 @@
+import decimal
+
+from django.db import migrations
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Least
+
+
+def get_heat_bonus(scoring, effective_chapters, effective_chapters_received):
+    # As get_leaderboard_heat_bonus was when this migration was written
+    if effective_chapters < scoring.heat_bonus_threshold_tier_1:
+        cap = scoring.max_heat_bonus_tier_0
+    elif effective_chapters < scoring.heat_bonus_threshold_tier_2:
+        cap = scoring.max_heat_bonus_tier_1
+    else:
+        cap = scoring.max_heat_bonus
+    base_bonus = decimal.Decimal(effective_chapters + 1) / decimal.Decimal(effective_chapters_received + 1) - 1
+    if base_bonus < 0:
+        return decimal.Decimal(0)
+    if base_bonus > cap:
+        return cap
+    return (base_bonus * 2).quantize(decimal.Decimal(1), rounding=decimal.ROUND_HALF_UP) / 2
+
+
+def fill_leaderboards(apps, schema_editor):
+    """
+    Builds the leaderboard entries for every existing blitz, the same way
+    LeaderboardEntry.objects.refresh does.
+
+    """
+    ReviewBlitz = apps.get_model('reviewblitz', 'ReviewBlitz')
+    BlitzReview = apps.get_model('reviewblitz', 'BlitzReview')
+    BlitzUser = apps.get_model('reviewblitz', 'BlitzUser')
+    LeaderboardEntry = apps.get_model('reviewblitz', 'LeaderboardEntry')
+
+    for blitz in ReviewBlitz.objects.select_related('scoring'):
+        effective_chapters = Sum(Least(F('review__chapters'), F('review__word_count') / blitz.scoring.words_per_chapter))
+        approved_reviews = BlitzReview.objects.filter(blitz=blitz, approved=True)
+        given = {
+            row['review__author_id']: row for row in approved_reviews.values('review__author_id').annotate(
+                points=Sum('score'),
+                reviews=Count('id'),
+                chapters=Sum('review__chapters'),
+                words=Sum('review__word_count'),
+                effective_chapters=effective_chapters,
+            )
+        }
+        received = dict(approved_reviews.values('review__fic__authors').annotate(effective_chapters=effective_chapters).values_list('review__fic__authors', 'effective_chapters'))
+
+        entries = []
+        for blitz_user in BlitzUser.objects.filter(blitz=blitz):
+            stats = given.get(blitz_user.member_id)
+            if stats is None:
+                continue
+            effective_chapters_received = received.get(blitz_user.member_id) or 0
+            entries.append(LeaderboardEntry(
+                blitz=blitz,
+                blitz_user=blitz_user,
+                points=stats['points'] + (blitz_user.bonus_points or 0),
+                reviews=stats['reviews'],
+                chapters=stats['chapters'],
+                words=stats['words'],
+                effective_chapters=stats['effective_chapters'] or 0,
+                effective_chapters_received=effective_chapters_received,
+                heat_bonus=get_heat_bonus(blitz.scoring, stats['effective_chapters'] or 0, effective_chapters_received),
+            ))
+        LeaderboardEntry.objects.filter(blitz=blitz).delete()
+        LeaderboardEntry.objects.bulk_create(entries)
+
+
+def empty_leaderboards(apps, schema_editor):
+    LeaderboardEntry = apps.get_model('reviewblitz', 'LeaderboardEntry')
+    LeaderboardEntry.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviewblitz', '0016_leaderboardentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_leaderboards, empty_leaderboards),
+    ]
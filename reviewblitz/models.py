@@ -1,11 +1,39 @@
 import decimal
-from django.db.models import Sum, F, Count, Max, ExpressionWrapper, DecimalField
+import time
+from django.conf import settings
+from django.db.models import Sum, F, Count, Max, ExpressionWrapper, DecimalField, Exists, OuterRef, Subquery
 from django.db.models.functions import Coalesce, Least
-from django.db import models
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.db import models, transaction
+from django.dispatch import receiver
+from django.core.signals import setting_changed
 from django.utils import timezone
 from forum.models import Fic, Member, Review, Chapter
 
 
+def effective_chapters_sum(words_per_chapter):
+    """
+    Sums the effective chapters reviewed over BlitzReviews: the number of
+    chapters of each review, or the number of words_per_chapter words in
+    it, whichever is smaller.
+
+    """
+    return Sum(Least(F('review__chapters'), F('review__word_count') / words_per_chapter))
+
+
+_current_blitz_cache = {}
+
+
+def clear_current_blitz_cache():
+    """
+    Forgets the current blitz cached by ReviewBlitz.get_current(), so the
+    next call reads it from the database. Tests should call this between
+    test cases, as rolling back doesn't send any signals.
+
+    """
+    _current_blitz_cache.clear()
+
+
 class WeeklyTheme(models.Model):
     name = models.CharField(max_length=50, help_text="A name for this theme, such as 'One-Shot Week'.")
     description = models.TextField(help_text="A basic description of this theme.")
@@ -72,7 +100,19 @@ class ReviewBlitz(models.Model):
 
     @classmethod
     def get_current(cls):
-        return cls.objects.latest("start_date")
+        """
+        Returns the current (latest) blitz, with its scoring and weekly
+        themes loaded. Nearly every page needs it, so it's cached in the
+        process for CURRENT_BLITZ_CACHE_TTL seconds; saving a blitz, its
+        themes or its scoring clears the cache (in this process - other
+        processes catch up when the cache expires).
+
+        """
+        cached = _current_blitz_cache.get('blitz')
+        if cached is None or cached[1] < time.monotonic():
+            blitz = cls.objects.select_related('scoring').prefetch_related('weekly_themes__theme').latest("start_date")
+            cached = _current_blitz_cache['blitz'] = (blitz, time.monotonic() + settings.CURRENT_BLITZ_CACHE_TTL)
+        return cached[0]
 
     def is_active(self):
         return self.start_date <= timezone.now() and self.end_date > timezone.now()
@@ -81,11 +121,31 @@ class ReviewBlitz(models.Model):
         delta = timezone.now() - self.start_date
         return int(delta.total_seconds() / (7 * 24 * 60 * 60)) + 1
 
+    def get_theme(self, week):
+        # Go through all() so that prefetched themes are used
+        for blitz_theme in self.weekly_themes.all():
+            if blitz_theme.week == week:
+                return blitz_theme.theme
+        return None
+
     def get_current_theme(self):
-        theme = self.weekly_themes.filter(week=self.current_week_index()).first()
-        return theme.theme if theme else None
+        return self.get_theme(self.current_week_index())
 
     def get_leaderboard(self):
+        """
+        Returns the leaderboard for this blitz, highest points first, from
+        the materialized leaderboard (see LeaderboardEntry).
+
+        """
+        return self.leaderboard_entries.select_related('blitz_user__member').order_by('-points', 'blitz_user_id')
+
+    def compute_leaderboard(self):
+        """
+        Computes the leaderboard for this blitz from scratch with a single
+        query. This is what the materialized leaderboard has to agree with
+        (see the rebuild_leaderboard command).
+
+        """
         return BlitzUser.objects.raw("""
             SELECT
                 s.id,
@@ -192,8 +252,7 @@ class BlitzReview(models.Model):
         return int(delta.total_seconds() / (7 * 24 * 60 * 60)) + 1
 
     def get_theme(self):
-        theme = self.blitz.weekly_themes.filter(week=self.week_index()).first()
-        return theme.theme if theme else None
+        return self.blitz.get_theme(self.week_index())
 
     def effective_chapters_reviewed(self):
         return min(self.review.word_count // self.blitz.scoring.words_per_chapter, self.review.chapters)
@@ -202,49 +261,25 @@ class BlitzReview(models.Model):
         heat_bonus = 0
 
         scoring = self.blitz.scoring
+        reviews = BlitzReview.objects.filter(blitz=self.blitz).order_by().values('blitz')
+        approved_reviews = reviews.filter(approved=True)
         # If hypothetically a fic has multiple authors, we should get the biggest heat bonus that applies for any of them.
-        for author in self.review.fic.get_authors():
-            print("Calculating heat bonus for author %s..." % author.username)
-            try:
-                recipient = BlitzUser.objects.get(blitz=self.blitz, member=author)
-            except BlitzUser.DoesNotExist:
-                # This author is not participating in Blitz - no heat bonus.
-                print("Author not participating in Blitz!")
-                continue
-
+        # Authors who aren't participating in the Blitz don't give a heat bonus, so only look at their Blitz users.
+        recipients = BlitzUser.objects.filter(blitz=self.blitz, member__in=self.review.fic.get_authors()).annotate(
             # Have we already claimed a heat bonus for this author this Blitz?
-            prev_heat_bonus = BlitzReview.objects.filter(blitz=self.blitz, review__author=self.review.author, review__fic__authors=author, heat_bonus__gt=0).exists()
-
-            print("Previous heat bonus claimed:", prev_heat_bonus)
+            prev_heat_bonus=Exists(reviews.filter(review__author=self.review.author, review__fic__authors=OuterRef('member'), heat_bonus__gt=0)),
+            reviews_given=Coalesce(Subquery(approved_reviews.filter(review__author=OuterRef('member')).annotate(effective_chapters=effective_chapters_sum(scoring.words_per_chapter)).values('effective_chapters')), 0),
+            reviews_received=Coalesce(Subquery(approved_reviews.filter(review__fic__authors=OuterRef('member')).annotate(effective_chapters=effective_chapters_sum(scoring.words_per_chapter)).values('effective_chapters')), 0),
+        )
 
-            if prev_heat_bonus:
+        for recipient in recipients:
+            if recipient.prev_heat_bonus:
                 # We've already received a heat bonus for this author this Blitz - no double-dipping.
                 continue
 
-            reviews_given = int(BlitzReview.objects.filter(blitz=self.blitz, review__author=author, approved=True).aggregate(effective_chapters=Sum(Least(F('review__chapters'), F('review__word_count') / scoring.words_per_chapter)))['effective_chapters'] or 0)
-            print("Chapter reviews given:", reviews_given)
-            reviews_received = int(BlitzReview.objects.filter(blitz=self.blitz, review__fic__authors=author, approved=True).aggregate(effective_chapters=Sum(Least(F('review__chapters'), F('review__word_count') / scoring.words_per_chapter)))['effective_chapters'] or 0)
-            print("Chapter reviews received:", reviews_received)
-
-            if reviews_given <= reviews_received:
-                # No bonus for an author who has received the same number or more reviews than they've given.
-                continue
-
-            max_heat_bonus = scoring.max_heat_bonus_tier_0 if reviews_given < scoring.heat_bonus_threshold_tier_1 else scoring.max_heat_bonus_tier_1 if reviews_given < scoring.heat_bonus_threshold_tier_2 else scoring.max_heat_bonus
-            print("Max heat bonus:", max_heat_bonus)
-
-            base_bonus = min((reviews_given + 1) / (reviews_received + 1) * float(scoring.heat_bonus_multiplier) - 1, float(max_heat_bonus))
-            print("Base bonus:", base_bonus)
-
-            # Round to the nearest half-point.
-            rounded_bonus = int(base_bonus * 2 + 0.5) / 2
-            print("Rounded bonus:", rounded_bonus)
-
             # If this is bigger than the heat bonus we currently have, replace it.
-            if rounded_bonus > heat_bonus:
-                heat_bonus = rounded_bonus
+            heat_bonus = max(heat_bonus, get_heat_bonus(scoring, int(recipient.reviews_given), int(recipient.reviews_received)))
 
-        print("Final heat bonus:", heat_bonus)
         return decimal.Decimal(heat_bonus)
 
 
@@ -267,3 +302,207 @@ class BlitzUser(models.Model):
 
     def __str__(self):
         return "{}'s stats for {}".format(self.member, self.blitz)
+
+
+def get_heat_bonus_cap(scoring, effective_chapters):
+    if effective_chapters < scoring.heat_bonus_threshold_tier_1:
+        return scoring.max_heat_bonus_tier_0
+    if effective_chapters < scoring.heat_bonus_threshold_tier_2:
+        return scoring.max_heat_bonus_tier_1
+    return scoring.max_heat_bonus
+
+
+def get_heat_bonus(scoring, reviews_given, reviews_received):
+    """
+    The heat bonus for reviewing an author who has given and received the
+    given numbers of effective chapters of reviews.
+
+    """
+    if reviews_given <= reviews_received:
+        # No bonus for an author who has received the same number or more reviews than they've given.
+        return 0
+
+    base_bonus = min((reviews_given + 1) / (reviews_received + 1) * float(scoring.heat_bonus_multiplier) - 1, float(get_heat_bonus_cap(scoring, reviews_given)))
+
+    # Round to the nearest half-point.
+    return int(base_bonus * 2 + 0.5) / 2
+
+
+def get_leaderboard_heat_bonus(scoring, effective_chapters, effective_chapters_received):
+    """
+    The heat bonus shown on the leaderboard for a reviewer who has given
+    and received the given numbers of effective chapters of reviews,
+    rounded to the nearest half-point and capped by tier.
+
+    """
+    cap = get_heat_bonus_cap(scoring, effective_chapters)
+    base_bonus = decimal.Decimal(effective_chapters + 1) / decimal.Decimal(effective_chapters_received + 1) - 1
+    if base_bonus < 0:
+        return decimal.Decimal(0)
+    if base_bonus > cap:
+        return cap
+    return (base_bonus * 2).quantize(decimal.Decimal(1), rounding=decimal.ROUND_HALF_UP) / 2
+
+
+class LeaderboardEntryManager(models.Manager):
+    @transaction.atomic
+    def refresh(self, blitz, member_ids=None):
+        """
+        Recomputes the leaderboard entries for the given blitz, for just
+        the participants with the given member IDs if any are given
+        (otherwise for everyone). Participants without any approved
+        reviews don't get an entry.
+
+        """
+        effective_chapters = effective_chapters_sum(blitz.scoring.words_per_chapter)
+        approved_reviews = BlitzReview.objects.filter(blitz=blitz, approved=True)
+        blitz_users = BlitzUser.objects.filter(blitz=blitz)
+        if member_ids is not None:
+            member_ids = set(member_ids)
+            approved_reviews_by = approved_reviews.filter(review__author_id__in=member_ids)
+            approved_reviews_of = approved_reviews.filter(review__fic__authors__in=member_ids)
+            blitz_users = blitz_users.filter(member_id__in=member_ids)
+        else:
+            approved_reviews_by = approved_reviews_of = approved_reviews
+
+        given = {
+            row['review__author_id']: row for row in approved_reviews_by.values('review__author_id').annotate(
+                points=Sum('score'),
+                reviews=Count('id'),
+                chapters=Sum('review__chapters'),
+                words=Sum('review__word_count'),
+                effective_chapters=effective_chapters,
+            )
+        }
+        received = dict(approved_reviews_of.values('review__fic__authors').annotate(effective_chapters=effective_chapters).values_list('review__fic__authors', 'effective_chapters'))
+
+        entries = []
+        for blitz_user in blitz_users:
+            stats = given.get(blitz_user.member_id)
+            if stats is None:
+                continue
+            effective_chapters_received = received.get(blitz_user.member_id) or 0
+            entries.append(LeaderboardEntry(
+                blitz=blitz,
+                blitz_user=blitz_user,
+                points=stats['points'] + (blitz_user.bonus_points or 0),
+                reviews=stats['reviews'],
+                chapters=stats['chapters'],
+                words=stats['words'],
+                effective_chapters=stats['effective_chapters'] or 0,
+                effective_chapters_received=effective_chapters_received,
+                heat_bonus=get_leaderboard_heat_bonus(blitz.scoring, stats['effective_chapters'] or 0, effective_chapters_received),
+            ))
+
+        stale = self.filter(blitz=blitz).exclude(blitz_user__in=[entry.blitz_user for entry in entries])
+        if member_ids is not None:
+            stale = stale.filter(blitz_user__member_id__in=member_ids)
+        stale.delete()
+        self.bulk_create(entries, update_conflicts=True, unique_fields=['blitz_user'], update_fields=['points', 'reviews', 'chapters', 'words', 'effective_chapters', 'effective_chapters_received', 'heat_bonus'])
+        return entries
+
+
+class LeaderboardEntry(models.Model):
+    """
+    A participant's standing in a blitz, kept up to date as reviews are
+    approved, edited or rejected and bonus points are given, so that
+    showing the leaderboard is a simple lookup.
+
+    """
+    blitz = models.ForeignKey(ReviewBlitz, related_name='leaderboard_entries', on_delete=models.CASCADE)
+    blitz_user = models.OneToOneField(BlitzUser, related_name='leaderboard_entry', on_delete=models.CASCADE)
+    points = models.DecimalField(max_digits=7, decimal_places=2)
+    reviews = models.PositiveIntegerField()
+    chapters = models.PositiveIntegerField()
+    words = models.PositiveIntegerField()
+    effective_chapters = models.PositiveIntegerField()
+    effective_chapters_received = models.PositiveIntegerField()
+    heat_bonus = models.DecimalField(max_digits=4, decimal_places=2)
+
+    objects = LeaderboardEntryManager()
+
+    class Meta:
+        verbose_name_plural = 'leaderboard entries'
+        indexes = [
+            models.Index(fields=['blitz', '-points']),
+        ]
+
+    def __str__(self):
+        return "{}'s leaderboard entry for {}".format(self.blitz_user.member, self.blitz)
+
+    @property
+    def username(self):
+        return self.blitz_user.member.username
+
+
+@receiver([post_save, post_delete], sender=BlitzReview)
+def update_leaderboard_on_blitz_review_change(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, ReviewBlitz):
+        # The whole blitz is going, leaderboard and all
+        return
+    review = Review.objects.filter(pk=instance.review_id).first()
+    if review is None:
+        return
+    # Both the reviewer's stats and the reviewed authors' received
+    # chapters may have changed
+    LeaderboardEntry.objects.refresh(instance.blitz, [review.author_id] + list(review.fic.authors.values_list('pk', flat=True)))
+
+
+@receiver([post_save, post_delete], sender=BlitzUser)
+def update_leaderboard_on_blitz_user_change(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, ReviewBlitz):
+        return
+    LeaderboardEntry.objects.refresh(instance.blitz, [instance.member_id])
+
+
+@receiver(post_save, sender=Review)
+def update_leaderboard_on_review_change(sender, instance, created=False, **kwargs):
+    # An edited review (e.g. its chapter or word count corrected) changes
+    # the stats of any blitz it was submitted to
+    if created:
+        return
+    member_ids = [instance.author_id] + list(instance.fic.authors.values_list('pk', flat=True))
+    for blitz in ReviewBlitz.objects.filter(blitz_reviews__review=instance).select_related('scoring').distinct():
+        LeaderboardEntry.objects.refresh(blitz, member_ids)
+
+
+@receiver(m2m_changed, sender=Fic.authors.through)
+def update_leaderboard_on_fic_authors_change(sender, instance, action, reverse, pk_set, **kwargs):
+    # Authors added to or removed from a fic gain or lose the chapters
+    # received from its reviews
+    if action not in ('post_add', 'post_remove', 'pre_clear', 'post_clear'):
+        return
+    if action == 'pre_clear':
+        # We won't know who was cleared afterwards
+        instance._cleared_pks = set(getattr(instance, 'fics' if reverse else 'authors').values_list('pk', flat=True))
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.pop('_cleared_pks', set())
+    if not pk_set:
+        return
+    if reverse:
+        fic_ids, member_ids = pk_set, [instance.pk]
+    else:
+        fic_ids, member_ids = [instance.pk], pk_set
+    for blitz in ReviewBlitz.objects.filter(blitz_reviews__review__fic__in=fic_ids).select_related('scoring').distinct():
+        LeaderboardEntry.objects.refresh(blitz, member_ids)
+
+
+@receiver(post_save, sender=ReviewBlitzScoring)
+def update_leaderboard_on_scoring_change(sender, instance, **kwargs):
+    for blitz in instance.blitzes.all():
+        LeaderboardEntry.objects.refresh(blitz)
+
+
+@receiver([post_save, post_delete], sender=ReviewBlitz)
+@receiver([post_save, post_delete], sender=ReviewBlitzTheme)
+@receiver([post_save, post_delete], sender=ReviewBlitzScoring)
+@receiver([post_save, post_delete], sender=WeeklyTheme)
+def clear_current_blitz_cache_on_change(sender, **kwargs):
+    clear_current_blitz_cache()
+
+
+@receiver(setting_changed)
+def clear_current_blitz_cache_on_setting_change(setting, **kwargs):
+    if setting == 'CURRENT_BLITZ_CACHE_TTL':
+        clear_current_blitz_cache()
@@ -0,0 +1,152 @@
+"""
+Replays the scoring of a whole Review Blitz in memory.
+
+Reviews are normally scored one at a time as they're submitted (see
+BlitzReviewSubmissionFormView), with each score depending on what came
+before it: earlier reviews of the same fic by the same reviewer (for the
+consecutive chapter bonus and per-fic themes) and the heat bonuses
+already claimed. BlitzScorer loads everything a blitz's scores depend on
+in a handful of queries and goes through its reviews in the order they
+were submitted, scoring each one the same way, so that scores can be
+recomputed after the scoring rules change mid-event.
+
+"""
+import decimal
+from collections import defaultdict, namedtuple
+
+from django.db import transaction
+
+from forum.models import Fic
+from reviewblitz.models import BlitzReview, BlitzUser, LeaderboardEntry, ReviewBlitz, get_heat_bonus
+
+
+ScoreChange = namedtuple('ScoreChange', ['blitz_review', 'old_score', 'new_score', 'old_heat_bonus', 'new_heat_bonus'])
+
+SCORE_PLACES = decimal.Decimal('0.01')
+HEAT_BONUS_PLACES = decimal.Decimal('0.1')
+
+
+class BlitzScorer(object):
+    """
+    Recomputes the scores of all the reviews in a blitz, under its own
+    scoring rules or the given ones (which don't need to be saved).
+
+    Approval times aren't recorded, so when working out a review's heat
+    bonus, every earlier review that is approved now counts as having
+    been approved at the time.
+
+    """
+    def __init__(self, blitz, scoring=None):
+        self.blitz = blitz
+        self.scoring = scoring or blitz.scoring
+        self.blitz_reviews = None
+
+    def load(self):
+        # The reviews all get a copy of the blitz with the scoring we're
+        # replaying, so that the scoring methods on BlitzReview and
+        # WeeklyTheme use it without touching the real one
+        blitz = ReviewBlitz(pk=self.blitz.pk, title=self.blitz.title, start_date=self.blitz.start_date, end_date=self.blitz.end_date, scoring=self.scoring)
+
+        self.blitz_reviews = list(BlitzReview.objects.filter(blitz=self.blitz).select_related('review__author').prefetch_related('chapter_links__chapter').order_by('id'))
+        for blitz_review in self.blitz_reviews:
+            blitz_review.blitz = blitz
+
+        self.themes = {blitz_theme.week: blitz_theme.theme for blitz_theme in self.blitz.weekly_themes.select_related('theme')}
+        self.participants = set(BlitzUser.objects.filter(blitz=self.blitz).values_list('member_id', flat=True))
+        self.fic_authors = defaultdict(set)
+        fic_ids = {blitz_review.review.fic_id for blitz_review in self.blitz_reviews}
+        for fic_id, member_id in Fic.authors.through.objects.filter(fic_id__in=fic_ids).values_list('fic_id', 'member_id'):
+            self.fic_authors[fic_id].add(member_id)
+
+    def get_heat_bonus(self, blitz_review, chapters_given, chapters_received, heat_claimed):
+        heat_bonus = 0
+        reviewer_id = blitz_review.review.author_id
+        for author_id in self.fic_authors[blitz_review.review.fic_id]:
+            if author_id not in self.participants or (reviewer_id, author_id) in heat_claimed:
+                continue
+            heat_bonus = max(heat_bonus, get_heat_bonus(self.scoring, chapters_given[author_id], chapters_received[author_id]))
+        return decimal.Decimal(heat_bonus)
+
+    def replay(self):
+        """
+        Goes through the blitz's reviews in the order they were submitted
+        and returns a ScoreChange for each of them. Nothing is saved.
+
+        """
+        if self.blitz_reviews is None:
+            self.load()
+
+        scoring = self.scoring
+        # Earlier reviews by each reviewer of each fic
+        prev_reviews = defaultdict(list)
+        # Effective chapters given and received through approved reviews,
+        # by member
+        chapters_given = defaultdict(int)
+        chapters_received = defaultdict(int)
+        # (reviewer, author) pairs the reviewer has already had a heat
+        # bonus for
+        heat_claimed = set()
+
+        changes = []
+        for blitz_review in self.blitz_reviews:
+            review = blitz_review.review
+            earlier_reviews = prev_reviews[(review.author_id, review.fic_id)]
+            prev_chapters_reviewed = sum(r.effective_chapters_reviewed() for r in earlier_reviews)
+            effective_chapters_reviewed = blitz_review.effective_chapters_reviewed()
+            weekly_theme = self.themes.get(blitz_review.week_index())
+
+            score = effective_chapters_reviewed * scoring.chapter_points
+
+            if not weekly_theme or weekly_theme.consecutive_chapter_bonus_applies:
+                chapter_bonuses = (effective_chapters_reviewed + prev_chapters_reviewed) // scoring.consecutive_chapter_interval - prev_chapters_reviewed // scoring.consecutive_chapter_interval
+                score += chapter_bonuses * scoring.consecutive_chapter_bonus
+
+            # Whether the review was marked as satisfying the theme is all
+            # we have left of the theme box. That's enough to tell how many
+            # bonuses were claimed, except for a review with no effective
+            # chapters under a theme that covers subsequent chapters, which
+            # is scored as if the box was left unchecked.
+            if weekly_theme:
+                score += scoring.theme_bonus * weekly_theme.claimable_theme_bonuses(blitz_review.theme, blitz_review, earlier_reviews)
+
+            # Only long chapters are linked to reviews
+            for chapter_link in blitz_review.chapter_links.all():
+                if chapter_link.chapter.word_count >= scoring.long_chapter_bonus_words:
+                    score += scoring.long_chapter_bonus
+
+            heat_bonus = decimal.Decimal(0)
+            if scoring.heat_bonus_multiplier:
+                heat_bonus = self.get_heat_bonus(blitz_review, chapters_given, chapters_received, heat_claimed)
+                score += heat_bonus
+
+            changes.append(ScoreChange(blitz_review, blitz_review.score, decimal.Decimal(score).quantize(SCORE_PLACES), blitz_review.heat_bonus, heat_bonus.quantize(HEAT_BONUS_PLACES)))
+
+            # Now this review is part of the history for the ones after it
+            earlier_reviews.append(blitz_review)
+            if heat_bonus > 0:
+                heat_claimed.update((review.author_id, author_id) for author_id in self.fic_authors[review.fic_id])
+            if blitz_review.approved:
+                chapters_given[review.author_id] += effective_chapters_reviewed
+                for author_id in self.fic_authors[review.fic_id]:
+                    chapters_received[author_id] += effective_chapters_reviewed
+
+        return changes
+
+    @transaction.atomic
+    def save(self, changes):
+        """
+        Writes the changed scores from the given ScoreChanges back to the
+        database and updates the leaderboard. Returns the changed reviews.
+
+        """
+        changed = []
+        for change in changes:
+            if change.old_score != change.new_score or change.old_heat_bonus != change.new_heat_bonus:
+                change.blitz_review.score = change.new_score
+                change.blitz_review.heat_bonus = change.new_heat_bonus
+                changed.append(change.blitz_review)
+        BlitzReview.objects.bulk_update(changed, ['score', 'heat_bonus'], batch_size=500)
+        # bulk_update doesn't send signals
+        if changed:
+            LeaderboardEntry.objects.refresh(self.blitz)
+        return changed
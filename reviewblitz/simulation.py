@@ -0,0 +1,237 @@
+"""
+"What if" scoring for Review Blitzes.
+
+Loads a blitz's reviews into NumPy arrays once and then scores them under
+a whole batch of alternative scoring parameters at the same time, so that
+organizers can see how the leaderboard would have come out under (say) a
+grid of a thousand different configurations without a thousand replays
+through the ORM (see BlitzScorer for the one-configuration version).
+
+Everything that doesn't depend on the scoring parameters (submission
+order, who reviewed what, theme claims) is worked out once up front;
+the only per-review loop left is for the heat bonus, which depends on
+the heat bonuses claimed before it, and even that handles every
+configuration at once.
+
+NumPy is optional; it's only needed for this.
+
+"""
+from collections import defaultdict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from reviewblitz.models import BlitzUser
+from reviewblitz.scoring import BlitzScorer
+
+
+# The ReviewBlitzScoring parameters that can be varied, and whether they
+# are whole numbers
+SCORING_PARAMETERS = (
+    ('words_per_chapter', True),
+    ('chapter_points', False),
+    ('consecutive_chapter_interval', True),
+    ('consecutive_chapter_bonus', False),
+    ('theme_bonus', False),
+    ('long_chapter_bonus_words', True),
+    ('long_chapter_bonus', False),
+    ('heat_bonus_multiplier', False),
+    ('max_heat_bonus_tier_0', False),
+    ('heat_bonus_threshold_tier_1', True),
+    ('max_heat_bonus_tier_1', False),
+    ('heat_bonus_threshold_tier_2', True),
+    ('max_heat_bonus', False),
+)
+
+THEME_NONE, THEME_FIXED, THEME_PER_CHAPTER, THEME_SUBSEQUENT_CHAPTERS = range(4)
+
+
+class BlitzSimulation(object):
+    """
+    A blitz's reviews as arrays, ready to be scored under any number of
+    scoring configurations. Configurations are dicts of the parameters in
+    SCORING_PARAMETERS; anything left out is taken from the blitz's own
+    scoring.
+
+    As with BlitzScorer, reviews count towards heat bonuses if they're
+    approved now.
+
+    """
+    def __init__(self, blitz):
+        if np is None:
+            raise ImportError("The blitz simulator needs NumPy (pip install numpy).")
+        self.blitz = blitz
+        self.load()
+
+    def load(self):
+        scorer = BlitzScorer(self.blitz)
+        scorer.load()
+        blitz_reviews = scorer.blitz_reviews
+        n = len(blitz_reviews)
+
+        self.bonus_points = dict(BlitzUser.objects.filter(blitz=self.blitz).values_list('member_id', 'bonus_points'))
+        usernames = {}
+        for blitz_review in blitz_reviews:
+            usernames[blitz_review.review.author_id] = blitz_review.review.author.username
+
+        # Only participants with approved reviews make it onto the
+        # leaderboard
+        self.member_ids = sorted({blitz_review.review.author_id for blitz_review in blitz_reviews if blitz_review.approved and blitz_review.review.author_id in self.bonus_points}, key=lambda member_id: usernames[member_id].lower())
+        self.usernames = [usernames[member_id] for member_id in self.member_ids]
+        leaderboard_index = {member_id: i for i, member_id in enumerate(self.member_ids)}
+
+        self.chapters = np.array([blitz_review.review.chapters for blitz_review in blitz_reviews], dtype=np.int64)
+        self.word_counts = np.array([blitz_review.review.word_count for blitz_review in blitz_reviews], dtype=np.int64)
+        self.approved = np.array([blitz_review.approved for blitz_review in blitz_reviews], dtype=bool)
+
+        # Earlier reviews of the same fic by the same reviewer, for the
+        # consecutive chapter bonus
+        groups = defaultdict(list)
+        for i, blitz_review in enumerate(blitz_reviews):
+            groups[(blitz_review.review.author_id, blitz_review.review.fic_id)].append(i)
+        self.groups = [np.array(indices) for indices in groups.values() if len(indices) > 1]
+
+        # Weekly themes: whether the consecutive chapter bonus applies,
+        # and how theme bonuses are claimed. Apart from per-chapter
+        # themes, the number of bonuses doesn't depend on the scoring.
+        self.consecutive_bonus_applies = np.ones(n, dtype=bool)
+        self.theme_mode = np.full(n, THEME_NONE)
+        self.theme_claims = np.zeros(n, dtype=np.int64)
+        self.theme_box = np.array([blitz_review.theme for blitz_review in blitz_reviews], dtype=np.int64)
+        themed_weeks = defaultdict(set)
+        for i, blitz_review in enumerate(blitz_reviews):
+            week = blitz_review.week_index()
+            weekly_theme = scorer.themes.get(week)
+            key = (blitz_review.review.author_id, blitz_review.review.fic_id)
+            if weekly_theme:
+                self.consecutive_bonus_applies[i] = weekly_theme.consecutive_chapter_bonus_applies
+                if weekly_theme.claimable == 'per_chapter':
+                    self.theme_mode[i] = THEME_SUBSEQUENT_CHAPTERS if weekly_theme.subsequent_chapter_theme_bonus else THEME_PER_CHAPTER
+                elif weekly_theme.claimable in ('per_review', 'per_fic'):
+                    self.theme_mode[i] = THEME_FIXED
+                    if weekly_theme.claimable == 'per_review' or week not in themed_weeks[key]:
+                        self.theme_claims[i] = blitz_review.theme
+            if blitz_review.theme:
+                themed_weeks[key].add(week)
+
+        # Word counts of the (long) chapters linked to each review, padded
+        # with -1
+        links = [[chapter_link.chapter.word_count for chapter_link in blitz_review.chapter_links.all()] for blitz_review in blitz_reviews]
+        self.linked_word_counts = np.full((n, max([len(words) for words in links] + [1])), -1, dtype=np.int64)
+        for i, words in enumerate(links):
+            self.linked_word_counts[i, :len(words)] = words
+
+        # For the heat bonus: for each review, the reviewer, the fic's
+        # participating authors and the (reviewer, author) pairs between
+        # them, all as indices into the state arrays.
+        members = {}
+        pairs = {}
+        self.reviewers = []
+        self.recipients = []
+        for blitz_review in blitz_reviews:
+            reviewer = members.setdefault(blitz_review.review.author_id, len(members))
+            authors = [members.setdefault(author_id, len(members)) for author_id in sorted(scorer.fic_authors[blitz_review.review.fic_id])]
+            recipients = [(author, pairs.setdefault((reviewer, author), len(pairs))) for author_id, author in zip(sorted(scorer.fic_authors[blitz_review.review.fic_id]), authors) if author_id in scorer.participants]
+            self.reviewers.append((reviewer, authors))
+            self.recipients.append(recipients)
+        self.member_count = len(members)
+        self.pair_count = len(pairs)
+
+        # Which leaderboard entry each approved review counts towards
+        self.leaderboard_entry = np.array([leaderboard_index.get(blitz_review.review.author_id, -1) if blitz_review.approved else -1 for blitz_review in blitz_reviews], dtype=np.int64)
+        self.leaderboard_bonus = np.array([float(self.bonus_points[member_id] or 0) for member_id in self.member_ids])
+
+    def get_parameters(self, configs):
+        """
+        Returns the given configurations as a dict of column vectors (one
+        row per configuration), filling in the blitz's own scoring for
+        anything they leave out.
+
+        """
+        parameters = {}
+        for name, integer in SCORING_PARAMETERS:
+            default = getattr(self.blitz.scoring, name)
+            values = [config.get(name, default) for config in configs]
+            parameters[name] = np.array(values, dtype=np.int64 if integer else np.float64).reshape(-1, 1)
+        return parameters
+
+    def get_heat_bonus(self, p, given, received):
+        cap = np.where(given < p['heat_bonus_threshold_tier_1'][:, 0], p['max_heat_bonus_tier_0'][:, 0], np.where(given < p['heat_bonus_threshold_tier_2'][:, 0], p['max_heat_bonus_tier_1'][:, 0], p['max_heat_bonus'][:, 0]))
+        base_bonus = np.minimum((given + 1) / (received + 1) * p['heat_bonus_multiplier'][:, 0] - 1, cap)
+        # Round to the nearest half-point (truncating like int() does)
+        bonus = np.trunc(base_bonus * 2 + 0.5) / 2
+        return np.where(given > received, bonus, 0)
+
+    def score(self, configs):
+        """
+        Scores every review under each of the given configurations and
+        returns a (configurations x reviews) array of scores.
+
+        """
+        p = self.get_parameters(configs)
+        k, n = len(configs), len(self.chapters)
+
+        effective_chapters = np.minimum(self.chapters, self.word_counts // p['words_per_chapter'])
+        scores = effective_chapters * p['chapter_points']
+
+        prev_chapters = np.zeros((k, n), dtype=np.int64)
+        for indices in self.groups:
+            totals = np.cumsum(effective_chapters[:, indices], axis=1)
+            prev_chapters[:, indices] = totals - effective_chapters[:, indices]
+        interval = p['consecutive_chapter_interval']
+        chapter_bonuses = (effective_chapters + prev_chapters) // interval - prev_chapters // interval
+        scores += np.where(self.consecutive_bonus_applies, chapter_bonuses, 0) * p['consecutive_chapter_bonus']
+
+        theme_claims = np.select(
+            [self.theme_mode == THEME_SUBSEQUENT_CHAPTERS, self.theme_mode == THEME_PER_CHAPTER],
+            [self.theme_box + effective_chapters - 1, effective_chapters * self.theme_box],
+            self.theme_claims,
+        )
+        scores += theme_claims * p['theme_bonus']
+
+        long_chapters = (self.linked_word_counts[np.newaxis, :, :] >= p['long_chapter_bonus_words'][:, :, np.newaxis]).sum(axis=2)
+        scores += long_chapters * p['long_chapter_bonus']
+
+        scores += self.get_heat_bonuses(p, effective_chapters)
+        return scores
+
+    def get_heat_bonuses(self, p, effective_chapters):
+        k, n = effective_chapters.shape
+        heat_bonuses = np.zeros((k, n))
+        if not p['heat_bonus_multiplier'].any():
+            return heat_bonuses
+
+        given = np.zeros((k, self.member_count), dtype=np.int64)
+        received = np.zeros((k, self.member_count), dtype=np.int64)
+        claimed = np.zeros((k, self.pair_count), dtype=bool)
+        for i in range(n):
+            (reviewer, authors), recipients = self.reviewers[i], self.recipients[i]
+            if recipients:
+                bonus = np.zeros(k)
+                for author, pair in recipients:
+                    bonus = np.maximum(bonus, np.where(claimed[:, pair], 0, self.get_heat_bonus(p, given[:, author], received[:, author])))
+                bonus[p['heat_bonus_multiplier'][:, 0] == 0] = 0
+                heat_bonuses[:, i] = bonus
+                for author, pair in recipients:
+                    claimed[:, pair] |= bonus > 0
+            if self.approved[i]:
+                given[:, reviewer] += effective_chapters[:, i]
+                for author in authors:
+                    received[:, author] += effective_chapters[:, i]
+        return heat_bonuses
+
+    def get_leaderboards(self, scores):
+        """
+        Returns the points (configurations x participants, in the order of
+        self.usernames) and the ranks (1 + the number of participants with
+        more points) on each configuration's leaderboard.
+
+        """
+        counted = self.leaderboard_entry >= 0
+        points = np.zeros((scores.shape[0], len(self.member_ids)))
+        np.add.at(points.T, self.leaderboard_entry[counted], np.round(scores[:, counted], 2).T)
+        points += self.leaderboard_bonus
+        ranks = 1 + (points[:, np.newaxis, :] > points[:, :, np.newaxis]).sum(axis=2)
+        return points, ranks
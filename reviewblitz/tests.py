@@ -1,3 +1,398 @@
-from django.test import TestCase
+import copy
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+from unittest import mock, skipUnless
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django.test import TestCase, override_settings
+from forum.models import Chapter, Fic, Member, Review
+from reviewblitz.models import (
+    BlitzReview, BlitzUser, LeaderboardEntry, ReviewBlitz, ReviewBlitzScoring, ReviewBlitzTheme, ReviewChapterLink, WeeklyTheme,
+    clear_current_blitz_cache, get_leaderboard_heat_bonus,
+)
+from reviewblitz.scoring import BlitzScorer
+from reviewblitz.simulation import SCORING_PARAMETERS, BlitzSimulation, np
 
-# Create your tests here.
+
+BLITZ_START = datetime(2024, 6, 1, tzinfo=timezone.utc)
+
+
+class BlitzTestMixin(object):
+    """
+    Builds blitzes, members, fics and reviews for tests. Reviews are
+    approved and score a point per effective chapter unless told
+    otherwise.
+
+    """
+    def setUp(self):
+        clear_current_blitz_cache()
+
+    def create_scoring(self, **kwargs):
+        fields = dict(
+            name="Test scoring",
+            min_words=100,
+            words_per_chapter=100,
+            chapter_points=1,
+            consecutive_chapter_interval=5,
+            consecutive_chapter_bonus=0,
+            theme_bonus=0,
+            long_chapter_bonus_words=5000,
+            long_chapter_bonus=0,
+            heat_bonus_multiplier=1,
+            max_heat_bonus_tier_0=Decimal('0.5'),
+            heat_bonus_threshold_tier_1=5,
+            max_heat_bonus_tier_1=Decimal('1.5'),
+            heat_bonus_threshold_tier_2=20,
+            max_heat_bonus=3,
+        )
+        fields.update(kwargs)
+        return ReviewBlitzScoring.objects.create(**fields)
+
+    def create_blitz(self, scoring=None, start_date=BLITZ_START):
+        return ReviewBlitz.objects.create(title="Test blitz", start_date=start_date, end_date=start_date + timedelta(days=28), scoring=scoring or self.create_scoring())
+
+    def create_member(self, user_id, blitz=None):
+        member = Member.objects.create(user_id=user_id, username="Member%s" % user_id)
+        if blitz is not None:
+            BlitzUser.objects.create(blitz=blitz, member=member)
+        return member
+
+    def create_fic(self, *authors):
+        fic = Fic.objects.create(title="Fic by %s" % ", ".join(str(author) for author in authors), thread_id=Fic.objects.count() + 1, posted_date=BLITZ_START - timedelta(days=365))
+        fic.authors.add(*authors)
+        return fic
+
+    def create_review(self, blitz, author, fic, chapters=1, word_count=100, posted_date=None, approved=True, heat_bonus=0):
+        review = Review.objects.create(
+            post_id=Review.objects.count() + 1,
+            author=author,
+            fic=fic,
+            posted_date=posted_date or blitz.start_date + timedelta(days=1),
+            word_count=word_count,
+            chapters=chapters,
+        )
+        return BlitzReview.objects.create(blitz=blitz, review=review, score=min(chapters, word_count // blitz.scoring.words_per_chapter), approved=approved, heat_bonus=heat_bonus)
+
+    def get_entry(self, member):
+        return LeaderboardEntry.objects.filter(blitz_user__member=member).first()
+
+
+class LeaderboardSignalTests(BlitzTestMixin, TestCase):
+    def setUp(self):
+        super(LeaderboardSignalTests, self).setUp()
+        self.blitz = self.create_blitz()
+        self.reviewer = self.create_member(1, self.blitz)
+        self.author = self.create_member(2, self.blitz)
+        self.coauthor = self.create_member(3, self.blitz)
+        self.fic = self.create_fic(self.author)
+        self.blitz_review = self.create_review(self.blitz, self.reviewer, self.fic, chapters=3, word_count=300)
+
+    def test_review_edit_updates_leaderboard(self):
+        review = self.blitz_review.review
+        review.chapters = 2
+        review.save()
+
+        entry = self.get_entry(self.reviewer)
+        self.assertEqual((entry.chapters, entry.words, entry.effective_chapters), (2, 300, 2))
+
+    def test_fic_author_changes_update_received_chapters(self):
+        self.create_review(self.blitz, self.coauthor, self.create_fic(self.reviewer))
+        self.assertEqual(self.get_entry(self.coauthor).effective_chapters_received, 0)
+
+        self.fic.authors.add(self.coauthor)
+        self.assertEqual(self.get_entry(self.coauthor).effective_chapters_received, 3)
+
+        self.coauthor.fics.remove(self.fic)
+        self.assertEqual(self.get_entry(self.coauthor).effective_chapters_received, 0)
+
+        self.fic.authors.add(self.coauthor)
+        self.fic.authors.clear()
+        self.assertEqual(self.get_entry(self.coauthor).effective_chapters_received, 0)
+        self.assertEqual(self.get_entry(self.author), None)
+
+    def test_blitz_user_delete_removes_entry(self):
+        BlitzUser.objects.get(blitz=self.blitz, member=self.reviewer).delete()
+        self.assertFalse(LeaderboardEntry.objects.filter(blitz=self.blitz, blitz_user__member=self.reviewer).exists())
+
+    def test_refresh_matches_signals(self):
+        self.create_review(self.blitz, self.author, self.create_fic(self.reviewer, self.coauthor), chapters=2, word_count=150)
+        entries = {entry.blitz_user_id: (entry.points, entry.effective_chapters, entry.effective_chapters_received, entry.heat_bonus) for entry in LeaderboardEntry.objects.all()}
+
+        LeaderboardEntry.objects.all().delete()
+        LeaderboardEntry.objects.refresh(self.blitz)
+        self.assertEqual({entry.blitz_user_id: (entry.points, entry.effective_chapters, entry.effective_chapters_received, entry.heat_bonus) for entry in LeaderboardEntry.objects.all()}, entries)
+
+
+    def test_migration_fills_leaderboard_like_refresh(self):
+        self.create_review(self.blitz, self.author, self.create_fic(self.reviewer, self.coauthor), chapters=2, word_count=150)
+        BlitzUser.objects.filter(member=self.reviewer).update(bonus_points=Decimal('1.5'))
+        LeaderboardEntry.objects.refresh(self.blitz)
+        entries = {entry.blitz_user_id: (entry.points, entry.reviews, entry.effective_chapters, entry.effective_chapters_received, entry.heat_bonus) for entry in LeaderboardEntry.objects.all()}
+
+        LeaderboardEntry.objects.all().delete()
+        migration = import_module('reviewblitz.migrations.0017_fill_leaderboardentry')
+        state = MigrationLoader(connection).project_state(('reviewblitz', '0017_fill_leaderboardentry'))
+        migration.fill_leaderboards(state.apps, None)
+        self.assertEqual({entry.blitz_user_id: (entry.points, entry.reviews, entry.effective_chapters, entry.effective_chapters_received, entry.heat_bonus) for entry in LeaderboardEntry.objects.all()}, entries)
+
+class HeatBonusTests(BlitzTestMixin, TestCase):
+    """
+    The heat bonus for reviewing an author, with a multiplier of 1 and
+    caps of 0.5, 1.5 (from 5 effective chapters given) and 3 (from 20).
+
+    """
+    def setUp(self):
+        super(HeatBonusTests, self).setUp()
+        self.blitz = self.create_blitz()
+        self.reviewer = self.create_member(1, self.blitz)
+        # Someone outside the blitz, to be reviewed by the authors
+        self.outsider = self.create_member(99)
+        self.outsider_fic = self.create_fic(self.outsider)
+
+    def create_author(self, user_id, given=0, received=0, blitz=None):
+        """
+        Returns a participating author who has given and received the
+        given numbers of effective chapters of reviews.
+
+        """
+        blitz = blitz or self.blitz
+        author = self.create_member(user_id, blitz)
+        if given:
+            self.create_review(blitz, author, self.outsider_fic, chapters=given, word_count=given * 100)
+        if received:
+            self.create_review(blitz, self.outsider, self.create_fic(author), chapters=received, word_count=received * 100)
+        return author
+
+    def submit(self, fic, **kwargs):
+        # Submitted reviews aren't approved yet
+        return self.create_review(self.blitz, self.reviewer, fic, approved=False, **kwargs)
+
+    def assertHeatBonus(self, fic, expected):
+        self.assertEqual(self.submit(fic).calculate_heat_bonus(), Decimal(expected))
+
+    def test_tier_thresholds(self):
+        # (given, received): (given + 1) / (received + 1) - 1, capped by
+        # tier and rounded to the nearest half-point
+        for user_id, (given, received, expected) in enumerate([
+            (4, 0, '0.5'),  # 4, just under tier 1
+            (5, 0, '1.5'),  # 5, just inside tier 1
+            (19, 0, '1.5'),  # 19, just under tier 2
+            (20, 0, '3'),  # 20, just inside tier 2
+            (6, 2, '1.5'),  # 1.33
+            (10, 5, '1'),  # 0.83
+            (6, 3, '1'),  # 0.75, rounded up
+            (3, 3, '0'),  # Received as many as given
+            (2, 5, '0'),
+        ], start=10):
+            with self.subTest(given=given, received=received):
+                self.assertHeatBonus(self.create_fic(self.create_author(user_id, given, received)), expected)
+
+    def test_multi_author_fic_takes_biggest_bonus(self):
+        fic = self.create_fic(self.create_author(10, 3, 3), self.create_author(11, 6, 2), self.create_author(12, 4, 0), self.create_member(13))
+        self.assertHeatBonus(fic, '1.5')
+
+    def test_only_approved_reviews_in_this_blitz_count(self):
+        author = self.create_author(10, 4, 0)
+        # A review given in another blitz, and one not yet approved
+        other_blitz = self.create_blitz(self.blitz.scoring, BLITZ_START - timedelta(days=60))
+        BlitzUser.objects.create(blitz=other_blitz, member=author)
+        self.create_review(other_blitz, author, self.outsider_fic, chapters=10, word_count=1000)
+        self.create_review(self.blitz, author, self.outsider_fic, chapters=10, word_count=1000, approved=False)
+        # Words short of a chapter don't count
+        self.create_review(self.blitz, self.outsider, self.create_fic(author), chapters=3, word_count=99)
+        self.assertHeatBonus(self.create_fic(author), '0.5')
+
+    def test_no_double_dipping(self):
+        author = self.create_author(10, 6, 2)
+        coauthor = self.create_author(11, 4, 0)
+        fic = self.create_fic(author)
+        self.submit(fic, heat_bonus=Decimal('1.5'))
+        self.assertHeatBonus(fic, '0')
+        # Another fic by the same author doesn't get one either
+        self.assertHeatBonus(self.create_fic(author), '0')
+        # But a coauthor we haven't had a bonus for does
+        self.assertHeatBonus(self.create_fic(author, coauthor), '0.5')
+
+    def test_leaderboard_heat_bonus(self):
+        for (given, received), expected in [
+            ((4, 0), '0.5'),
+            ((5, 0), '1.5'),
+            ((20, 1), '3'),
+            ((10, 4), '1'),  # 1.2
+            ((4, 3), '0.5'),  # 0.25, rounded half up
+            ((2, 5), '0'),
+        ]:
+            with self.subTest(given=given, received=received):
+                self.assertEqual(get_leaderboard_heat_bonus(self.blitz.scoring, given, received), Decimal(expected))
+
+    def test_leaderboard_entries(self):
+        authors = [self.create_author(10, 4, 0), self.create_author(11, 5, 0), self.create_author(12, 10, 4)]
+        self.assertEqual([self.get_entry(author).heat_bonus for author in authors], [Decimal('0.5'), Decimal('1.5'), Decimal('1')])
+
+
+class BlitzScorerTests(BlitzTestMixin, TestCase):
+    def setUp(self):
+        super(BlitzScorerTests, self).setUp()
+        self.blitz = self.create_blitz(self.create_scoring(consecutive_chapter_interval=2, consecutive_chapter_bonus=Decimal('0.5')))
+        self.reviewer = self.create_member(1, self.blitz)
+        author = self.create_member(2, self.blitz)
+        outsider = self.create_member(99)
+        fic = self.create_fic(author)
+        # Stored scores are just the effective chapters, without bonuses
+        self.blitz_reviews = [
+            self.create_review(self.blitz, author, self.create_fic(outsider), chapters=4, word_count=400),
+            self.create_review(self.blitz, self.reviewer, fic),
+            self.create_review(self.blitz, self.reviewer, fic),
+            self.create_review(self.blitz, self.reviewer, fic, chapters=3, word_count=150, approved=False),
+        ]
+
+    def test_replay(self):
+        changes = BlitzScorer(self.blitz).replay()
+        self.assertEqual([change.blitz_review.pk for change in changes], [blitz_review.pk for blitz_review in self.blitz_reviews])
+        self.assertEqual([(change.new_score, change.new_heat_bonus) for change in changes], [
+            # 4 chapters, with 2 consecutive chapter bonuses; the fic's
+            # author isn't in the blitz
+            (Decimal('5.00'), Decimal('0.0')),
+            # The author has given 4 chapters and received none
+            (Decimal('1.50'), Decimal('0.5')),
+            # A consecutive chapter bonus, but no second heat bonus
+            (Decimal('1.50'), Decimal('0.0')),
+            # One effective chapter, not enough for another bonus
+            (Decimal('1.00'), Decimal('0.0')),
+        ])
+
+    def test_replay_under_other_scoring(self):
+        scoring = self.create_scoring(chapter_points=2, heat_bonus_multiplier=0)
+        changes = BlitzScorer(self.blitz, scoring).replay()
+        self.assertEqual([change.new_score for change in changes], [Decimal(8), Decimal(2), Decimal(2), Decimal(2)])
+
+    def test_command_only_writes_when_asked(self):
+        call_command('recompute_blitz_scores', self.blitz.pk, stdout=StringIO())
+        self.assertEqual([blitz_review.score for blitz_review in BlitzReview.objects.order_by('id')], [4, 1, 1, 1])
+
+        call_command('recompute_blitz_scores', self.blitz.pk, write=True, stdout=StringIO())
+        self.assertEqual([blitz_review.score for blitz_review in BlitzReview.objects.order_by('id')], [Decimal('5'), Decimal('1.5'), Decimal('1.5'), 1])
+        self.assertEqual(self.get_entry(self.reviewer).points, Decimal('3'))
+
+
+class CurrentBlitzCacheTests(BlitzTestMixin, TestCase):
+    def setUp(self):
+        super(CurrentBlitzCacheTests, self).setUp()
+        self.blitz = self.create_blitz()
+        ReviewBlitz.get_current()
+
+    def test_cached(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(ReviewBlitz.get_current(), self.blitz)
+
+    def test_saving_blitz_clears(self):
+        self.blitz.title = "Renamed"
+        self.blitz.save()
+        self.assertEqual(ReviewBlitz.get_current().title, "Renamed")
+        newer = self.create_blitz(start_date=BLITZ_START + timedelta(days=60))
+        self.assertEqual(ReviewBlitz.get_current(), newer)
+
+    def test_saving_theme_clears(self):
+        theme = WeeklyTheme.objects.create(name="One-Shot Week", description="", notes="")
+        ReviewBlitzTheme.objects.create(blitz=self.blitz, theme=theme, week=1)
+        self.assertEqual([blitz_theme.theme.name for blitz_theme in ReviewBlitz.get_current().weekly_themes.all()], ["One-Shot Week"])
+        theme.name = "Long Fic Week"
+        theme.save()
+        self.assertEqual([blitz_theme.theme.name for blitz_theme in ReviewBlitz.get_current().weekly_themes.all()], ["Long Fic Week"])
+
+    def test_saving_scoring_clears(self):
+        self.blitz.scoring.chapter_points = 3
+        self.blitz.scoring.save()
+        self.assertEqual(ReviewBlitz.get_current().scoring.chapter_points, 3)
+
+    @override_settings(CURRENT_BLITZ_CACHE_TTL=30)
+    def test_expires(self):
+        clear_current_blitz_cache()
+        now = time.monotonic()
+        with mock.patch('reviewblitz.models.time.monotonic', return_value=now):
+            ReviewBlitz.get_current()
+        # Updating doesn't send signals, like a change made in another
+        # process
+        ReviewBlitz.objects.filter(pk=self.blitz.pk).update(title="Renamed")
+        with mock.patch('reviewblitz.models.time.monotonic', return_value=now + 29):
+            self.assertEqual(ReviewBlitz.get_current().title, self.blitz.title)
+        with mock.patch('reviewblitz.models.time.monotonic', return_value=now + 31):
+            self.assertEqual(ReviewBlitz.get_current().title, "Renamed")
+
+
+@skipUnless(np, "The blitz simulator needs NumPy.")
+class BlitzSimulationTests(BlitzTestMixin, TestCase):
+    CONFIGS = [
+        {},
+        {'chapter_points': 2, 'theme_bonus': 1.5},
+        {'consecutive_chapter_interval': 2, 'consecutive_chapter_bonus': 1},
+        {'words_per_chapter': 120, 'long_chapter_bonus_words': 1000, 'long_chapter_bonus': 2},
+        {'heat_bonus_multiplier': 2, 'heat_bonus_threshold_tier_1': 2, 'max_heat_bonus_tier_1': 2.5, 'heat_bonus_threshold_tier_2': 10, 'max_heat_bonus': 5},
+        {'heat_bonus_multiplier': 0},
+    ]
+
+    def setUp(self):
+        super(BlitzSimulationTests, self).setUp()
+        self.blitz = self.create_blitz(self.create_scoring(theme_bonus=1, consecutive_chapter_interval=3, consecutive_chapter_bonus=Decimal('0.5'), long_chapter_bonus=1))
+        for week, (claimable, subsequent, consecutive) in enumerate([('per_chapter', False, True), ('per_chapter', True, False), ('per_fic', False, True), ('per_review', False, True)], start=1):
+            theme = WeeklyTheme.objects.create(name="Week %s" % week, description="", notes="", claimable=claimable, subsequent_chapter_theme_bonus=subsequent, consecutive_chapter_bonus_applies=consecutive)
+            ReviewBlitzTheme.objects.create(blitz=self.blitz, theme=theme, week=week)
+
+        reviewer = self.create_member(1, self.blitz)
+        BlitzUser.objects.filter(member=reviewer).update(bonus_points=7)
+        # Authors who give 6, 25 and 1 chapters of reviews, for heat bonus
+        # tiers
+        authors = [self.create_member(user_id, self.blitz) for user_id in (2, 3, 4)]
+        outsider_fic = self.create_fic(self.create_member(99))
+        fics = [self.create_fic(authors[0]), self.create_fic(authors[1]), self.create_fic(authors[1], authors[2]), self.create_fic(authors[0])]
+
+        def review(author, fic, chapters, words, week, theme=False, approved=True, long_chapters=()):
+            blitz_review = self.create_review(self.blitz, author, fic, chapters=chapters, word_count=words, posted_date=BLITZ_START + timedelta(days=7 * week - 6), approved=approved)
+            blitz_review.theme = theme
+            blitz_review.save()
+            for words in long_chapters:
+                chapter = Chapter.objects.create(post_id=1000 + Chapter.objects.count(), fic=fic, threadmark_title="", posted_date=BLITZ_START, word_count=words)
+                ReviewChapterLink.objects.create(review=blitz_review, chapter=chapter)
+
+        review(authors[0], outsider_fic, 6, 600, 1, theme=True)
+        review(authors[1], outsider_fic, 25, 2500, 1)
+        review(authors[2], outsider_fic, 1, 100, 2, theme=True)
+        review(reviewer, fics[0], 2, 250, 1, theme=True, long_chapters=(6000,))
+        review(reviewer, fics[0], 3, 300, 2, theme=True)
+        review(reviewer, fics[1], 1, 100, 3, theme=True)
+        review(reviewer, fics[1], 1, 100, 3, theme=True)
+        review(reviewer, fics[2], 2, 200, 4, theme=True)
+        review(reviewer, fics[0], 1, 100, 4, approved=False)
+        review(authors[2], fics[3], 2, 250, 2, long_chapters=(1200, 7000))
+
+    def get_scoring(self, config):
+        scoring = copy.copy(self.blitz.scoring)
+        for name, integer in SCORING_PARAMETERS:
+            if name in config:
+                setattr(scoring, name, config[name] if integer else Decimal(str(config[name])))
+        return scoring
+
+    def test_matches_replay(self):
+        simulation = BlitzSimulation(self.blitz)
+        scores = simulation.score(self.CONFIGS)
+        for config, config_scores in zip(self.CONFIGS, scores):
+            with self.subTest(config=config):
+                changes = BlitzScorer(self.blitz, self.get_scoring(config)).replay()
+                self.assertEqual([round(score, 2) for score in config_scores.tolist()], [float(change.new_score) for change in changes])
+
+    def test_leaderboards_match_replay(self):
+        simulation = BlitzSimulation(self.blitz)
+        points, ranks = simulation.get_leaderboards(simulation.score(self.CONFIGS))
+        bonus_points = dict(BlitzUser.objects.filter(blitz=self.blitz).values_list('member__username', 'bonus_points'))
+        for config, config_points, config_ranks in zip(self.CONFIGS, points, ranks):
+            expected = {username: float(bonus_points[username]) for username in simulation.usernames}
+            for change in BlitzScorer(self.blitz, self.get_scoring(config)).replay():
+                if change.blitz_review.approved:
+                    expected[change.blitz_review.review.author.username] += float(change.new_score)
+            with self.subTest(config=config):
+                self.assertEqual([round(value, 2) for value in config_points.tolist()], [round(expected[username], 2) for username in simulation.usernames])
+                self.assertEqual(config_ranks.tolist(), [1 + sum(other > expected[username] for other in expected.values()) for username in simulation.usernames])
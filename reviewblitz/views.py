@@ -1,6 +1,7 @@
 import urllib
 
 from django.conf import settings
+from django.db import transaction
 from django.db.models import Sum
 from django.http import HttpResponseRedirect
 from django.urls import reverse
@@ -20,6 +21,7 @@ class BlitzReviewSubmissionFormView(LoginRequiredMixin, VerificationRequiredMixi
     form_class = BlitzReviewSubmissionForm
     template_name = "blitz_review_submit.html"
 
+    @transaction.atomic
     def form_valid(self, form):
         review = form.cleaned_data["review"]
         review.chapters = form.cleaned_data["chapters"]
@@ -126,6 +128,7 @@ class BlitzReviewApprovalQueueView(PermissionRequiredMixin, ListView):
     def get_queryset(self):
         return BlitzReview.objects.filter(approved=False, blitz=ReviewBlitz.get_current())
 
+    @transaction.atomic
     def post(self, request, *args, **kwargs):
         blitz_review_obj = BlitzReview.objects.get(id=request.POST.get("blitz_review_id"))
         if request.POST.get("valid"):